@@ -0,0 +1,137 @@
+import asyncio
+from collections import deque
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from config import config
+from lazy import Lazy
+
+# Admission control: each class of requests runs at most `concurrency` at a time, the next ones wait in a bounded
+# queue and are answered 503 right away when it's full (or after waiting `timeout` seconds). A spike of one class
+# (a login storm, a bulk import) sheds its own excess instead of making every request wait for the database.
+
+AUTH_PATHS = {"/token", "/register"}
+# always admitted, we need them the most when the service is overloaded
+EXEMPT_PATHS = {"/metrics"}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Limiter:
+    def __init__(self, concurrency: int, max_queue: int, timeout: float):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        # first come, first served. A released slot goes straight to the next waiter
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise Overloaded
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except TimeoutError:
+            self._discard(future)
+            self.rejected["timeout"] += 1
+            raise Overloaded
+        except asyncio.CancelledError:
+            # the client went away, give back the slot if it was already handed over
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._discard(future)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, future: asyncio.Future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+def create_limiters() -> dict[str, Limiter]:
+    timeout = config.ADMISSION_QUEUE_TIMEOUT_SECONDS
+    return {
+        "auth": Limiter(config.ADMISSION_AUTH_CONCURRENCY, config.ADMISSION_AUTH_QUEUE, timeout),
+        "write": Limiter(config.ADMISSION_WRITE_CONCURRENCY, config.ADMISSION_WRITE_QUEUE, timeout),
+        "read": Limiter(config.ADMISSION_READ_CONCURRENCY, config.ADMISSION_READ_QUEUE, timeout),
+    }
+
+
+limiters = Lazy(create_limiters)
+
+
+def request_class(method: str, path: str) -> str | None:
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS:
+        return "auth"
+    return "read" if method in READ_METHODS else "write"
+
+
+# pure ASGI like MetricsMiddleware, added before it so the 503s show up in http_requests_total
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+        name = request_class(scope["method"], scope["path"])
+        limiter = limiters.get(name) if name else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except Overloaded:
+            response = JSONResponse(
+                {"detail": "Too many requests in progress, try again later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(config.ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -0,0 +1,77 @@
+# Rows per second of `manage.py import` for every table, indexes rebuilt after the load vs kept up to date row by row.
+#   python -m benchmarks.bulk_import [--users 10000] [--posts 200000] [--comments 200000] [--likes 300000]
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+
+from benchmarks.common import Timer, use_temporary_database
+
+use_temporary_database()
+
+import security  # noqa: E402
+from bulk_import import ImportFormat, ImportTable, import_rows, read_rows  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+TOPICS = ["cats", "dogs", "sqlite", "python"]
+
+
+def ndjson(rows) -> bytes:
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+def dataset(args) -> dict[ImportTable, bytes]:
+    random.seed(0)
+    # a single bcrypt for everyone, the import never hashes
+    password = security.get_password_hash("1234")
+    likes = set()
+    while len(likes) < args.likes:
+        likes.add((random.randint(1, args.posts), random.randint(1, args.users)))
+    return {
+        ImportTable.users: ndjson(
+            {"id": i, "email": f"user{i}@example.net", "password": password} for i in range(1, args.users + 1)
+        ),
+        ImportTable.posts: ndjson(
+            {"id": i, "body": f"Post {i} about {random.choice(TOPICS)}", "user_id": random.randint(1, args.users)}
+            for i in range(1, args.posts + 1)
+        ),
+        ImportTable.comments: ndjson(
+            {"body": f"Comment {i}", "post_id": random.randint(1, args.posts), "user_id": random.randint(1, args.users)}
+            for i in range(args.comments)
+        ),
+        ImportTable.likes: ndjson(
+            {"post_id": post_id, "user_id": user_id, "created_at": None} for post_id, user_id in likes
+        ),
+    }
+
+
+def load(files: dict[ImportTable, bytes], rebuild_indexes: bool) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="socialapi-bench-"), "import.db")
+    migrate(path)
+    results = {}
+    for table, content in files.items():
+        rows = read_rows(io.BytesIO(content), ImportFormat.ndjson)
+        with Timer() as timer:
+            imported = import_rows(path, table, rows, rebuild_indexes=rebuild_indexes)
+        results[table.value] = {"rows": imported, "rows_per_s": round(imported / timer.elapsed)}
+    return results
+
+
+def main(args):
+    files = dataset(args)
+    results = {
+        "rebuild_indexes": load(files, rebuild_indexes=True),
+        "keep_indexes": load(files, rebuild_indexes=False),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=200000)
+    parser.add_argument("--comments", type=int, default=200000)
+    parser.add_argument("--likes", type=int, default=300000)
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+# Items per second through the per-item endpoints vs the bulk ones.
+#   python -m benchmarks.bulk_writes [--items 2000] [--batch 500]
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import Timer, use_temporary_database
+
+use_temporary_database()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+import security  # noqa: E402
+from database import database, post_table, setup_schema, user_table  # noqa: E402
+from main import app  # noqa: E402
+
+
+async def seed_users(users: int) -> list[str]:
+    password = security.get_password_hash("1234")
+    await database.execute_many(
+        user_table.insert(), [{"email": f"bulk{i}@example.net", "password": password} for i in range(users)]
+    )
+    return [security.create_access_token(f"bulk{i}@example.net") for i in range(users)]
+
+
+async def one_by_one(client: AsyncClient, path: str, items: list[dict], headers: dict):
+    for item in items:
+        await client.post(path, json=item, headers=headers)
+
+
+async def in_batches(client: AsyncClient, path: str, items: list[dict], headers: dict, batch: int):
+    for start in range(0, len(items), batch):
+        await client.post(f"{path}/bulk", json=items[start:start + batch], headers=headers)
+
+
+async def compare(client: AsyncClient, path: str, single_items, bulk_items, headers: dict, batch: int) -> dict:
+    with Timer() as single:
+        await one_by_one(client, path, single_items, headers)
+    with Timer() as bulk:
+        await in_batches(client, path, bulk_items, headers, batch)
+    single_rate = len(single_items) / single.elapsed
+    bulk_rate = len(bulk_items) / bulk.elapsed
+    return {"single_per_s": single_rate, "bulk_per_s": bulk_rate, "speedup": bulk_rate / single_rate}
+
+
+async def main(args):
+    setup_schema()
+    await database.connect()
+    tokens = await seed_users(2)
+    headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+    results = {}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        posts = [{"body": f"Post {i}"} for i in range(args.items)]
+        results["posts"] = await compare(client, "/posts", posts, posts, headers[0], args.batch)
+
+        post_ids = [row.id for row in await database.fetch_all(post_table.select().limit(args.items))]
+        comments = [{"body": "Comment", "post_id": post_id} for post_id in post_ids]
+        results["comments"] = await compare(client, "/comments", comments, comments, headers[0], args.batch)
+
+        # every user can like a post once, each side likes with its own user
+        likes = [{"post_id": post_id} for post_id in post_ids]
+        with Timer() as single:
+            await one_by_one(client, "/like", likes, headers[0])
+        with Timer() as bulk:
+            await in_batches(client, "/like", likes, headers[1], args.batch)
+        results["likes"] = {
+            "single_per_s": len(likes) / single.elapsed,
+            "bulk_per_s": len(likes) / bulk.elapsed,
+            "speedup": single.elapsed / bulk.elapsed,
+        }
+    await database.disconnect()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,65 @@
+# Hundreds of clients reading the same post and the same feed page at once, with and without single-flight.
+#   python -m benchmarks.coalescing [--requests 2000] [--concurrency 200]
+# The feed cache is disabled so every GET /posts would reach the database.
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import percentiles, use_temporary_database
+
+use_temporary_database()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from config import config  # noqa: E402
+from database import database, post_table, setup_schema, user_table  # noqa: E402
+from main import app, lifespan  # noqa: E402
+from singleflight import single_flight  # noqa: E402
+
+
+async def seed(posts: int):
+    user_id = await database.execute(user_table.insert().values(email="hot@example.net", password="-"))
+    await database.execute_many(post_table.insert(), [{"body": f"Post {i}", "user_id": user_id} for i in range(posts)])
+
+
+async def run(client: AsyncClient, url: str, params: dict, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def get():
+        async with semaphore:
+            start = time.perf_counter()
+            await client.get(url, params=params)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(get() for _ in range(requests)))
+    return {"requests_per_s": requests / (time.perf_counter() - start), **percentiles(latencies)}
+
+
+async def main(args):
+    setup_schema()
+    config.FEED_CACHE_ENABLED = False
+    results = {}
+    async with lifespan(app):
+        await seed(posts=1000)
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            for enabled in (False, True):
+                config.SINGLE_FLIGHT_ENABLED = enabled
+                name = "single_flight" if enabled else "every_request_queries"
+                results[name] = {
+                    "GET /posts/{post_id}": await run(client, "/posts/500", {}, args.requests, args.concurrency),
+                    "GET /posts?sorting=most_likes": await run(
+                        client, "/posts", {"sorting": "most_likes", "limit": 100}, args.requests, args.concurrency
+                    ),
+                }
+    results["queries_saved"] = single_flight.stats()["shared"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
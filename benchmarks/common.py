@@ -0,0 +1,39 @@
+import os
+import statistics
+import tempfile
+import time
+
+
+# The app reads its config the first time it's used, benchmarks call this before touching anything from it.
+# Every run gets its own throwaway sqlite file.
+def use_temporary_database() -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="socialapi-bench-"), "bench.db")
+    os.environ["ENV_STATE"] = "test"
+    os.environ["TEST_DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["TEST_DB_FORCE_ROLL_BACK"] = "false"
+    return path
+
+
+def percentiles(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
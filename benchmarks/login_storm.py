@@ -0,0 +1,85 @@
+# Feed latency while a burst of logins is hashing passwords.
+#   python -m benchmarks.login_storm [--logins 200] [--concurrency 32]
+# "inline" runs bcrypt on the event loop (HASHING_WORKERS=0, the old behaviour), "pool" in the hashing thread pool.
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import percentiles, use_temporary_database
+
+use_temporary_database()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+import security  # noqa: E402
+from database import database, post_table, setup_schema, user_table  # noqa: E402
+from main import app  # noqa: E402
+
+USER = {"email": "storm@example.net", "password": "1234"}
+
+
+async def seed(posts: int):
+    user_id = await database.execute(
+        user_table.insert().values(email=USER["email"], password=security.get_password_hash(USER["password"]))
+    )
+    await database.execute_many(post_table.insert(), [{"body": f"Post {i}", "user_id": user_id} for i in range(posts)])
+
+
+async def measure_feed(client: AsyncClient, stop: asyncio.Event) -> list[float]:
+    latencies = []
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await client.get("/posts")
+        latencies.append(loop.time() - start)
+        await asyncio.sleep(0)
+    return latencies
+
+
+async def storm(client: AsyncClient, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            await client.post("/token", json=USER)
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+
+
+async def scenario(client: AsyncClient, workers: int, logins: int, concurrency: int) -> dict:
+    security.hashing_pool = security.HashingPool(workers=workers, max_pending=logins)
+    stop = asyncio.Event()
+
+    idle_task = asyncio.create_task(measure_feed(client, stop))
+    await asyncio.sleep(1)
+    stop.set()
+    idle = await idle_task
+
+    stop.clear()
+    feed_task = asyncio.create_task(measure_feed(client, stop))
+    await storm(client, logins, concurrency)
+    stop.set()
+    during_storm = await feed_task
+
+    security.hashing_pool.shutdown()
+    return {"feed_idle": percentiles(idle), "feed_during_logins": percentiles(during_storm)}
+
+
+async def main(args):
+    setup_schema()
+    await database.connect()
+    await seed(posts=200)
+    results = {}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        results["inline"] = await scenario(client, 0, args.logins, args.concurrency)
+        results["pool"] = await scenario(client, args.workers, args.logins, args.concurrency)
+    await database.disconnect()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
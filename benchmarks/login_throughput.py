@@ -0,0 +1,73 @@
+# Logins per second per core for each password hash setting, the hashing pool runs a single thread.
+#   python -m benchmarks.login_throughput [--logins 30] [--settings bcrypt:10 bcrypt:12 pbkdf2_sha256:29000]
+# The same login keeps working when the setting changes: the first one after a change upgrades the stored hash.
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import Timer, use_temporary_database
+
+use_temporary_database()
+
+import sqlalchemy  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+import security  # noqa: E402
+from config import config  # noqa: E402
+from database import database, setup_schema, user_table  # noqa: E402
+from main import app  # noqa: E402
+
+USER = {"email": "throughput@example.net", "password": "1234"}
+
+
+def use_setting(setting: str):
+    scheme, _, rounds = setting.partition(":")
+    config.PASSWORD_HASH_SCHEMES = [scheme, *(s for s in config.PASSWORD_HASH_SCHEMES if s != scheme)]
+    config.PASSWORD_HASH_ROUNDS = int(rounds) if rounds else None
+    security.pwd_context.reset()
+
+
+async def scenario(client: AsyncClient, setting: str, logins: int, concurrency: int) -> dict:
+    use_setting(setting)
+    security.hashing_pool = security.HashingPool(workers=1, max_pending=logins)
+    # upgrades the hash left by the previous setting, not measured
+    response = await client.post("/token", json=USER)
+    assert response.status_code == 200, response.text
+    stored = await database.fetch_val(sqlalchemy.select(user_table.c.password))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            await client.post("/token", json=USER)
+
+    with Timer() as timer:
+        await asyncio.gather(*(login() for _ in range(logins)))
+    security.hashing_pool.shutdown()
+    # scheme and cost, without salt and checksum
+    return {"hash": "$".join(stored.split("$")[:3]) + "$", "logins_per_s_per_core": round(logins / timer.elapsed, 1)}
+
+
+async def main(args):
+    setup_schema()
+    await database.connect()
+    # the first setting is registered with every scheme of the others still accepted
+    config.PASSWORD_HASH_SCHEMES = list(dict.fromkeys(setting.partition(":")[0] for setting in args.settings))
+    use_setting(args.settings[0])
+    await database.execute(
+        user_table.insert().values(email=USER["email"], password=security.get_password_hash(USER["password"]))
+    )
+    results = {}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        for setting in args.settings:
+            results[setting] = await scenario(client, setting, args.logins, args.concurrency)
+    await database.disconnect()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--settings", nargs="+", default=["bcrypt:10", "bcrypt:11", "bcrypt:12", "pbkdf2_sha256:29000"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,92 @@
+# Feed latency while --writers clients keep posting for --duration seconds, without and with admission control.
+#   python -m benchmarks.overload [--duration 5] [--writers 256] [--write-concurrency 8] [--write-queue 32]
+# Without it every write queues on the database ahead of the reads. With it the writes beyond the write budget
+# (--write-concurrency running + --write-queue waiting) are answered 503 and the writer waits for Retry-After.
+import argparse
+import asyncio
+import json
+from collections import Counter
+
+from benchmarks.common import percentiles, use_temporary_database
+
+use_temporary_database()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+import admission  # noqa: E402
+import security  # noqa: E402
+from config import config  # noqa: E402
+from database import database, post_table, setup_schema, user_table  # noqa: E402
+from main import app, lifespan  # noqa: E402
+
+EMAIL = "overload@example.net"
+
+
+async def seed(posts: int) -> dict:
+    user_id = await database.execute(user_table.insert().values(email=EMAIL, password="-"))
+    await database.execute_many(post_table.insert(), [{"body": f"Post {i}", "user_id": user_id} for i in range(posts)])
+    return {"Authorization": f"Bearer {security.create_access_token(EMAIL, user_id)}"}
+
+
+async def measure_feed(client: AsyncClient, stop: asyncio.Event) -> tuple[list[float], Counter]:
+    latencies, statuses = [], Counter()
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        response = await client.get("/posts", params={"sorting": "old"})
+        latencies.append(loop.time() - start)
+        statuses[response.status_code] += 1
+        await asyncio.sleep(0)
+    return latencies, statuses
+
+
+async def write_load(client: AsyncClient, headers: dict, writers: int, duration: float) -> Counter:
+    statuses = Counter()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+
+    async def writer():
+        while loop.time() < deadline:
+            response = await client.post("/posts", json={"body": "Burst"}, headers=headers)
+            statuses[response.status_code] += 1
+            if response.status_code == 503:
+                # a well-behaved client, the benchmark clients share the event loop with the app
+                await asyncio.sleep(float(response.headers["Retry-After"]))
+
+    await asyncio.gather(*(writer() for _ in range(writers)))
+    return statuses
+
+
+async def scenario(client: AsyncClient, headers: dict, args, enabled: bool) -> dict:
+    config.ADMISSION_CONTROL = enabled
+    admission.limiters = admission.create_limiters()
+    admission.limiters["write"] = admission.Limiter(args.write_concurrency, args.write_queue, timeout=1)
+
+    stop = asyncio.Event()
+    feed_task = asyncio.create_task(measure_feed(client, stop))
+    writes = await write_load(client, headers, args.writers, args.duration)
+    stop.set()
+    latencies, reads = await feed_task
+    return {"feed": percentiles(latencies), "feed_statuses": dict(reads), "write_statuses": dict(writes)}
+
+
+async def main(args):
+    setup_schema()
+    results = {}
+    # writes failing with "database is locked" are counted as 500s instead of stopping the benchmark
+    transport = ASGITransport(app=app, raise_app_exceptions=False)
+    async with lifespan(app):
+        headers = await seed(posts=200)
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            results["without_admission_control"] = await scenario(client, headers, args, enabled=False)
+            results["with_admission_control"] = await scenario(client, headers, args, enabled=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=256)
+    parser.add_argument("--write-concurrency", type=int, default=8)
+    parser.add_argument("--write-queue", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
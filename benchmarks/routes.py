@@ -0,0 +1,253 @@
+# Latency and throughput of every route in routers/ (post, timeline and user) against a seeded dataset.
+#   python -m benchmarks.routes [--posts 20000] [--requests 500] [--concurrency 16] [--output results.json]
+#   python -m benchmarks.routes --baseline results.json [--tolerance 0.25]
+# The dataset is generated from --seed, so two runs with the same arguments measure the same data. With
+# --baseline it exits with 1 when a route's p95 grew (or its throughput dropped) more than --tolerance.
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+
+from benchmarks.common import percentiles, use_temporary_database
+
+use_temporary_database()
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+import security  # noqa: E402
+from database import database_path, setup_schema  # noqa: E402
+from main import app, lifespan  # noqa: E402
+from pagination import NEXT_CURSOR_HEADER  # noqa: E402
+
+PASSWORD = "1234"
+# every post body has one of these words (by its id, the rest of the dataset doesn't change), what GET /posts/search
+# looks for: each word matches 1 / SEARCH_WORDS of the posts
+SEARCH_WORDS = 100
+
+
+# written with sqlite3 directly, seeding through the API would take longer than the benchmark itself
+def seed(args, rng: random.Random) -> dict:
+    password = security.get_password_hash(PASSWORD)
+    connection = sqlite3.connect(database_path())
+    with connection:
+        connection.executemany(
+            "INSERT INTO users (id, email, password) VALUES (?, ?, ?)",
+            [(user_id, f"user{user_id}@example.net", password) for user_id in range(1, args.users + 1)],
+        )
+        connection.executemany(
+            "INSERT INTO posts (id, body, user_id) VALUES (?, ?, ?)",
+            [
+                (post_id, f"Post {post_id} about word{post_id % SEARCH_WORDS}", rng.randint(1, args.users))
+                for post_id in range(1, args.posts + 1)
+            ],
+        )
+        connection.executemany(
+            "INSERT INTO comments (body, post_id, user_id) VALUES (?, ?, ?)",
+            [("Comment", rng.randint(1, args.posts), rng.randint(1, args.users)) for _ in range(args.comments)],
+        )
+        likes = set()
+        while len(likes) < min(args.likes, args.users * args.posts):
+            likes.add((rng.randint(1, args.posts), rng.randint(1, args.users)))
+        connection.executemany("INSERT INTO likes (post_id, user_id) VALUES (?, ?)", sorted(likes))
+        connection.execute("UPDATE posts SET likes = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)")
+
+        # users without any like, so the like scenarios never hit the unique index
+        users = {}
+        for name in ("writer", "liker", "bulk_liker", "reader"):
+            user_id = connection.execute(
+                "INSERT INTO users (email, password) VALUES (?, ?)", (f"{name}@example.net", password)
+            ).lastrowid
+            users[name] = {"Authorization": f"Bearer {security.create_access_token(f'{name}@example.net', user_id)}"}
+
+        # the reader follows --follows users, its timeline materialized like the fan-out worker would have done
+        reader_id = connection.execute("SELECT id FROM users WHERE email = 'reader@example.net'").fetchone()[0]
+        followees = rng.sample(range(1, args.users + 1), min(args.follows, args.users))
+        connection.executemany(
+            "INSERT INTO follows (follower_id, followee_id) VALUES (?, ?)", [(reader_id, user) for user in followees]
+        )
+        connection.execute("UPDATE users SET followers = (SELECT count(*) FROM follows WHERE followee_id = users.id)")
+        connection.execute(
+            "INSERT INTO timelines (user_id, post_id) SELECT follows.follower_id, posts.id "
+            "FROM follows JOIN posts ON posts.user_id = follows.followee_id WHERE follows.follower_id = ?",
+            (reader_id,),
+        )
+    connection.close()
+    return users
+
+
+# (name, number of requests, expected status, request(client, i, rng)) for every route
+def scenarios(args, users: dict, cursors: list[str], etags: list[tuple[str, str]]) -> list[tuple]:
+    def random_post(rng: random.Random) -> int:
+        return rng.randint(1, args.posts)
+
+    def bulk(i: int, item) -> list:
+        return [item(i * args.batch + offset) for offset in range(args.batch)]
+
+    # every like needs its own post, like scenarios are capped by the number of posts
+    likes = min(args.requests, args.posts)
+    bulk_likes = min(args.requests, args.posts // args.batch)
+    return [
+        ("GET /posts", args.requests, 200, lambda client, i, rng: client.get("/posts")),
+        ("GET /posts?sorting=most_likes", args.requests, 200,
+         lambda client, i, rng: client.get("/posts", params={"sorting": "most_likes"})),
+        ("GET /posts?cursor", args.requests, 200,
+         lambda client, i, rng: client.get("/posts", params={"cursor": cursors[i % len(cursors)]})),
+        # polling clients that already have the latest version, answered before any query
+        ("GET /posts If-None-Match", args.requests, 304,
+         lambda client, i, rng: client.get("/posts", headers={"If-None-Match": etags[0][1]})),
+        ("GET /posts/{post_id} If-None-Match", args.requests, 304,
+         lambda client, i, rng: client.get(etags[1 + i % (len(etags) - 1)][0],
+                                           headers={"If-None-Match": etags[1 + i % (len(etags) - 1)][1]})),
+        ("GET /feed", args.requests, 200, lambda client, i, rng: client.get("/feed")),
+        ("GET /timeline", args.requests, 200, lambda client, i, rng: client.get("/timeline", headers=users["reader"])),
+        ("GET /posts/search", args.requests, 200,
+         lambda client, i, rng: client.get("/posts/search", params={"q": f"word{rng.randrange(SEARCH_WORDS)}"})),
+        ("GET /posts/{post_id}", args.requests, 200, lambda client, i, rng: client.get(f"/posts/{random_post(rng)}")),
+        ("GET /posts/{post_id}/comments", args.requests, 200,
+         lambda client, i, rng: client.get(f"/posts/{random_post(rng)}/comments")),
+        ("GET /posts/batch", args.requests, 200,
+         lambda client, i, rng: client.get("/posts/batch", params={"ids": [random_post(rng) for _ in range(20)]})),
+        ("POST /posts", args.requests, 201,
+         lambda client, i, rng: client.post("/posts", json={"body": f"New post {i}"}, headers=users["writer"])),
+        ("POST /comments", args.requests, 201,
+         lambda client, i, rng: client.post(
+             "/comments", json={"body": "New comment", "post_id": random_post(rng)}, headers=users["writer"]
+         )),
+        ("POST /like", likes, (201, 202),
+         lambda client, i, rng: client.post("/like", json={"post_id": i + 1}, headers=users["liker"])),
+        ("POST /posts/bulk", args.requests, 201,
+         lambda client, i, rng: client.post(
+             "/posts/bulk", json=bulk(i, lambda n: {"body": f"Bulk post {n}"}), headers=users["writer"]
+         )),
+        ("POST /comments/bulk", args.requests, 201,
+         lambda client, i, rng: client.post(
+             "/comments/bulk", json=bulk(i, lambda n: {"body": "Bulk comment", "post_id": random_post(rng)}),
+             headers=users["writer"],
+         )),
+        ("POST /like/bulk", bulk_likes, 201,
+         lambda client, i, rng: client.post(
+             "/like/bulk", json=bulk(i, lambda n: {"post_id": n + 1}), headers=users["bulk_liker"]
+         )),
+        # bcrypt bound, fewer requests
+        ("POST /register", args.auth_requests, 201,
+         lambda client, i, rng: client.post("/register", json={"email": f"new{i}@example.net", "password": PASSWORD})),
+        ("POST /token", args.auth_requests, 200,
+         lambda client, i, rng: client.post(
+             "/token", json={"email": f"user{rng.randint(1, args.users)}@example.net", "password": PASSWORD}
+         )),
+    ]
+
+
+async def run_scenario(client: AsyncClient, requests: int, expected, request, concurrency: int, seed: int) -> dict:
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    rng = random.Random(seed)
+    indexes = iter(range(requests))
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        for i in indexes:
+            start = time.perf_counter()
+            response = await request(client, i, rng)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in expected:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"requests_per_s": requests / elapsed, "errors": errors, **percentiles(latencies)}
+
+
+# the next-page tokens of the first pages of the feed
+async def collect_cursors(client: AsyncClient, pages: int) -> list[str]:
+    cursors = []
+    response = await client.get("/posts")
+    while NEXT_CURSOR_HEADER in response.headers and len(cursors) < pages:
+        cursors.append(response.headers[NEXT_CURSOR_HEADER])
+        response = await client.get("/posts", params={"cursor": cursors[-1]})
+    return cursors
+
+
+# (url, ETag) of the first page of the feed and of some posts, before any write changes them
+async def collect_etags(client: AsyncClient, posts: int) -> list[tuple[str, str]]:
+    urls = ["/posts"] + [f"/posts/{post_id}" for post_id in range(1, posts + 1)]
+    return [(url, (await client.get(url)).headers["ETag"]) for url in urls]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results["routes"].items():
+        previous = baseline["routes"].get(name)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+        if result["requests_per_s"] < previous["requests_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {previous['requests_per_s']:.0f} -> {result['requests_per_s']:.0f} requests/s"
+            )
+    return regressions
+
+
+async def main(args) -> dict:
+    rng = random.Random(args.seed)
+    setup_schema()
+    users = seed(args, rng)
+
+    results = {
+        "dataset": {name: getattr(args, name) for name in ("users", "posts", "comments", "likes", "follows", "seed")},
+        "load": {name: getattr(args, name) for name in ("requests", "auth_requests", "batch", "concurrency")},
+        "python": platform.python_version(),
+        "routes": {},
+    }
+    async with lifespan(app):
+        # an unhandled exception comes back as a 500, counted in the errors of its route instead of ending the run
+        transport = ASGITransport(app=app, raise_app_exceptions=False)
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            cursors = await collect_cursors(client, pages=50)
+            etags = await collect_etags(client, posts=min(50, args.posts))
+            for index, (name, requests, expected, request) in enumerate(scenarios(args, users, cursors, etags)):
+                if args.routes and not any(route in name for route in args.routes):
+                    continue
+                results["routes"][name] = await run_scenario(
+                    client, requests, expected, request, args.concurrency, args.seed + index
+                )
+                print(f"{name}: {results['routes'][name]['requests_per_s']:.0f} requests/s", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=50000)
+    parser.add_argument("--likes", type=int, default=50000)
+    parser.add_argument("--follows", type=int, default=200, help="users followed by the timeline reader")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--auth-requests", type=int, default=50, help="requests for /register and /token")
+    parser.add_argument("--batch", type=int, default=100, help="items per bulk request")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--routes", nargs="*", help="only the routes containing one of these")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    arguments = parser.parse_args()
+
+    report = asyncio.run(main(arguments))
+    print(json.dumps(report, indent=2))
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            found = compare(report, json.load(baseline_file), arguments.tolerance)
+        if found:
+            print("Regressions:\n" + "\n".join(found), file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,59 @@
+# First page of a search with the FTS5 index (GET /posts/search) vs a LIKE '%q%' scan of posts.body.
+#   python -m benchmarks.search [--posts 200000] [--queries 200]
+# Both run the same words against the same sqlite file, straight through sqlite3 so only the query is measured.
+import argparse
+import json
+import random
+import sqlite3
+import time
+
+from benchmarks.common import percentiles, use_temporary_database
+
+use_temporary_database()
+
+from database import database_path, setup_schema  # noqa: E402
+from pagination import DEFAULT_PAGE_SIZE  # noqa: E402
+from routers.post import match_expression, search_posts_query  # noqa: E402
+
+like_query = "SELECT id, body, user_id, likes FROM posts WHERE body LIKE :pattern ORDER BY id DESC LIMIT :limit"
+
+
+def seed(connection: sqlite3.Connection, posts: int, vocabulary: list[str], rng: random.Random):
+    connection.execute("INSERT INTO users (id, email, password) VALUES (1, 'search@example.net', '-')")
+    # a few words are everywhere, most of them are rare (like real text)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    rows = [(" ".join(rng.choices(vocabulary, weights, k=rng.randint(5, 30))), 1) for _ in range(posts)]
+    with connection:
+        connection.executemany("INSERT INTO posts (body, user_id) VALUES (?, ?)", rows)
+
+
+def run(connection: sqlite3.Connection, sql: str, parameters: list[dict]) -> dict:
+    latencies = []
+    for values in parameters:
+        start = time.perf_counter()
+        connection.execute(sql, values).fetchall()
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=200000)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"word{i}" for i in range(args.vocabulary)]
+    setup_schema()
+    connection = sqlite3.connect(database_path())
+    seed(connection, args.posts, vocabulary, rng)
+
+    words = rng.choices(vocabulary, k=args.queries)
+    limit = DEFAULT_PAGE_SIZE + 1
+    fts = run(connection, search_posts_query.format(after=""),
+              [{"match": match_expression(word), "limit": limit} for word in words])
+    # word1 also matches word10, word100... LIKE can't tell words apart, it's the best it can do
+    like = run(connection, like_query, [{"pattern": f"%{word}%", "limit": limit} for word in words])
+    print(json.dumps({"fts5": fts, "like": like, "p50_speedup": like["p50_ms"] / fts["p50_ms"]}, indent=2))
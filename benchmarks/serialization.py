@@ -0,0 +1,78 @@
+# Response building per model in models/post.py: the response_model path (validate the rows from attributes,
+# jsonable_encoder, stdlib json) vs the fast path (serialization.rows_as + orjson).
+#   python -m benchmarks.serialization [--rows 1000] [--repeat 20]
+import argparse
+import asyncio
+import json
+import timeit
+
+from benchmarks.common import use_temporary_database
+
+use_temporary_database()
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from database import comment_table, database, like_table, post_table, setup_schema, user_table  # noqa: E402
+from models.post import Comment, PostLIke, UserPost, UserPostWithComments, UserPostWithLikes  # noqa: E402
+from routers.post import fetch_posts_with_comments  # noqa: E402
+from serialization import rows_as  # noqa: E402
+
+
+async def seed(rows: int):
+    user_id = await database.execute(user_table.insert().values(email="bench@example.net", password="-"))
+    await database.execute_many(post_table.insert(), [{"body": f"Post {i}", "user_id": user_id} for i in range(rows)])
+    await database.execute_many(
+        comment_table.insert(), [{"body": "Comment", "post_id": i % 50 + 1, "user_id": user_id} for i in range(rows)]
+    )
+    await database.execute_many(like_table.insert(), [{"post_id": i + 1, "user_id": user_id} for i in range(rows)])
+
+
+def validated(model, rows) -> bytes:
+    adapter = TypeAdapter(list[model])
+    values = adapter.validate_python(rows, from_attributes=True)
+    return json.dumps(jsonable_encoder(values)).encode()
+
+
+def fast(model, rows) -> bytes:
+    # fetch_posts_with_comments already builds the response shape, the route only encodes it
+    if model is UserPostWithComments:
+        return orjson.dumps(rows)
+    return orjson.dumps(rows_as(model, rows))
+
+
+async def main(args):
+    setup_schema()
+    await database.connect()
+    await seed(args.rows)
+    posts = await database.fetch_all(post_table.select())
+    with_comments = list((await fetch_posts_with_comments(list(range(1, 51)))).values())
+    samples = {
+        UserPost: posts,
+        UserPostWithLikes: posts,
+        Comment: await database.fetch_all(comment_table.select()),
+        PostLIke: await database.fetch_all(like_table.select()),
+        UserPostWithComments: with_comments,
+    }
+    await database.disconnect()
+
+    results = {}
+    for model, rows in samples.items():
+        assert json.loads(validated(model, rows)) == json.loads(fast(model, rows))
+        slow_time = min(timeit.repeat(lambda: validated(model, rows), number=1, repeat=args.repeat))
+        fast_time = min(timeit.repeat(lambda: fast(model, rows), number=1, repeat=args.repeat))
+        results[model.__name__] = {
+            "rows": len(rows),
+            "response_model_ms": slow_time * 1000,
+            "fast_ms": fast_time * 1000,
+            "speedup": slow_time / fast_time,
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+# Mixed read/write load with the default sqlite setup vs SQLITE_PRODUCTION_PROFILE.
+#   python -m benchmarks.sqlite_profile [--clients 32] [--seconds 5] [--write-ratio 0.1]
+# Every profile runs in its own process, the storage setup is decided when database.py is imported.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.common import percentiles, use_temporary_database
+
+
+async def run_load(args) -> dict:
+    from httpx import ASGITransport, AsyncClient
+
+    import security
+    from database import database, post_table, read_database, setup_schema, user_table
+    from main import app
+
+    setup_schema()
+    await database.connect()
+    await read_database.connect()
+    user_id = await database.execute(user_table.insert().values(email="load@example.net", password="-"))
+    await database.execute_many(post_table.insert(), [{"body": f"Post {i}", "user_id": user_id} for i in range(1000)])
+    headers = {"Authorization": f"Bearer {security.create_access_token('load@example.net')}"}
+
+    reads, writes = [], []
+    deadline = time.perf_counter() + args.seconds
+
+    async def client_loop(client: AsyncClient, rng: random.Random):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if rng.random() < args.write_ratio:
+                await client.post("/posts", json={"body": "Load post"}, headers=headers)
+                writes.append(time.perf_counter() - start)
+            else:
+                await client.get(f"/posts/{rng.randint(1, 1000)}")
+                reads.append(time.perf_counter() - start)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(client_loop(client, random.Random(i)) for i in range(args.clients)))
+
+    await read_database.disconnect()
+    await database.disconnect()
+    return {
+        "requests_per_s": (len(reads) + len(writes)) / args.seconds,
+        "reads": percentiles(reads),
+        "writes": percentiles(writes),
+    }
+
+
+def run_profile(profile: str, args) -> dict:
+    env = {**os.environ, "TEST_SQLITE_PRODUCTION_PROFILE": str(profile == "production").lower()}
+    command = [sys.executable, "-m", "benchmarks.sqlite_profile", "--child",
+               "--clients", str(args.clients), "--seconds", str(args.seconds), "--write-ratio", str(args.write_ratio)]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        use_temporary_database()
+        print(json.dumps(asyncio.run(run_load(arguments))))
+    else:
+        print(json.dumps({profile: run_profile(profile, arguments) for profile in ("default", "production")}, indent=2))
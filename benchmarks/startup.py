@@ -0,0 +1,83 @@
+# Startup cost: how long `import main` takes and how long until the first request is answered.
+#   python -m benchmarks.startup [--runs 5] [--max-import-ms 2000] [--max-first-request-ms 3000]
+# Every run is a fresh interpreter, the module cache would hide the cost otherwise. Exits with 1 when a median
+# is over its threshold so it can gate CI.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import use_temporary_database
+
+FIRST_REQUEST = """
+import asyncio, json, time
+start = time.perf_counter()
+from httpx import ASGITransport, AsyncClient
+from main import app, lifespan
+imported = time.perf_counter()
+
+async def first_request():
+    async with lifespan(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            response = await client.get("/posts")
+            assert response.status_code == 200, response.text
+
+asyncio.run(first_request())
+print(json.dumps({"import_s": imported - start, "first_request_s": time.perf_counter() - start}))
+"""
+
+
+# total of the top level imports reported by -X importtime, in microseconds
+def import_time_us() -> int:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], env=os.environ, check=True,
+        capture_output=True, text=True
+    ).stderr
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented, their time is already part of their parent's cumulative time
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total
+
+
+def first_request() -> dict:
+    # a new database file for every run, creating the schema is part of the first request
+    use_temporary_database()
+    output = subprocess.run(
+        [sys.executable, "-c", FIRST_REQUEST], env=os.environ, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time is higher")
+    parser.add_argument("--max-first-request-ms", type=float, help="fail when the median time to first request is higher")
+    args = parser.parse_args()
+
+    use_temporary_database()
+    imports = [import_time_us() / 1000 for _ in range(args.runs)]
+    first_requests = [first_request()["first_request_s"] * 1000 for _ in range(args.runs)]
+    results = {
+        "import_ms": {"median": statistics.median(imports), "min": min(imports), "max": max(imports)},
+        "first_request_ms": {
+            "median": statistics.median(first_requests), "min": min(first_requests), "max": max(first_requests)
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+    regressions = [
+        f"{name} median {results[name]['median']:.0f}ms > {limit:.0f}ms"
+        for name, limit in (("import_ms", args.max_import_ms), ("first_request_ms", args.max_first_request_ms))
+        if limit is not None and results[name]["median"] > limit
+    ]
+    if regressions:
+        print("Startup regression: " + ", ".join(regressions), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,156 @@
+import csv
+import io
+import itertools
+import json
+import sqlite3
+from enum import Enum
+from typing import IO, Iterable, Iterator
+
+from coherence import RECORD_EXTERNAL_WRITE
+from database import comment_table, like_table, post_table, user_table
+from security import pwd_context
+
+# Bulk loading for seeding and migrations from other systems: rows go straight into the tables with executemany,
+# no endpoint, no per-row bcrypt (passwords must already be hashed). Everything runs in a single transaction, an
+# error leaves the database as it was. The transaction also bumps the external_writes row, so the workers of a
+# running app drop their caches on their next poll (see coherence.py).
+
+# rows per executemany, memory stays the same whatever the size of the file
+IMPORT_BATCH_ROWS = 10000
+# page cache of the import connection, index builds sort in it
+IMPORT_CACHE_SIZE_KIB = 256 * 1024
+
+
+class ImportTable(str, Enum):
+    users = "users"
+    posts = "posts"
+    comments = "comments"
+    likes = "likes"
+
+
+import_tables = {
+    ImportTable.users: user_table,
+    ImportTable.posts: post_table,
+    ImportTable.comments: comment_table,
+    ImportTable.likes: like_table,
+}
+
+
+class ImportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class InvalidImport(ValueError):
+    pass
+
+
+# one JSON object per line (what `manage.py export` writes), or CSV with a header row. Empty CSV fields are NULL
+def read_rows(file: IO[bytes], format: ImportFormat) -> Iterator[dict]:
+    if format == ImportFormat.csv:
+        reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8", newline=""))
+        for row in reader:
+            yield {column: value if value != "" else None for column, value in row.items()}
+        return
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            raise InvalidImport(f"Line {line_number} is not valid JSON: {error}") from None
+
+
+def check_password(row: dict, position: int):
+    password = row.get("password")
+    if password is None or pwd_context.identify(password, required=False) is None:
+        raise InvalidImport(f"Row {position}: the password must be a hash ({', '.join(pwd_context.schemes())})")
+
+
+# the indexes and triggers of `table`, as (name, type, sql). Automatic indexes (primary keys, UNIQUE columns)
+# have no sql and can't be dropped
+def secondary_objects(connection: sqlite3.Connection, table: str) -> list[tuple[str, str, str]]:
+    return connection.execute(
+        "SELECT name, type, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+        "AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+
+
+def insert_batches(connection: sqlite3.Connection, table: ImportTable, rows: Iterable[dict], batch_size: int) -> int:
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    columns = list(first)
+    unknown = set(columns) - {column.name for column in import_tables[table].columns}
+    if unknown:
+        raise InvalidImport(f"Unknown columns for {table.value}: {', '.join(sorted(unknown))}")
+    sql = f"INSERT INTO {table.value} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    imported = 0
+    rows = itertools.chain([first], rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        values = []
+        for position, row in enumerate(batch, start=imported + 1):
+            if row.keys() != first.keys():
+                raise InvalidImport(f"Row {position} has different columns than the first one")
+            if table == ImportTable.users:
+                check_password(row, position)
+            values.append(tuple(row.values()))
+        try:
+            connection.executemany(sql, values)
+        except sqlite3.IntegrityError as error:
+            raise InvalidImport(f"Rows {imported + 1}-{imported + len(values)}: {error}") from None
+        imported += len(values)
+    return imported
+
+
+def import_rows(
+    database_path: str,
+    table: ImportTable,
+    rows: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_ROWS,
+    rebuild_indexes: bool = True,
+) -> int:
+    # isolation_level=None so we control the transaction, DDL included (like migrate)
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        # only for this connection: commits don't wait for the disk. Safe if the process dies, an OS crash or a
+        # power loss during the import can corrupt the file, back up a database that matters first
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(f"PRAGMA cache_size = -{IMPORT_CACHE_SIZE_KIB}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # appending to a table with no index is a sequential write, every index is then built once from sorted
+            # keys instead of being updated row by row. Small imports into a big table are faster keeping them
+            dropped = secondary_objects(connection, table.value) if rebuild_indexes else []
+            for name, kind, _ in dropped:
+                connection.execute(f"DROP {kind.upper()} {name}")
+
+            imported = insert_batches(connection, table, rows, batch_size)
+
+            for name, _, sql in dropped:
+                try:
+                    connection.execute(sql)
+                except sqlite3.IntegrityError as error:
+                    raise InvalidImport(f"Can't rebuild {name}: {error}") from None
+            # the posts_fts_* triggers were dropped with the other triggers of posts
+            if table == ImportTable.posts and dropped:
+                connection.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+            # likes is the source of truth of the posts.likes counters
+            if table == ImportTable.likes and imported:
+                connection.execute(
+                    "UPDATE posts SET likes = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)"
+                )
+            connection.execute(RECORD_EXTERNAL_WRITE)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        # statistics of the rebuilt indexes for the query planner
+        connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+    return imported
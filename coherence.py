@@ -0,0 +1,151 @@
+import asyncio
+import inspect
+import logging
+import sqlite3
+from multiprocessing.sharedctypes import RawArray
+from typing import Callable
+
+from config import config
+from lazy import Lazy
+
+logger = logging.getLogger(__name__)
+
+# what a write can make stale, one generation counter per worker and kind
+KINDS = ("feed", "users")
+# and one more per worker counting its commits, whatever they changed
+SLOTS = (*KINDS, "commits")
+
+# kind -> what every worker runs when another process changed it, registered with @on_change by the modules that
+# keep in-process state. They may be async, and return False to be called again on the next poll
+handlers: dict[str, list[Callable]] = {kind: [] for kind in KINDS}
+
+
+def on_change(kind: str):
+    def register(handler: Callable) -> Callable:
+        handlers[kind].append(handler)
+        return handler
+
+    return register
+
+
+# run by every writer outside of the workers (manage.py, imports), in the transaction of its writes
+RECORD_EXTERNAL_WRITE = "UPDATE external_writes SET generation = generation + 1"
+
+
+def shared_generations(workers: int):
+    # created by serve.py before forking, every worker sees the same memory. A worker only ever writes its own
+    # slots, no lock needed
+    return RawArray("Q", workers * len(SLOTS))
+
+
+# Keeps the in-process caches of every worker coherent with the writes of the others, without any external service.
+# Writes bump a generation of their worker in shared memory (publish). Every `interval` seconds each worker looks
+# at the generations of the others and runs the handlers of what changed.
+# Processes outside of the group (manage.py, imports) bump the external_writes row with their writes
+# (RECORD_EXTERNAL_WRITE), a new generation runs every handler. Other writers (a sqlite3 shell) are caught by
+# PRAGMA data_version: every commit of the workers is counted (record_commit, called by the writer connection),
+# a change that no worker counted is external too.
+class Coherence:
+    def __init__(self, interval: float | None):
+        self.interval = interval
+        # a single worker until serve.py attaches the shared memory
+        self.generations = shared_generations(1)
+        self.worker = 0
+        self._seen: list[int] = list(self.generations)
+        self._data_version: int | None = None
+        self._external_writes: int | None = None
+        self._connection: sqlite3.Connection | None = None
+        self._task: asyncio.Task | None = None
+        # handlers that asked to be called again
+        self._pending: list[Callable] = []
+        self.invalidations = {kind: 0 for kind in (*KINDS, "external")}
+
+    def attach(self, generations, worker: int):
+        self.generations = generations
+        self.worker = worker
+        self._seen = list(generations)
+
+    def _slot(self, worker: int, kind: str) -> int:
+        return worker * len(SLOTS) + SLOTS.index(kind)
+
+    def publish(self, kind: str):
+        self.generations[self._slot(self.worker, kind)] += 1
+
+    def record_commit(self):
+        self.generations[self._slot(self.worker, "commits")] += 1
+
+    def _read_versions(self) -> tuple[int, int]:
+        data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+        external_writes = self._connection.execute("SELECT generation FROM external_writes").fetchone()[0]
+        return data_version, external_writes
+
+    # the kinds changed by other processes since the last call
+    async def changes(self) -> set[str]:
+        # waits while another process holds the write lock, kept off the event loop
+        data_version, external_writes = await asyncio.to_thread(self._read_versions)
+        generations = list(self.generations)
+        own = {self._slot(self.worker, kind) for kind in SLOTS}
+        moved = [slot for slot, (seen, current) in enumerate(zip(self._seen, generations)) if seen != current]
+        changed = {SLOTS[slot % len(SLOTS)] for slot in moved if slot not in own} - {"commits"}
+        # never missed, whatever the workers committed meanwhile
+        external = self._external_writes is not None and external_writes != self._external_writes
+        # a commit nobody counted. A commit is counted once it returns: seen in between, it looks external, which
+        # only costs an invalidation too many. Only a writer that doesn't record its writes can go unnoticed, when
+        # a worker committed during the same poll
+        external = external or (self._data_version is not None and data_version != self._data_version and not moved)
+        self._seen = generations
+        self._data_version = data_version
+        self._external_writes = external_writes
+
+        if external:
+            self.invalidations["external"] += 1
+            return set(KINDS)
+        for kind in changed:
+            self.invalidations[kind] += 1
+        return changed
+
+    async def poll(self):
+        changed = await self.changes()
+        calls = self._pending + [handler for kind in KINDS if kind in changed for handler in handlers[kind]]
+        self._pending = []
+        for handler in dict.fromkeys(calls):
+            result = handler()
+            if inspect.isawaitable(result):
+                result = await result
+            if result is False:
+                self._pending.append(handler)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Could not check the writes of other processes")
+
+    def start(self, database_path: str):
+        if self.interval is None or self._task is not None:
+            return
+        # its own connection: data_version only changes for commits made by other connections
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._data_version, self._external_writes = self._read_versions()
+        self._seen = list(self.generations)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def stats(self) -> dict:
+        return {"worker": self.worker, "invalidations": dict(self.invalidations)}
+
+
+coherence = Lazy(lambda: Coherence(interval=config.COHERENCE_POLL_SECONDS))
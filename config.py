@@ -2,6 +2,8 @@ from typing import Optional
 from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from lazy import Lazy
+
 
 class BaseConfig(BaseSettings):
     ENV_STATE: Optional[str] = None
@@ -13,6 +15,64 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DB_FORCE_ROLL_BACK: bool = False
+    # WAL, tuned pragmas, a single writer connection and a pool of read-only ones (see storage.py)
+    SQLITE_PRODUCTION_PROFILE: bool = False
+    SQLITE_READERS: int = 4
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_CACHE_SIZE_KIB: int = 64 * 1024
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    # authenticated users cached by get_current_user (0 disables the cache)
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL_SECONDS: float = 60
+    # pages of GET /posts cached until the next post or like
+    FEED_CACHE_ENABLED: bool = True
+    FEED_CACHE_SIZE: int = 256
+    FEED_CACHE_TTL_SECONDS: float = 300
+    # read endpoints encode database rows with orjson instead of validating them through their response_model
+    FAST_SERIALIZATION: bool = True
+    # like_post acknowledges likes right away and writes them in batches (see like_buffer.py)
+    LIKE_WRITE_BEHIND: bool = False
+    LIKE_BUFFER_SIZE: int = 500
+    LIKE_BUFFER_FLUSH_SECONDS: float = 1.0
+    # threads that run bcrypt away from the event loop (None = one per core, 0 = run inline)
+    HASHING_WORKERS: Optional[int] = None
+    # hashes queued or running before /register and /token answer 503
+    HASHING_MAX_PENDING: int = 64
+    # passlib schemes, the first one hashes new passwords. The others are still accepted and replaced on login,
+    # like hashes of another cost (see security.py)
+    PASSWORD_HASH_SCHEMES: list[str] = ["bcrypt"]
+    # cost of the first scheme (log2 for bcrypt), None = the passlib default. `manage.py calibrate-hash` picks it
+    PASSWORD_HASH_ROUNDS: Optional[int] = None
+    # most liked and trending posts kept in memory (see leaderboard.py)
+    LEADERBOARD_SIZE: int = 100
+    TRENDING_HALF_LIFE_HOURS: float = 6
+    # posts of authors with at least this many followers are not copied into every timeline, the timelines
+    # of their followers read them at request time (see fan_out.py)
+    FAN_OUT_MAX_FOLLOWERS: int = 10000
+    # latest posts of an account copied into the timeline of a new follower
+    TIMELINE_BACKFILL_POSTS: int = 50
+    # posts whose version (the ETag of GET /posts/{post_id} and its comments) is remembered, see versions.py
+    POST_VERSIONS_SIZE: int = 100000
+    # requests of each class (auth: /token and /register, write, read) running at once and waiting for their turn,
+    # the rest are answered 503 with Retry-After (see admission.py)
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_AUTH_CONCURRENCY: int = 16
+    ADMISSION_AUTH_QUEUE: int = 64
+    ADMISSION_WRITE_CONCURRENCY: int = 32
+    ADMISSION_WRITE_QUEUE: int = 256
+    ADMISSION_READ_CONCURRENCY: int = 64
+    ADMISSION_READ_QUEUE: int = 512
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 2
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
+    # identical reads running at the same time share one query (see singleflight.py)
+    SINGLE_FLIGHT_ENABLED: bool = True
+    # how often every worker looks for writes made by the other processes (see coherence.py, None disables it)
+    COHERENCE_POLL_SECONDS: Optional[float] = 1.0
+    # request and query histograms served by GET /metrics
+    METRICS_ENABLED: bool = True
+    # queries taking at least this long are logged with their parameters (None disables the log)
+    SLOW_QUERY_MS: Optional[float] = 100
 
 
 class DevConfig(GlobalConfig):
@@ -37,4 +97,5 @@ def get_config(env_state: str):
     return configs[env_state]()
 
 
-config = get_config(BaseConfig().ENV_STATE)
+# the settings (and the .env file) are read the first time a setting is used, not when this module is imported
+config = Lazy(lambda: get_config(BaseConfig().ENV_STATE))
@@ -1,6 +1,10 @@
 import databases
 import sqlalchemy
 from config import config
+from lazy import Lazy
+from metrics import timed_query
+from migrations import migrate
+from storage import ProfiledDatabase, WriterDatabase, profile_pragmas
 
 # all database structure
 metadata = sqlalchemy.MetaData()
@@ -10,7 +14,13 @@ post_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    # denormalized amount of likes, like_post keeps it updated so reads don't need to aggregate the likes table
+    sqlalchemy.Column("likes", sqlalchemy.Integer, nullable=False, server_default="0"),
+    # serves the most_likes sorting (and its (likes, id) cursor) straight from the index
+    sqlalchemy.Index("ix_posts_likes_id", "likes", "id"),
+    # the latest posts of an author (timelines of high-follower accounts are read from here)
+    sqlalchemy.Index("ix_posts_user_id_id", "user_id", "id"),
 )
 
 user_table = sqlalchemy.Table(
@@ -18,7 +28,9 @@ user_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("email", sqlalchemy.String, unique=True),
-    sqlalchemy.Column("password", sqlalchemy.String)
+    sqlalchemy.Column("password", sqlalchemy.String),
+    # denormalized amount of followers, kept by the follow endpoints
+    sqlalchemy.Column("followers", sqlalchemy.Integer, nullable=False, server_default="0"),
 )
 
 comment_table = sqlalchemy.Table(
@@ -27,7 +39,8 @@ comment_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Index("ix_comments_post_id", "post_id"),
 )
 
 like_table = sqlalchemy.Table(
@@ -35,20 +48,92 @@ like_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    # unix time, the trending leaderboard is rebuilt from the recent ones (ix_likes_created_at)
+    sqlalchemy.Column("created_at", sqlalchemy.Float),
+    # one like per user and post, it also serves the lookups by post_id
+    sqlalchemy.Index("ux_likes_post_id_user_id", "post_id", "user_id", unique=True),
+    sqlalchemy.Index("ix_likes_user_id", "user_id"),
+    sqlalchemy.Index("ix_likes_created_at", "created_at"),
 )
 
-# to connect to sqlalchemy
-engine = sqlalchemy.create_engine(
-    config.DATABASE_URL,
-    # This is only for sqlite database
-    connect_args={"check_same_thread": False}
+follow_table = sqlalchemy.Table(
+    "follows",
+    metadata,
+    sqlalchemy.Column("follower_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Column("followee_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Index("ix_follows_followee_id", "followee_id"),
+    sqlite_with_rowid=False,
 )
 
-# create the tables with the correct structure
-metadata.create_all(engine)
+# per-user materialized home timeline, filled by the fan-out worker (see fan_out.py)
+timeline_table = sqlalchemy.Table(
+    "timelines",
+    metadata,
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), primary_key=True),
+    sqlite_with_rowid=False,
+)
+
+# generation bumped by the writers outside of the app workers (manage.py, imports), see coherence.py
+external_writes_table = sqlalchemy.Table(
+    "external_writes",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("generation", sqlalchemy.Integer, nullable=False),
+)
+
+
+def database_path() -> str:
+    return sqlalchemy.engine.make_url(config.DATABASE_URL).database
+
+
+# create / upgrade the tables with the versioned migrations (see migrations.py), it runs in the app startup
+# (lifespan) and before the management commands. The tables above describe the schema after the latest migration
+def setup_schema():
+    migrate(database_path())
+
+
+# every write goes through `database`. `read_database` serves the reads that don't need to see an open write
+# transaction, it's the same instance unless the sqlite production profile is enabled
+def create_databases() -> tuple[databases.Database, databases.Database]:
+    if not config.SQLITE_PRODUCTION_PROFILE:
+        writer = WriterDatabase(
+            config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
+        )
+        return writer, writer
+
+    pragmas = profile_pragmas(
+        synchronous=config.SQLITE_SYNCHRONOUS,
+        cache_size_kib=config.SQLITE_CACHE_SIZE_KIB,
+        mmap_size=config.SQLITE_MMAP_SIZE,
+        busy_timeout_ms=config.SQLITE_BUSY_TIMEOUT_MS,
+    )
+    writer = ProfiledDatabase(
+        config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK, pool_size=1, pragmas=pragmas
+    )
+    readers = ProfiledDatabase(
+        config.DATABASE_URL, pool_size=config.SQLITE_READERS, pragmas=pragmas, read_only=True
+    )
+    return writer, readers
+
+
+# the instances to interact with the database, built on first use so importing this module does no I/O
+_databases = Lazy(create_databases)
+database = Lazy(lambda: _databases.resolve()[0])
+read_database = Lazy(lambda: _databases.resolve()[1])
+
+
+# executemany on the raw sqlite connection, must run inside a transaction (`async with database.transaction()`).
+# The transaction holds the write lock since the first row, so the new ids are consecutive up to last_insert_rowid
+async def insert_many(table: sqlalchemy.Table, rows: list[dict]) -> list[int]:
+    columns = list(rows[0])
+    sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    raw_connection = database.connection().raw_connection
 
-# the instance to interact with the database
-database = databases.Database(
-    config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
-)
\ No newline at end of file
+    values = [tuple(row[column] for column in columns) for row in rows]
+    with timed_query("execute_many", sql, values):
+        await raw_connection.executemany(sql, values)
+        async with raw_connection.execute("SELECT last_insert_rowid()") as cursor:
+            (last_id,) = await cursor.fetchone()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
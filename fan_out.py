@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from config import config
+from database import database
+from lazy import Lazy
+from metrics import timed_query
+
+logger = logging.getLogger(__name__)
+
+# the post goes into the timeline of every follower of its author, unless the author has so many followers that
+# their timelines read the post at request time instead (the subquery is a constant, evaluated once per post)
+fan_out_post = """
+    INSERT OR IGNORE INTO timelines (user_id, post_id)
+    SELECT follower_id, ? FROM follows
+    WHERE followee_id = ? AND (SELECT followers FROM users WHERE id = ?) < ?
+"""
+
+
+# Fan-out on write: create_post only adds the new post here and a background task copies it into the timelines
+# of the followers of its author, so writing a post doesn't wait for thousands of inserts. Posts are written as
+# soon as the task wakes up, everything that arrived meanwhile in a single transaction; stop() drains the rest.
+class FanOut:
+    def __init__(self):
+        # (post_id, author id) waiting to be fanned out
+        self._pending: list[tuple[int, int]] = []
+        self._wake_up = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.posts = 0
+        self.timeline_rows = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, post_id: int, user_id: int):
+        self._pending.append((post_id, user_id))
+        self._wake_up.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            posts, self._pending = self._pending, []
+            # read on every flush, the timelines tell the accounts served on read with the same setting
+            values = [(post_id, user_id, user_id, config.FAN_OUT_MAX_FOLLOWERS) for post_id, user_id in posts]
+            try:
+                async with database.transaction():
+                    raw_connection = database.connection().raw_connection
+                    with timed_query("execute_many", fan_out_post, values):
+                        cursor = await raw_connection.executemany(fan_out_post, values)
+            except BaseException:
+                # kept for the next flush, a cancelled one included
+                self._pending = posts + self._pending
+                raise
+            self.posts += len(posts)
+            self.timeline_rows += cursor.rowcount
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wake_up.wait()
+            self._wake_up.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not fan out %s posts", len(self))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # never cancelled, like LikeBuffer.stop: the loop finishes the flush in progress (and its transaction) and returns
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wake_up.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    def clear(self):
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {"pending": len(self), "posts": self.posts, "timeline_rows": self.timeline_rows}
+
+
+fan_out = Lazy(FanOut)
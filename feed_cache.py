@@ -0,0 +1,22 @@
+from cache import TTLCache
+from coherence import coherence, on_change
+from config import config
+from lazy import Lazy
+from versions import versions
+
+# pages of GET /posts keyed by (sorting, cursor, limit).
+# Every write that changes what the feed shows (posts, likes) must call invalidate_feed once it's committed.
+feed_cache = Lazy(lambda: TTLCache(max_size=config.FEED_CACHE_SIZE, ttl=config.FEED_CACHE_TTL_SECONDS))
+
+
+def invalidate_feed():
+    feed_cache.clear()
+    # the ETag of GET /posts and /feed
+    versions.bump_feed()
+    # the other workers drop their pages too (see coherence.py)
+    coherence.publish("feed")
+
+
+@on_change("feed")
+def drop_feed_pages():
+    feed_cache.clear()
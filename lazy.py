@@ -0,0 +1,24 @@
+from typing import Any, Callable
+
+
+# Stands in for an object that is only built the first time it's used, so importing the module that declares it
+# does no I/O (reading the settings, opening the database...). Attributes assigned on the proxy itself
+# (e.g. mock.patch.object in tests) shadow the ones of the real object.
+class Lazy:
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+
+    def resolve(self) -> Any:
+        if self._instance is None:
+            object.__setattr__(self, "_instance", self._factory())
+        return self._instance
+
+    def reset(self):
+        object.__setattr__(self, "_instance", None)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+    def __len__(self) -> int:
+        return len(self.resolve())
@@ -0,0 +1,207 @@
+import bisect
+import time
+from collections import defaultdict
+
+import sqlalchemy
+
+from coherence import on_change
+from config import config
+from database import like_table, post_table, read_database
+from lazy import Lazy
+
+# likes older than this many half-lives weigh less than 1/1000 of a new one, they are not loaded at startup
+TRENDING_WINDOW_HALF_LIVES = 10
+# the landmark of the trending scores moves forward after this many half-lives, before 2^x overflows a float
+REBASE_HALF_LIVES = 64
+# trending scores below this (a like ~20 half-lives old) are forgotten when rebasing
+FORGET_SCORE = 2 ** -20
+# posts read per query when loading, below the sqlite limit of bound parameters
+LOAD_CHUNK = 500
+# likes read per query by record_new_likes
+NEW_LIKES_CHUNK = 10000
+
+
+# The `size` posts with the highest (score, id), kept in order. Scores only ever grow (likes are never removed,
+# trending scores are forward-decayed), so a post outside can only come in by pushing the lowest one out:
+# the set stays exact without looking at any other post. Updates and reads are O(size).
+class TopK:
+    def __init__(self, size: int):
+        self.size = size
+        # ascending (score, post id)
+        self._keys: list[tuple[float, int]] = []
+        self._posts: dict[int, tuple[tuple[float, int], dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, post: dict, score: float):
+        key = (score, post["id"])
+        current = self._posts.get(post["id"])
+        if current is not None:
+            # concurrent likes of a post can report their new counter out of order, the highest one wins
+            if key < current[0]:
+                return
+            del self._keys[bisect.bisect_left(self._keys, current[0])]
+        elif len(self._keys) >= self.size:
+            if not self._keys or key <= self._keys[0]:
+                return
+            _, lowest_id = self._keys.pop(0)
+            del self._posts[lowest_id]
+        bisect.insort(self._keys, key)
+        self._posts[post["id"]] = (key, post)
+
+    # best first
+    def top(self, limit: int) -> list[dict]:
+        return [self._posts[post_id][1] for _, post_id in reversed(self._keys[-limit:])] if limit else []
+
+    def rescale(self, factor: float):
+        self._keys = [(score * factor, post_id) for score, post_id in self._keys]
+        self._posts = {post_id: ((key[0] * factor, post_id), post) for post_id, (key, post) in self._posts.items()}
+
+    def clear(self):
+        self._keys.clear()
+        self._posts.clear()
+
+
+# Most liked and trending posts, kept up to date by every write of likes instead of sorting posts on each read.
+# Trending uses forward decay: a like at time t weighs 2^((t - landmark) / half_life). The decayed score of every
+# post at any moment is that sum times the same 2^(-(now - landmark) / half_life), so the order never changes by
+# just waiting and old scores never need updating.
+class Leaderboard:
+    def __init__(self, size: int, half_life: float):
+        self.size = size
+        self.half_life = half_life
+        self.most_liked = TopK(size)
+        self.trending = TopK(size)
+        # forward-decayed score of every post liked recently, a post needs its previous score to enter trending
+        self._scores: dict[int, float] = {}
+        self._landmark = time.time()
+        # False until load() read the database, most_likes pages come from the database meanwhile
+        self.loaded = False
+        # likes up to this id are counted (ids are given in commit order), see record_new_likes
+        self.last_like_id = 0
+
+    def weight(self, timestamp: float) -> float:
+        return 2 ** ((timestamp - self._landmark) / self.half_life)
+
+    def add_post(self, post: dict):
+        self.most_liked.update(post, post["likes"])
+
+    # post: the row after its likes counter was updated, timestamps: created_at of its new likes
+    def record_likes(self, post: dict, timestamps: list[float]):
+        self.most_liked.update(post, post["likes"])
+        if not timestamps:
+            return
+        if max(timestamps) - self._landmark > REBASE_HALF_LIVES * self.half_life:
+            self._rebase(max(timestamps))
+        score = self._scores.get(post["id"], 0.0) + sum(self.weight(timestamp) for timestamp in timestamps)
+        self._scores[post["id"]] = score
+        self.trending.update(post, score)
+
+    def _rebase(self, landmark: float):
+        factor = 2 ** ((self._landmark - landmark) / self.half_life)
+        self._landmark = landmark
+        self.trending.rescale(factor)
+        self._scores = {
+            post_id: score * factor for post_id, score in self._scores.items() if score * factor >= FORGET_SCORE
+        }
+
+    def clear(self):
+        self.most_liked.clear()
+        self.trending.clear()
+        self._scores.clear()
+        self._landmark = time.time()
+        self.loaded = False
+        self.last_like_id = 0
+
+
+leaderboard = Lazy(
+    lambda: Leaderboard(size=config.LEADERBOARD_SIZE, half_life=config.TRENDING_HALF_LIFE_HOURS * 3600)
+)
+
+
+async def fetch_posts(post_ids: list[int]) -> list[dict]:
+    posts = []
+    for start in range(0, len(post_ids), LOAD_CHUNK):
+        query = post_table.select().where(post_table.c.id.in_(post_ids[start:start + LOAD_CHUNK]))
+        posts += [{**post} for post in await read_database.fetch_all(query)]
+    return posts
+
+
+def timestamps_per_post(likes: list[tuple[int, float]]) -> dict[int, list[float]]:
+    timestamps = defaultdict(list)
+    for post_id, created_at in likes:
+        timestamps[post_id].append(created_at)
+    return timestamps
+
+
+# Every like is added to the scores once, in id order: by the worker that wrote it right after its commit, by the
+# others on their next "feed" change, whoever comes first. Only the likes above the last one counted are read
+# (likes.id, the primary key), with the posts they liked for their new counter. posts: rows the caller read after
+# its write, not read again
+async def record_new_likes(posts: list[dict] = ()):
+    known = {post["id"]: post for post in posts}
+    while True:
+        query = (
+            sqlalchemy.select(like_table.c.id, like_table.c.post_id, like_table.c.created_at)
+            .where(like_table.c.id > leaderboard.last_like_id)
+            .order_by(like_table.c.id)
+            .limit(NEW_LIKES_CHUNK)
+        )
+        likes = await read_database.fetch_all(query)
+        missing = sorted({like.post_id for like in likes} - known.keys())
+        known.update((post["id"], post) for post in await fetch_posts(missing))
+
+        # another call may have counted some of them meanwhile, applied without awaiting from here
+        new = [like for like in likes if like.id > leaderboard.last_like_id]
+        if new:
+            # likes without created_at are too old to be trending
+            timestamps = timestamps_per_post([(like.post_id, like.created_at) for like in new])
+            for post_id, post_timestamps in timestamps.items():
+                if post_id in known:
+                    leaderboard.record_likes(known[post_id], [t for t in post_timestamps if t is not None])
+            leaderboard.last_like_id = new[-1].id
+        if len(likes) < NEW_LIKES_CHUNK:
+            return
+
+
+def most_liked_query():
+    query = post_table.select().order_by(post_table.c.likes.desc(), post_table.c.id.desc())
+    return query.limit(leaderboard.size)
+
+
+def max_like_id_query():
+    return sqlalchemy.select(sqlalchemy.func.coalesce(sqlalchemy.func.max(like_table.c.id), 0))
+
+
+# called at startup: the most liked posts (ix_posts_likes_id) and the likes of the trending window
+# (ix_likes_created_at), nothing else is read
+async def load_leaderboard():
+    # read first, the likes committed meanwhile are left to record_new_likes
+    last_like_id = await read_database.fetch_val(max_like_id_query())
+    most_liked = await read_database.fetch_all(most_liked_query())
+    since = time.time() - TRENDING_WINDOW_HALF_LIVES * leaderboard.half_life
+    query = sqlalchemy.select(like_table.c.post_id, like_table.c.created_at).where(
+        like_table.c.created_at >= since, like_table.c.id <= last_like_id
+    )
+    timestamps = timestamps_per_post([(like.post_id, like.created_at) for like in await read_database.fetch_all(query)])
+    liked = await fetch_posts(list(timestamps))
+
+    # everything read first and applied without awaiting, a request never sees a leaderboard half loaded
+    leaderboard.clear()
+    for post in most_liked:
+        leaderboard.add_post({**post})
+    for post in liked:
+        leaderboard.record_likes(post, timestamps[post["id"]])
+    leaderboard.last_like_id = last_like_id
+    leaderboard.loaded = True
+
+
+# posts and likes written by another process: their new likes, and the top of ix_posts_likes_id for the counters
+# changed without a like row (imports). Pages keep coming from memory
+@on_change("feed")
+async def refresh_leaderboard():
+    most_liked = await read_database.fetch_all(most_liked_query())
+    for post in most_liked:
+        leaderboard.add_post({**post})
+    await record_new_likes()
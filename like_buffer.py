@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+
+from config import config
+from database import database
+from feed_cache import invalidate_feed
+from lazy import Lazy
+from leaderboard import record_new_likes
+from metrics import timed_query
+
+logger = logging.getLogger(__name__)
+
+insert_like = "INSERT OR IGNORE INTO likes (post_id, user_id, created_at) VALUES (?, ?, ?)"
+# by the rows really stored, the rowcount of the inserts of the post (likes already there are ignored)
+increment_likes = "UPDATE posts SET likes = likes + ? WHERE id = ?"
+
+
+# Write-behind for likes: like_post only adds the like here and a background task writes them in batches,
+# one transaction (and one write lock) per batch. Likes are flushed when `max_size` are waiting or every
+# `flush_interval` seconds, and stop() drains whatever is left on shutdown.
+class LikeBuffer:
+    def __init__(self, max_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        # (post_id, user_id) -> created_at, waiting for the next flush and the ones being written right now
+        self._pending: dict[tuple[int, int], float] = {}
+        self._flushing: dict[tuple[int, int], float] = {}
+        self._pending_per_post: Counter = Counter()
+        self._wake_up = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.flushes = 0
+        self.flushed_likes = 0
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._flushing)
+
+    def contains(self, post_id: int, user_id: int) -> bool:
+        return (post_id, user_id) in self._pending or (post_id, user_id) in self._flushing
+
+    def add(self, post_id: int, user_id: int):
+        self._pending[(post_id, user_id)] = time.time()
+        self._pending_per_post[post_id] += 1
+        if len(self._pending) >= self.max_size:
+            self._wake_up.set()
+
+    def pending_likes(self, post_id: int) -> int:
+        return self._pending_per_post[post_id]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            likes = [(post_id, user_id, created_at) for (post_id, user_id), created_at in self._flushing.items()]
+            likes_per_post = defaultdict(list)
+            for like in likes:
+                likes_per_post[like[0]].append(like)
+            try:
+                async with database.transaction():
+                    raw_connection = database.connection().raw_connection
+                    increments = []
+                    for post_id, post_likes in likes_per_post.items():
+                        with timed_query("execute_many", insert_like, post_likes):
+                            cursor = await raw_connection.executemany(insert_like, post_likes)
+                        if cursor.rowcount:
+                            increments.append((cursor.rowcount, post_id))
+                    with timed_query("execute_many", increment_likes, increments):
+                        await raw_connection.executemany(increment_likes, increments)
+            except BaseException:
+                # keep them for the next flush (a cancelled flush included), they are still counted by pending_likes
+                self._pending = {**self._flushing, **self._pending}
+                raise
+            finally:
+                self._flushing = {}
+
+            self._pending_per_post.subtract(post_id for post_id, _, _ in likes)
+            self._pending_per_post = +self._pending_per_post
+            self.flushes += 1
+            self.flushed_likes += len(likes)
+        # the stored counters changed, cached pages were computed with the old ones
+        invalidate_feed()
+        await record_new_likes()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout=self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wake_up.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not flush %s buffered likes", len(self))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # never cancelled: interrupted in its transaction, a flush would keep the writer connection forever (the only
+    # one with the production profile). The loop finishes the flush in progress and returns
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wake_up.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    def clear(self):
+        self._pending.clear()
+        self._pending_per_post.clear()
+
+    def stats(self) -> dict:
+        return {"pending": len(self), "flushes": self.flushes, "flushed_likes": self.flushed_likes}
+
+
+like_buffer = Lazy(
+    lambda: LikeBuffer(max_size=config.LIKE_BUFFER_SIZE, flush_interval=config.LIKE_BUFFER_FLUSH_SECONDS)
+)
@@ -1,19 +1,51 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from routers.export import router as export_router
+from routers.metrics import router as metrics_router
 from routers.post import router as post_router
+from routers.timeline import router as timeline_router
 from routers.user import router as user_router
-from database import database
+from admission import AdmissionMiddleware
+from coherence import coherence
+from config import config
+from database import database, database_path, read_database, setup_schema
+from fan_out import fan_out
+from leaderboard import load_leaderboard
+from like_buffer import like_buffer
+from metrics import MetricsMiddleware
+from security import hashing_pool
 
 
 # function that setup and finish the process when "yield" finish
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # nothing touches the database (or reads the settings) until here, importing the app has no side effects
+    setup_schema()
     await database.connect()
+    await read_database.connect()
+    await load_leaderboard()
+    fan_out.start()
+    # writes of the other workers (serve.py) and processes drop our cached reads
+    coherence.start(database_path())
+    if config.LIKE_WRITE_BEHIND:
+        like_buffer.start()
     yield
+    # buffered likes and pending fan-outs are written before the database goes away
+    await like_buffer.stop()
+    await fan_out.stop()
+    await coherence.stop()
+    await read_database.disconnect()
     await database.disconnect()
+    hashing_pool.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
+# the last one added runs first: every request is measured, the ones shed by admission control included
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(post_router)
 app.include_router(user_router)
+app.include_router(timeline_router)
+app.include_router(export_router)
+app.include_router(metrics_router)
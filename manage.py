@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import sys
+import time
+
+import sqlalchemy
+
+from bulk_import import IMPORT_BATCH_ROWS, ImportFormat, ImportTable, InvalidImport, import_rows, read_rows
+from coherence import RECORD_EXTERNAL_WRITE
+from config import config
+from database import database, database_path, like_table, post_table, read_database, setup_schema
+from migrations import LATEST_VERSION, migrate
+from routers.export import ExportTable, export_rows
+from security import calibrate_rounds
+
+
+# rebuilds every posts.likes counter from the likes table (the source of truth)
+async def reconcile_like_counts():
+    count_likes = (
+        sqlalchemy.select(sqlalchemy.func.count(like_table.c.id))
+        .where(like_table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+    query = post_table.update().values(likes=count_likes)
+    updated = await database.execute(query)
+    # running workers drop their feed pages and leaderboard
+    await database.execute(RECORD_EXTERNAL_WRITE)
+    return updated
+
+
+# reindexes every post, for databases written while the posts_fts triggers didn't exist (or were dropped)
+async def rebuild_search_index():
+    await database.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    return await database.fetch_val("SELECT count(*) FROM posts")
+
+
+async def run_migrate(args):
+    applied = migrate(database_path(), target=args.target)
+    print(f"Applied migrations: {applied or 'none, already up to date'}")
+
+
+async def run_reconcile_likes(args):
+    setup_schema()
+    await database.connect()
+    try:
+        async with database.transaction():
+            updated = await reconcile_like_counts()
+    finally:
+        await database.disconnect()
+    print(f"Reconciled like counters of {updated} posts")
+
+
+async def run_rebuild_search(args):
+    setup_schema()
+    await database.connect()
+    try:
+        indexed = await rebuild_search_index()
+    finally:
+        await database.disconnect()
+    print(f"Rebuilt the search index of {indexed} posts")
+
+
+async def run_export(args):
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    setup_schema()
+    # export_rows reads with read_database, a pool of its own with the production profile. Left open, its
+    # connection threads keep the process from exiting
+    await read_database.connect()
+    try:
+        async for chunk in export_rows(ExportTable(args.table), args.since_id):
+            output.write(chunk)
+    finally:
+        await read_database.disconnect()
+        if args.output:
+            output.close()
+
+
+async def run_import(args):
+    setup_schema()
+    format = ImportFormat(args.format or ("csv" if args.input.endswith(".csv") else "ndjson"))
+    input = open(args.input, "rb") if args.input != "-" else sys.stdin.buffer
+    start = time.perf_counter()
+    try:
+        imported = import_rows(
+            database_path(), ImportTable(args.table), read_rows(input, format),
+            batch_size=args.batch_size, rebuild_indexes=not args.keep_indexes,
+        )
+    except InvalidImport as error:
+        sys.exit(f"Nothing imported: {error}")
+    finally:
+        if args.input != "-":
+            input.close()
+    elapsed = time.perf_counter() - start
+    print(f"Imported {imported} {args.table} in {elapsed:.2f}s ({imported / elapsed:.0f} rows/s)")
+
+
+async def run_calibrate_hash(args):
+    scheme = args.scheme or config.PASSWORD_HASH_SCHEMES[0]
+    try:
+        rounds, elapsed = calibrate_rounds(scheme, args.target_ms / 1000)
+    except ValueError as error:
+        sys.exit(str(error))
+    print(f"{scheme} with {rounds} rounds: {elapsed * 1000:.0f}ms per hash (target {args.target_ms:.0f}ms), "
+          f"about {1 / elapsed:.0f} logins/s per core")
+    print(f"Set PASSWORD_HASH_ROUNDS={rounds}, existing hashes are upgraded as their users log in")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="socialapi management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply the pending schema migrations")
+    migrate_parser.add_argument("--target", type=int, default=LATEST_VERSION, help="stop at this schema version")
+    migrate_parser.set_defaults(handler=run_migrate)
+
+    reconcile_likes = subparsers.add_parser(
+        "reconcile-likes", help="backfill / rebuild posts.likes from the likes table"
+    )
+    reconcile_likes.set_defaults(handler=run_reconcile_likes)
+
+    rebuild_search = subparsers.add_parser("rebuild-search", help="backfill / rebuild the full-text index of posts")
+    rebuild_search.set_defaults(handler=run_rebuild_search)
+
+    export = subparsers.add_parser("export", help="stream a table as NDJSON")
+    export.add_argument("table", choices=[table.value for table in ExportTable])
+    export.add_argument("--since-id", type=int, default=0, help="only rows with a greater id (incremental export)")
+    export.add_argument("--output", help="file to write, stdout by default")
+    export.set_defaults(handler=run_export)
+
+    bulk_import = subparsers.add_parser(
+        "import", help="bulk load users, posts, comments or likes from NDJSON or CSV (passwords already hashed)"
+    )
+    bulk_import.add_argument("table", choices=[table.value for table in ImportTable])
+    bulk_import.add_argument("input", help="file to read, - for stdin")
+    bulk_import.add_argument(
+        "--format", choices=[format.value for format in ImportFormat], help="ndjson unless the file ends with .csv"
+    )
+    bulk_import.add_argument("--batch-size", type=int, default=IMPORT_BATCH_ROWS, help="rows per executemany")
+    bulk_import.add_argument(
+        "--keep-indexes", action="store_true", help="update the indexes row by row instead of rebuilding them"
+    )
+    bulk_import.set_defaults(handler=run_import)
+
+    calibrate_hash = subparsers.add_parser(
+        "calibrate-hash", help="the password hash cost that takes --target-ms on this machine"
+    )
+    calibrate_hash.add_argument("--target-ms", type=float, default=250, help="time of one hash, per core")
+    calibrate_hash.add_argument("--scheme", help="first of PASSWORD_HASH_SCHEMES by default")
+    calibrate_hash.set_defaults(handler=run_calibrate_hash)
+
+    args = parser.parse_args(argv)
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+import databases
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Request and query instrumentation, exposed in the Prometheus text format by GET /metrics.
+# Observing a value is a bisect and a few additions, no locks needed: everything runs on the event loop.
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [observations per bucket (the last one is +Inf), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+# values computed when /metrics is scraped, e.g. the stats() of a cache. samples: [(labels dict, value)]
+def render_samples(name: str, documentation: str, kind: str, samples: list[tuple[dict, float]]) -> list[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+requests_total = Counter("http_requests_total", "Requests answered", ("method", "route", "status"))
+request_duration = Histogram("http_request_duration_seconds", "Time to answer a request", ("method", "route"))
+request_queries = Histogram(
+    "http_request_db_queries", "Database queries run by a request", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+request_query_duration = Histogram(
+    "http_request_db_seconds", "Time a request spent in database queries", ("method", "route"), QUERY_BUCKETS
+)
+query_duration = Histogram("db_query_duration_seconds", "Time of a database query", ("operation",), QUERY_BUCKETS)
+slow_queries = Counter("db_slow_queries_total", "Queries slower than SLOW_QUERY_MS")
+
+REGISTRY = [requests_total, request_duration, request_queries, request_query_duration, query_duration, slow_queries]
+
+
+def render_metrics() -> list[str]:
+    return [line for metric in REGISTRY for line in metric.render()]
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# the queries of the request being handled, set by MetricsMiddleware
+current_queries: ContextVar[QueryStats | None] = ContextVar("current_queries", default=None)
+
+
+def query_text(query, values) -> tuple[str, Any]:
+    if isinstance(query, str):
+        return query, values
+    compiled = query.compile()
+    return str(compiled), values or compiled.params
+
+
+def record_query(operation: str, query, values, elapsed: float):
+    query_duration.observe((operation,), elapsed)
+    stats = current_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    slow_query_ms = config.SLOW_QUERY_MS
+    if slow_query_ms is not None and elapsed * 1000 >= slow_query_ms:
+        slow_queries.inc()
+        sql, parameters = query_text(query, values)
+        # execute_many: only the first rows, the whole batch could be thousands of them
+        if isinstance(parameters, list) and len(parameters) > 3:
+            parameters = [*parameters[:3], f"... {len(parameters)} rows"]
+        logger.warning("Slow query (%s, %.1fms): %s parameters=%s", operation, elapsed * 1000, sql, parameters)
+
+
+@contextmanager
+def timed_query(operation: str, query, values=None):
+    if not config.METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_query(operation, query, values, time.perf_counter() - start)
+
+
+# every query that goes through the databases API is timed, see timed_query for the raw sqlite ones
+class InstrumentedDatabase(databases.Database):
+    async def fetch_all(self, query, values=None):
+        with timed_query("fetch_all", query, values):
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values=None):
+        with timed_query("fetch_one", query, values):
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        with timed_query("fetch_val", query, values):
+            return await super().fetch_val(query, values, column)
+
+    async def execute(self, query, values=None):
+        with timed_query("execute", query, values):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values):
+        with timed_query("execute_many", query, values):
+            return await super().execute_many(query, values)
+
+    async def iterate(self, query, values=None):
+        if not config.METRICS_ENABLED:
+            async for record in super().iterate(query, values):
+                yield record
+            return
+        # one query, timed while fetching rows only and not while the caller works with each one
+        rows = super().iterate(query, values).__aiter__()
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    record = await rows.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield record
+        finally:
+            record_query("iterate", query, values, elapsed)
+
+
+# pure ASGI middleware (no extra task per request like BaseHTTPMiddleware). The route template, not the
+# path, is the label so /posts/1 and /posts/2 are the same series.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = QueryStats()
+        token = current_queries.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_queries.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            requests_total.inc((*labels, status_code))
+            request_duration.observe(labels, elapsed)
+            request_queries.observe(labels, stats.count)
+            request_query_duration.observe(labels, stats.seconds)
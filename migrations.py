@@ -0,0 +1,195 @@
+import sqlite3
+
+# Versioned schema changes. The version applied last is stored in the sqlite header (PRAGMA user_version),
+# every migration runs inside its own transaction together with the version bump.
+# Migrations must be idempotent because databases created with the old `metadata.create_all` start at version 0.
+
+
+def column_names(connection: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def initial_schema(connection: sqlite3.Connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            email VARCHAR,
+            password VARCHAR,
+            PRIMARY KEY (id),
+            UNIQUE (email)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER NOT NULL,
+            body VARCHAR,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER NOT NULL,
+            body VARCHAR,
+            post_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(post_id) REFERENCES posts (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS likes (
+            id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(post_id) REFERENCES posts (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """)
+    # very first databases were created before posts and comments had an author
+    for table in ("posts", "comments"):
+        if "user_id" not in column_names(connection, table):
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER REFERENCES users (id)")
+
+
+def like_counters(connection: sqlite3.Connection):
+    if "likes" not in column_names(connection, "posts"):
+        connection.execute("ALTER TABLE posts ADD COLUMN likes INTEGER NOT NULL DEFAULT 0")
+    connection.execute("UPDATE posts SET likes = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_posts_likes_id ON posts (likes, id)")
+
+
+def secondary_indexes(connection: sqlite3.Connection):
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_comments_post_id ON comments (post_id)")
+
+    # a user can only like a post once, duplicated likes are dropped before the unique index is created
+    connection.execute("DELETE FROM likes WHERE id NOT IN (SELECT min(id) FROM likes GROUP BY post_id, user_id)")
+    connection.execute("UPDATE posts SET likes = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)")
+    # also serves every lookup by likes.post_id (leftmost column)
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_likes_post_id_user_id ON likes (post_id, user_id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_likes_user_id ON likes (user_id)")
+
+
+def post_search(connection: sqlite3.Connection):
+    # external content table: the text stays in posts, the index only keeps the tokens
+    connection.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            body, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    # keep the index in sync whoever writes posts (create_post, /posts/bulk, imports...)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, body) VALUES (new.id, new.body);
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        END
+    """)
+    # OF body: updating the likes counter must not reindex the post
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF body ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, body) VALUES ('delete', old.id, old.body);
+            INSERT INTO posts_fts (rowid, body) VALUES (new.id, new.body);
+        END
+    """)
+    # index the posts that already exist
+    connection.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+
+def like_timestamps(connection: sqlite3.Connection):
+    # likes stored before are NULL: too old to be trending
+    if "created_at" not in column_names(connection, "likes"):
+        connection.execute("ALTER TABLE likes ADD COLUMN created_at REAL")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_likes_created_at ON likes (created_at)")
+
+
+def follows_and_timelines(connection: sqlite3.Connection):
+    # denormalized like posts.likes: the fan-out reads it to tell the accounts served on read
+    if "followers" not in column_names(connection, "users"):
+        connection.execute("ALTER TABLE users ADD COLUMN followers INTEGER NOT NULL DEFAULT 0")
+    # WITHOUT ROWID: the primary key is the table, a lookup by its leftmost column is a single range read
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS follows (
+            follower_id INTEGER NOT NULL,
+            followee_id INTEGER NOT NULL,
+            PRIMARY KEY (follower_id, followee_id),
+            FOREIGN KEY(follower_id) REFERENCES users (id),
+            FOREIGN KEY(followee_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    """)
+    # the followers of an author, the index also carries follower_id (the rest of the primary key)
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_follows_followee_id ON follows (followee_id)")
+    # the materialized home timelines, a page is a range of (user_id, post_id) read backwards
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS timelines (
+            user_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, post_id),
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(post_id) REFERENCES posts (id)
+        ) WITHOUT ROWID
+    """)
+    # the latest posts of an author, for the timelines that read them instead of getting them fanned out
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_posts_user_id_id ON posts (user_id, id)")
+
+
+def external_writes(connection: sqlite3.Connection):
+    # a single row, bumped by every writer that isn't a worker of the app (see coherence.py)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS external_writes (
+            id INTEGER NOT NULL CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )
+    """)
+    connection.execute("INSERT OR IGNORE INTO external_writes (id, generation) VALUES (1, 0)")
+
+
+# (version, migration), append only - never edit a migration that was already released
+MIGRATIONS = [
+    (1, initial_schema),
+    (2, like_counters),
+    (3, secondary_indexes),
+    (4, post_search),
+    (5, like_timestamps),
+    (6, follows_and_timelines),
+    (7, external_writes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(database_path: str, target: int = LATEST_VERSION) -> list[int]:
+    # isolation_level=None so we control the transactions, DDL included
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    applied = []
+    try:
+        for version, migration in MIGRATIONS:
+            if version > target:
+                break
+            if version <= current_version(connection):
+                continue
+            # IMMEDIATE takes the write lock first, so two processes starting together can't both apply it
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if version > current_version(connection):
+                    migration(connection)
+                    connection.execute(f"PRAGMA user_version = {version}")
+                    applied.append(version)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+    finally:
+        connection.close()
+    return applied
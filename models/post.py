@@ -31,6 +31,12 @@ class Comment(CommentIn):
     user_id: int
 
 
+class UserPostWithCommentPreview(UserPostWithLikes):
+    comment_count: int
+    # the latest ones, newest first
+    comments: list[Comment]
+
+
 class UserPostWithComments(BaseModel):
     post: UserPostWithLikes
     comments: list[Comment]
@@ -41,5 +47,6 @@ class PostLIkeIn(BaseModel):
 
 
 class PostLIke(PostLIkeIn):
-    id: int
+    # None when the like is still buffered (write-behind mode)
+    id: int | None
     user_id: int
@@ -8,3 +8,11 @@ class User(BaseModel):
 
 class UserIn(User):
     password: str
+
+
+class FollowIn(BaseModel):
+    user_id: int
+
+
+class Follow(FollowIn):
+    follower_id: int
@@ -0,0 +1,30 @@
+import base64
+import json
+
+# Opaque keyset cursors: the client only gets back a token with the last row "position"
+# so the next page is a WHERE on indexed columns instead of an OFFSET scan.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(kind: str, **position) -> str:
+    raw = json.dumps({"k": kind, **position}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, kind: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+    # a cursor created for one sorting can not be reused with another one
+    if not isinstance(position, dict) or position.pop("k", None) != kind:
+        raise InvalidCursor("Invalid cursor")
+    return position
@@ -0,0 +1,50 @@
+import json
+from enum import Enum
+from typing import Annotated, AsyncIterator
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+
+from database import comment_table, like_table, post_table, read_database
+from security import get_current_user
+
+router = APIRouter()
+
+# rows sent per chunk, memory stays the same whatever the size of the table
+EXPORT_CHUNK_ROWS = 500
+
+
+class ExportTable(str, Enum):
+    posts = "posts"
+    comments = "comments"
+    likes = "likes"
+
+
+export_tables = {
+    ExportTable.posts: post_table,
+    ExportTable.comments: comment_table,
+    ExportTable.likes: like_table,
+}
+
+
+# one JSON object per line, ordered by id so `since_id` (the last id already exported) resumes an export
+async def export_rows(table: ExportTable, since_id: int = 0) -> AsyncIterator[bytes]:
+    sql_table = export_tables[table]
+    last_id = since_id
+    while True:
+        # a page per chunk (keyset on the primary key): the query is done and its connection released before the
+        # chunk is sent, a slow client never keeps a read open (and the writer waiting on its lock)
+        query = sql_table.select().where(sql_table.c.id > last_id).order_by(sql_table.c.id).limit(EXPORT_CHUNK_ROWS)
+        rows = await read_database.fetch_all(query)
+        if not rows:
+            return
+        yield "".join(json.dumps({**row}, separators=(",", ":")) + "\n" for row in rows).encode()
+        if len(rows) < EXPORT_CHUNK_ROWS:
+            return
+        last_id = rows[-1].id
+
+
+# every like comes with its user_id, logged-in users only
+@router.get("/export/{table}", response_class=StreamingResponse, dependencies=[Depends(get_current_user)])
+async def export_table(table: ExportTable, since_id: Annotated[int, Query(ge=0)] = 0):
+    return StreamingResponse(export_rows(table, since_id), media_type="application/x-ndjson")
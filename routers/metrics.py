@@ -0,0 +1,80 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from admission import limiters
+from coherence import coherence
+
+from fan_out import fan_out
+from feed_cache import feed_cache
+from like_buffer import like_buffer
+from metrics import render_metrics, render_samples
+from security import hashing_pool, user_cache
+from singleflight import single_flight
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# the stats() the in-process components already keep, read when /metrics is scraped
+def component_metrics() -> list[str]:
+    caches = {"user": user_cache.stats(), "feed": feed_cache.stats()}
+    pool = hashing_pool.stats()
+    buffer = like_buffer.stats()
+    timelines = fan_out.stats()
+    lines = []
+    for name, kind, documentation, key in (
+        ("cache_hits_total", "counter", "Cache lookups that found an entry", "hits"),
+        ("cache_misses_total", "counter", "Cache lookups that found nothing", "misses"),
+        ("cache_evictions_total", "counter", "Entries dropped to make room", "evictions"),
+        ("cache_entries", "gauge", "Entries in the cache", "size"),
+    ):
+        samples = [({"cache": cache}, stats[key]) for cache, stats in caches.items()]
+        lines += render_samples(name, documentation, kind, samples)
+    lines += render_samples("hashing_pool_workers", "Threads hashing passwords", "gauge", [({}, pool["workers"])])
+    lines += render_samples("hashing_pool_pending", "Hashes queued or running", "gauge", [({}, pool["pending"])])
+    lines += render_samples(
+        "hashing_pool_rejected_total", "Hashes rejected with a 503", "counter", [({}, pool["rejected"])]
+    )
+    lines += render_samples("like_buffer_pending", "Likes waiting to be written", "gauge", [({}, buffer["pending"])])
+    lines += render_samples(
+        "like_buffer_flushes_total", "Batches of likes written", "counter", [({}, buffer["flushes"])]
+    )
+    lines += render_samples(
+        "like_buffer_flushed_likes_total", "Likes written by the buffer", "counter", [({}, buffer["flushed_likes"])]
+    )
+    lines += render_samples("fan_out_pending", "Posts waiting to be fanned out", "gauge", [({}, timelines["pending"])])
+    lines += render_samples("fan_out_posts_total", "Posts fanned out", "counter", [({}, timelines["posts"])])
+    lines += render_samples(
+        "fan_out_timeline_rows_total", "Posts written into timelines", "counter", [({}, timelines["timeline_rows"])]
+    )
+    admission = {request_class: limiter.stats() for request_class, limiter in limiters.items()}
+    for name, kind, documentation, key in (
+        ("admission_concurrency", "gauge", "Requests of the class allowed to run at once", "concurrency"),
+        ("admission_active", "gauge", "Requests of the class running", "active"),
+        ("admission_queued", "gauge", "Requests of the class waiting for their turn", "queued"),
+        ("admission_admitted_total", "counter", "Requests of the class let through", "admitted"),
+    ):
+        samples = [({"class": request_class}, stats[key]) for request_class, stats in admission.items()]
+        lines += render_samples(name, documentation, kind, samples)
+    lines += render_samples("admission_rejected_total", "Requests answered 503 by admission control", "counter", [
+        ({"class": request_class, "reason": reason}, count)
+        for request_class, stats in admission.items() for reason, count in stats["rejected"].items()
+    ])
+    flights = single_flight.stats()
+    lines += render_samples("single_flight_queries_total", "Coalesced reads that ran their query", "counter", [
+        ({"read": kind}, count) for kind, count in flights["queries"].items()
+    ])
+    lines += render_samples("single_flight_shared_total", "Queries saved: callers served by a query in flight",
+                            "counter", [({"read": kind}, count) for kind, count in flights["shared"].items()])
+    lines += render_samples(
+        "coherence_invalidations_total", "Cached reads dropped after writes of other processes", "counter",
+        [({"kind": kind}, count) for kind, count in coherence.stats()["invalidations"].items()],
+    )
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    lines = render_metrics() + component_metrics()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,28 +1,61 @@
+import functools
+import re
+import sqlite3
+import time
+from collections import Counter
 from enum import Enum
 from typing import List, Annotated
 
 import sqlalchemy
-from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi import APIRouter, HTTPException, status, Request, Depends, Query, Response, Body, Header
 
-from database import comment_table, post_table, database, like_table
+from config import config
+from database import comment_table, post_table, database, like_table, insert_many, read_database
+from fan_out import fan_out
+from feed_cache import feed_cache, invalidate_feed
+from leaderboard import leaderboard, record_new_likes
+from like_buffer import like_buffer
+from metrics import timed_query
 from models.post import UserPost, UserPostIn, Comment, CommentIn, UserPostWithComments, PostLIkeIn, PostLIke, \
-    UserPostWithLikes
+    UserPostWithLikes, UserPostWithCommentPreview
 from models.user import User
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, InvalidCursor, decode_cursor, \
+    encode_cursor
 # oauth2_scheme reads the Request headers to find the Authorization value "Bearer [token]"
 from security import get_current_user, oauth2_scheme
+from serialization import json_response, rows_as
+from singleflight import single_flight
+from versions import etag_matches, versions
 
 router = APIRouter()
 
-select_post_and_likes = (
-    sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
-)
+# items accepted by every bulk endpoint in a single request
+MAX_BULK_ITEMS = 1000
+
+# latest comments shown with every post of /feed
+DEFAULT_PREVIEW_COMMENTS = 2
+MAX_PREVIEW_COMMENTS = 10
+
+# posts.likes is the denormalized counter updated by like_post, no join with the likes table needed
+select_post_and_likes = sqlalchemy.select(post_table)
 
 
 async def find_post(post_id: int):
     query = post_table.select().where(post_table.c.id == post_id)
-    return await database.fetch_one(query)
+    # only tells if the post exists (comments, likes), a query in flight is recent enough
+    return await single_flight.do(("find_post", post_id), lambda: read_database.fetch_one(query))
+
+
+# the client already has this version, nothing is read nor serialized
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+# likes still waiting in the write-behind buffer are part of the counts we serve
+def with_pending_likes(posts: list) -> list:
+    if not len(like_buffer):
+        return posts
+    return [{**post, "likes": post["likes"] + like_buffer.pending_likes(post["id"])} for post in posts]
 
 
 @router.post("/posts", response_model=UserPost, status_code=status.HTTP_201_CREATED)
@@ -30,6 +63,9 @@ async def create_post(post: UserPostIn, current_user: Annotated[User, Depends(ge
     data = {**post.model_dump(), "user_id": current_user.id}
     query = post_table.insert().values(data)
     last_record_id = await database.execute(query)
+    invalidate_feed()
+    leaderboard.add_post({**data, "id": last_record_id, "likes": 0})
+    fan_out.add(last_record_id, current_user.id)
     return {**data, "id": last_record_id}
 
 
@@ -37,38 +73,325 @@ class PostSorting(str, Enum):
     new = "new"
     old = "old"
     most_likes = "most_likes"
+    # likes of the last hours count the most (see leaderboard.py), a single page of at most LEADERBOARD_SIZE posts
+    trending = "trending"
 
 
-@router.get("/posts", response_model=List[UserPostWithLikes])
-async def get_posts(sorting: PostSorting = PostSorting.new):
+def posts_page_query(sorting: PostSorting, position: dict | None, limit: int):
+    # keyset pagination, every page starts right after the last row of the previous one
     match sorting:
         case PostSorting.new:
             query = select_post_and_likes.order_by(post_table.c.id.desc())
+            if position:
+                query = query.where(post_table.c.id < position["id"])
         case PostSorting.old:
             query = select_post_and_likes.order_by(post_table.c.id.asc())
+            if position:
+                query = query.where(post_table.c.id > position["id"])
         case PostSorting.most_likes:
-            query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+            # (likes, id) tiebreak so posts with the same amount of likes keep a stable order
+            query = select_post_and_likes.order_by(post_table.c.likes.desc(), post_table.c.id.desc())
+            if position:
+                # row value comparison, sqlite seeks into ix_posts_likes_id (an OR here sorts in a temp b-tree)
+                query = query.where(
+                    sqlalchemy.tuple_(post_table.c.likes, post_table.c.id) < (position["likes"], position["id"])
+                )
+
+    # one extra row tells us if there is a next page without counting the table
+    return query.limit(limit + 1)
+
+
+def read_cursor(cursor: str | None, sorting: PostSorting) -> dict | None:
+    if cursor is None:
+        return None
+    try:
+        position = decode_cursor(cursor, sorting.value)
+        return {key: int(value) for key, value in position.items()}
+    except (InvalidCursor, ValueError, TypeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+
+def next_cursor(sorting: PostSorting, last_post) -> str:
+    if sorting == PostSorting.most_likes:
+        return encode_cursor(sorting.value, likes=last_post["likes"], id=last_post["id"])
+    return encode_cursor(sorting.value, id=last_post["id"])
+
+
+# a page of posts and the cursor of the next one
+async def posts_page(sorting: PostSorting, limit: int, cursor: str | None) -> tuple[list, str | None]:
+    key = (sorting, cursor, limit)
+    page = None
+    if sorting == PostSorting.trending:
+        if cursor is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        page = (leaderboard.trending.top(limit), None)
+    elif sorting == PostSorting.most_likes and cursor is None and leaderboard.loaded and limit < leaderboard.size:
+        # first page straight from memory, its cursor carries on in the database
+        posts = leaderboard.most_liked.top(limit + 1)
+        page = (posts[:limit], next_cursor(sorting, posts[limit - 1]) if len(posts) > limit else None)
+    elif config.FEED_CACHE_ENABLED:
+        page = feed_cache.get(key)
+    if page is None:
+        position = read_cursor(cursor, sorting)
+        generation = feed_cache.generation
+        # the same page requested at once is read once, a new post or like (new generation) starts a new query
+        posts = await single_flight.do(
+            ("posts_page", sorting, cursor, limit, generation),
+            lambda: read_database.fetch_all(posts_page_query(sorting, position, limit)),
+        )
+        page = (posts[:limit], next_cursor(sorting, posts[limit - 1]) if len(posts) > limit else None)
+        # skipped if a write invalidated the cache while we were querying
+        feed_cache.set(key, page, generation=generation)
+    return page
+
+
+@router.get("/posts", response_model=List[UserPostWithLikes])
+async def get_posts(
+        response: Response,
+        sorting: PostSorting = PostSorting.new,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        if_none_match: Annotated[str | None, Header()] = None,
+):
+    # taken before reading, a write committed meanwhile gives the next request a new ETag
+    etag = versions.feed_etag()
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    posts, page_cursor = await posts_page(sorting, limit, cursor)
+    headers = {"ETag": etag, **({NEXT_CURSOR_HEADER: page_cursor} if page_cursor else {})}
+
+    posts = with_pending_likes(posts)
+    if config.FAST_SERIALIZATION:
+        return json_response(rows_as(UserPostWithLikes, posts), headers=headers)
+    response.headers.update(headers)
+    return posts
+
+
+# one index seek per post, newest first, with its count: SQLite has no LATERAL join and a window function would
+# read every comment of the post to number them. Plain SQL, built once per page size: compiling the same
+# statement with SQLAlchemy on every request took longer than running it
+@functools.lru_cache
+def latest_comments_sql(posts: int) -> str:
+    return " UNION ALL ".join(
+        f"""SELECT * FROM (
+            SELECT id, body, post_id, user_id,
+                (SELECT count(*) FROM comments WHERE post_id = :post_{i}) AS comment_count
+            FROM comments WHERE post_id = :post_{i} ORDER BY id DESC LIMIT :comments
+        )"""
+        for i in range(posts)
+    )
+
+
+def latest_comments_query(post_ids: list[int], comments: int) -> tuple:
+    if not comments:
+        # counting only, straight from ix_comments_post_id
+        query = (
+            sqlalchemy.select(comment_table.c.post_id, sqlalchemy.func.count().label("comment_count"))
+            .where(comment_table.c.post_id.in_(post_ids))
+            .group_by(comment_table.c.post_id)
+        )
+        return query, None
+    values = {f"post_{i}": post_id for i, post_id in enumerate(post_ids)}
+    return latest_comments_sql(len(post_ids)), {**values, "comments": comments}
+
+
+# post id -> (comment count, latest comments) for a whole page in a single query
+async def fetch_comment_previews(post_ids: list[int], comments: int) -> dict[int, tuple[int, list[dict]]]:
+    if not post_ids:
+        return {}
+    previews = {post_id: (0, []) for post_id in post_ids}
+    for row in await read_database.fetch_all(*latest_comments_query(post_ids, comments)):
+        count, latest = previews[row.post_id]
+        if comments:
+            latest.append({"id": row.id, "body": row.body, "post_id": row.post_id, "user_id": row.user_id})
+        previews[row.post_id] = (row.comment_count, latest)
+    return previews
+
+
+# GET /posts plus the comment count and latest comments of every post, what feed clients showed by calling
+# /posts/{post_id}/comments for each post
+@router.get("/feed", response_model=List[UserPostWithCommentPreview])
+async def get_feed(
+        response: Response,
+        sorting: PostSorting = PostSorting.new,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        comments: Annotated[int, Query(ge=0, le=MAX_PREVIEW_COMMENTS)] = DEFAULT_PREVIEW_COMMENTS,
+        if_none_match: Annotated[str | None, Header()] = None,
+):
+    # comments bump the feed version too (invalidate_feed)
+    etag = versions.feed_etag()
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    posts, page_cursor = await posts_page(sorting, limit, cursor)
+    headers = {"ETag": etag, **({NEXT_CURSOR_HEADER: page_cursor} if page_cursor else {})}
+
+    post_ids = [post["id"] for post in posts]
+    key = ("previews", tuple(post_ids), comments)
+    previews = feed_cache.get(key) if config.FEED_CACHE_ENABLED else None
+    if previews is None:
+        generation = feed_cache.generation
+        previews = await fetch_comment_previews(post_ids, comments)
+        feed_cache.set(key, previews, generation=generation)
+
+    feed = [
+        {**post, "comment_count": previews[post["id"]][0], "comments": previews[post["id"]][1]}
+        for post in rows_as(UserPostWithLikes, with_pending_likes(posts))
+    ]
+    if config.FAST_SERIALIZATION:
+        return json_response(feed, headers=headers)
+    response.headers.update(headers)
+    return feed
+
+
+# posts_fts is the FTS5 index of posts.body kept by triggers (see migrations.post_search). Best matches first
+# (bm25, lower is better), the cursor is the (rank, id) of the last post of the page
+search_posts_query = """
+    SELECT posts.id, posts.body, posts.user_id, posts.likes, posts_fts.rank
+    FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid
+    WHERE posts_fts MATCH :match {after}
+    ORDER BY posts_fts.rank, posts_fts.rowid
+    LIMIT :limit
+"""
+
 
-    return await database.fetch_all(query)
+def read_search_cursor(cursor: str) -> dict:
+    try:
+        position = decode_cursor(cursor, "search")
+        return {"rank": float(position["rank"]), "id": int(position["id"])}
+    except (InvalidCursor, KeyError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+
+# every word of the query must be in the post. Quoted so FTS5 operators (AND, NEAR, *, -...) are plain text
+def match_expression(q: str) -> str:
+    return " ".join(f'"{term}"' for term in re.findall(r"\w+", q))
+
+
+@router.get("/posts/search", response_model=List[UserPostWithLikes])
+async def search_posts(
+        response: Response,
+        q: Annotated[str, Query(min_length=1)],
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+):
+    match = match_expression(q)
+    posts = []
+    if match:
+        values = {"match": match, "limit": limit + 1}
+        after = ""
+        if cursor is not None:
+            values.update(read_search_cursor(cursor))
+            after = "AND (posts_fts.rank, posts_fts.rowid) > (:rank, :id)"
+        posts = await read_database.fetch_all(search_posts_query.format(after=after), values)
+
+    headers = {}
+    if len(posts) > limit:
+        last_post = posts[limit - 1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor("search", rank=last_post.rank, id=last_post.id)
+        posts = posts[:limit]
+
+    posts = with_pending_likes(posts)
+    if config.FAST_SERIALIZATION:
+        return json_response(rows_as(UserPostWithLikes, posts), headers=headers)
+    response.headers.update(headers)
+    return posts
 
 
 @router.get("/posts/{post_id}/comments", response_model=List[Comment])
-async def get_comments_on_post(post_id: int):
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
-    return await database.fetch_all(query)
+async def get_comments_on_post(
+        post_id: int,
+        response: Response,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        if_none_match: Annotated[str | None, Header()] = None,
+):
+    etag = versions.post_etag(post_id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    # oldest first, keyset on the id: ix_comments_post_id keeps them ordered by id within a post
+    query = comment_table.select().where(comment_table.c.post_id == post_id).order_by(comment_table.c.id)
+    if cursor is not None:
+        try:
+            after_id = int(decode_cursor(cursor, "comments")["id"])
+        except (InvalidCursor, KeyError, ValueError, TypeError) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+        query = query.where(comment_table.c.id > after_id)
+    comments = await read_database.fetch_all(query.limit(limit + 1))
+
+    headers = {"ETag": etag}
+    if len(comments) > limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor("comments", id=comments[limit - 1].id)
+        comments = comments[:limit]
+    if config.FAST_SERIALIZATION:
+        return json_response(rows_as(Comment, comments), headers=headers)
+    response.headers.update(headers)
+    return comments
+
+
+# one row per comment (or a single row with NULL comment columns), a post and its comments in one round trip
+select_post_with_comments = sqlalchemy.select(
+    post_table,
+    comment_table.c.id.label("comment_id"),
+    comment_table.c.body.label("comment_body"),
+    comment_table.c.user_id.label("comment_user_id"),
+).select_from(post_table.outerjoin(comment_table))
+
+
+async def fetch_posts_with_comments(post_ids: list[int]) -> dict[int, dict]:
+    # comments come out of ix_comments_post_id already ordered by id, no sorting needed
+    query = select_post_with_comments.where(post_table.c.id.in_(post_ids)).order_by(
+        post_table.c.id, comment_table.c.id
+    )
+    posts = {}
+    for row in await read_database.fetch_all(query):
+        if row.id not in posts:
+            posts[row.id] = {
+                "post": {
+                    "id": row.id,
+                    "body": row.body,
+                    "user_id": row.user_id,
+                    "likes": row.likes + like_buffer.pending_likes(row.id),
+                },
+                "comments": [],
+            }
+        if row.comment_id is not None:
+            posts[row.id]["comments"].append(
+                {"id": row.comment_id, "body": row.comment_body, "post_id": row.id, "user_id": row.comment_user_id}
+            )
+    return posts
+
+
+# declared before /posts/{post_id} so "batch" isn't read as a post id
+@router.get("/posts/batch", response_model=List[UserPostWithComments])
+async def get_posts_with_comments(ids: Annotated[List[int], Query(min_length=1, max_length=MAX_PAGE_SIZE)]):
+    posts = await fetch_posts_with_comments(ids)
+    # same order as requested, unknown ids are skipped
+    found = [posts[post_id] for post_id in dict.fromkeys(ids) if post_id in posts]
+    # built field by field by fetch_posts_with_comments, already in the response shape
+    if config.FAST_SERIALIZATION:
+        return json_response(found)
+    return found
 
 
 @router.get("/posts/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
-    query = select_post_and_likes.where(post_table.c.id == post_id)
-    post = await database.fetch_one(query)
+async def get_post_with_comments(
+        post_id: int, response: Response, if_none_match: Annotated[str | None, Header()] = None
+):
+    # bumped by its comments and likes, checked before select_post_with_comments runs
+    etag = versions.post_etag(post_id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    # keyed by the version too: a request that comes after a comment or like never gets a query started before it
+    posts = await single_flight.do(("post_with_comments", post_id, etag), lambda: fetch_posts_with_comments([post_id]))
+    post = posts.get(post_id)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found!")
 
-    return {
-        "post": post,
-        "comments": await get_comments_on_post(post_id)
-    }
+    if config.FAST_SERIALIZATION:
+        return json_response(post, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return post
 
 
 @router.post("/comments", response_model=Comment, status_code=status.HTTP_201_CREATED)
@@ -80,17 +403,125 @@ async def create_post(comment: CommentIn, request: Request, current_user: Annota
     data = {**comment.model_dump(), "user_id": current_user.id}
     query = comment_table.insert().values(data)
     last_record_id = await database.execute(query)
+    versions.bump_posts([comment.post_id])
+    # cached /feed previews have the comment counts
+    invalidate_feed()
     return {**data, "id": last_record_id}
 
 
+async def buffer_like(like: PostLIkeIn, response: Response, current_user: User):
+    # one indexed read, the insert itself waits in the buffer
+    already_liked = sqlalchemy.exists().where(
+        like_table.c.post_id == post_table.c.id, like_table.c.user_id == current_user.id
+    )
+    query = sqlalchemy.select(post_table.c.id, already_liked.label("liked")).where(post_table.c.id == like.post_id)
+    post = await read_database.fetch_one(query)
+    if not post:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found!")
+    if post.liked or like_buffer.contains(like.post_id, current_user.id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Post already liked")
+
+    like_buffer.add(like.post_id, current_user.id)
+    # pending likes are part of the counts we serve already
+    versions.bump_posts([like.post_id])
+    versions.bump_feed()
+    response.status_code = status.HTTP_202_ACCEPTED
+    return {"id": None, **like.model_dump(), "user_id": current_user.id}
+
+
 @router.post("/like", response_model=PostLIke, status_code=status.HTTP_201_CREATED)
-async def like_post(like: PostLIkeIn, current_user: Annotated[User, Depends(get_current_user)]):
+async def like_post(
+        like: PostLIkeIn, response: Response, current_user: Annotated[User, Depends(get_current_user)]
+):
+    if config.LIKE_WRITE_BEHIND:
+        return await buffer_like(like, response, current_user)
+
     post = await find_post(like.post_id)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found!")
 
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
+    created_at = time.time()
+    query = like_table.insert().values(**data, created_at=created_at)
+    # same transaction, the counter never drifts from the likes table
+    increment_likes = (
+        post_table.update()
+        .where(post_table.c.id == like.post_id)
+        .values(likes=post_table.c.likes + 1)
+        .returning(*post_table.c)
+    )
 
-    last_record_id = await database.execute(query)
+    try:
+        async with database.transaction():
+            last_record_id = await database.execute(query)
+            post = await database.fetch_one(increment_likes)
+    except sqlite3.IntegrityError as e:
+        # ux_likes_post_id_user_id, a user can like a post only once
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Post already liked") from e
+    versions.bump_posts([like.post_id])
+    invalidate_feed()
+    await record_new_likes([{**post}])
     return {"id": last_record_id, **data}
+
+
+async def check_posts_exist(post_ids: set[int]):
+    query = sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(post_ids))
+    missing = post_ids - {row.id for row in await read_database.fetch_all(query)}
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Posts not found: {sorted(missing)}")
+
+
+@router.post("/posts/bulk", response_model=List[UserPost], status_code=status.HTTP_201_CREATED)
+async def create_posts(
+        posts: Annotated[List[UserPostIn], Body(min_length=1, max_length=MAX_BULK_ITEMS)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    rows = [{**post.model_dump(), "user_id": current_user.id} for post in posts]
+    async with database.transaction():
+        ids = await insert_many(post_table, rows)
+    invalidate_feed()
+    for row, post_id in zip(rows, ids):
+        leaderboard.add_post({**row, "id": post_id, "likes": 0})
+        fan_out.add(post_id, current_user.id)
+    return [{**row, "id": post_id} for row, post_id in zip(rows, ids)]
+
+
+@router.post("/comments/bulk", response_model=List[Comment], status_code=status.HTTP_201_CREATED)
+async def create_comments(
+        comments: Annotated[List[CommentIn], Body(min_length=1, max_length=MAX_BULK_ITEMS)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    await check_posts_exist({comment.post_id for comment in comments})
+
+    rows = [{**comment.model_dump(), "user_id": current_user.id} for comment in comments]
+    async with database.transaction():
+        ids = await insert_many(comment_table, rows)
+    versions.bump_posts({row["post_id"] for row in rows})
+    invalidate_feed()
+    return [{**row, "id": comment_id} for row, comment_id in zip(rows, ids)]
+
+
+@router.post("/like/bulk", response_model=List[PostLIke], status_code=status.HTTP_201_CREATED)
+async def like_posts(
+        likes: Annotated[List[PostLIkeIn], Body(min_length=1, max_length=MAX_BULK_ITEMS)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    await check_posts_exist({like.post_id for like in likes})
+
+    created_at = time.time()
+    rows = [{**like.model_dump(), "user_id": current_user.id, "created_at": created_at} for like in likes]
+    likes_per_post = Counter(row["post_id"] for row in rows)
+    increment_likes = "UPDATE posts SET likes = likes + ? WHERE id = ?"
+    try:
+        async with database.transaction():
+            ids = await insert_many(like_table, rows)
+            increments = [(amount, post_id) for post_id, amount in likes_per_post.items()]
+            with timed_query("execute_many", increment_likes, increments):
+                await database.connection().raw_connection.executemany(increment_likes, increments)
+    except sqlite3.IntegrityError as e:
+        # nothing is stored if any post was already liked (or is repeated in the request)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Post already liked") from e
+    versions.bump_posts(likes_per_post)
+    invalidate_feed()
+    await record_new_likes()
+    return [{**row, "id": like_id} for row, like_id in zip(rows, ids)]
@@ -0,0 +1,166 @@
+import functools
+import sqlite3
+from typing import List, Annotated
+
+import sqlalchemy
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+
+from config import config
+from database import database, follow_table, post_table, read_database, user_table
+from fan_out import fan_out
+from models.post import UserPostWithLikes
+from models.user import Follow, FollowIn, User
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, InvalidCursor, decode_cursor, \
+    encode_cursor
+from routers.post import with_pending_likes
+from security import get_current_user
+from serialization import json_response, rows_as
+
+router = APIRouter()
+
+# authors read at request time per query, below the sqlite limit of terms in a compound SELECT
+MAX_AUTHORS_PER_QUERY = 100
+# the first page starts before any post id
+FIRST_POST_ID = 2 ** 63 - 1
+
+# the latest posts of the new followee go into the timeline of the follower right away
+backfill_timeline = """
+    INSERT OR IGNORE INTO timelines (user_id, post_id)
+    SELECT :follower_id, id FROM posts WHERE user_id = :followee_id ORDER BY id DESC LIMIT :posts
+"""
+# ix_posts_user_id_id, only the posts of the followee are looked at
+drop_from_timeline = """
+    DELETE FROM timelines
+    WHERE user_id = :follower_id AND post_id IN (SELECT id FROM posts WHERE user_id = :followee_id)
+"""
+
+
+async def find_user(user_id: int):
+    query = user_table.select().where(user_table.c.id == user_id)
+    return await read_database.fetch_one(query)
+
+
+@router.post("/follow", response_model=Follow, status_code=status.HTTP_201_CREATED)
+async def follow(follow_in: FollowIn, current_user: Annotated[User, Depends(get_current_user)]):
+    if follow_in.user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Users can not follow themselves")
+    followee = await find_user(follow_in.user_id)
+    if not followee:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    data = {"follower_id": current_user.id, "followee_id": followee.id}
+    try:
+        async with database.transaction():
+            await database.execute(follow_table.insert().values(data))
+            await database.execute(
+                user_table.update().where(user_table.c.id == followee.id).values(followers=user_table.c.followers + 1)
+            )
+            # posts of accounts read at request time are never copied
+            if followee.followers < config.FAN_OUT_MAX_FOLLOWERS:
+                await database.execute(backfill_timeline, {**data, "posts": config.TIMELINE_BACKFILL_POSTS})
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User already followed") from e
+    return {"user_id": followee.id, "follower_id": current_user.id}
+
+
+@router.delete("/follow/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow(user_id: int, current_user: Annotated[User, Depends(get_current_user)]):
+    followee = await find_user(user_id)
+    data = {"follower_id": current_user.id, "followee_id": user_id}
+    async with database.transaction():
+        # RETURNING tells if there was a follow to remove, in the same statement
+        query = follow_table.delete().where(
+            follow_table.c.follower_id == current_user.id, follow_table.c.followee_id == user_id
+        ).returning(follow_table.c.followee_id)
+        if followee is None or await database.fetch_one(query) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not followed")
+        followers = await database.fetch_val(
+            user_table.update().where(user_table.c.id == user_id).values(followers=user_table.c.followers - 1)
+            .returning(user_table.c.followers)
+        )
+        await database.execute(drop_from_timeline, data)
+    # back under the threshold, the posts of the author are not read on request anymore: the latest ones (maybe
+    # written while they were) are fanned out to the remaining followers, like a new follow gets them
+    if followers == config.FAN_OUT_MAX_FOLLOWERS - 1:
+        query = (
+            sqlalchemy.select(post_table.c.id).where(post_table.c.user_id == user_id)
+            .order_by(post_table.c.id.desc()).limit(config.TIMELINE_BACKFILL_POSTS)
+        )
+        for row in await read_database.fetch_all(query):
+            fan_out.add(row.id, user_id)
+
+
+# the authors whose posts are not fanned out: the user and the followed accounts with too many followers
+async def authors_read_on_request(user_id: int) -> list[int]:
+    query = (
+        sqlalchemy.select(follow_table.c.followee_id)
+        .select_from(follow_table.join(user_table, user_table.c.id == follow_table.c.followee_id))
+        .where(follow_table.c.follower_id == user_id, user_table.c.followers >= config.FAN_OUT_MAX_FOLLOWERS)
+    )
+    return [user_id] + [row.followee_id for row in await read_database.fetch_all(query)]
+
+
+# one range of the materialized timeline plus one index seek per author read on request, each of them at most
+# a page long: a page costs O(page size * authors) rows whatever the size of the timeline. Plain SQL built once
+# per amount of authors, like the comment previews of /feed
+@functools.lru_cache
+def timeline_sql(authors: int, materialized: bool) -> str:
+    arms = [
+        f"""SELECT * FROM (
+            SELECT id, body, user_id, likes FROM posts
+            WHERE user_id = :author_{i} AND id < :before ORDER BY id DESC LIMIT :limit
+        )"""
+        for i in range(authors)
+    ]
+    if materialized:
+        arms.append("""SELECT * FROM (
+            SELECT posts.id, posts.body, posts.user_id, posts.likes
+            FROM timelines JOIN posts ON posts.id = timelines.post_id
+            WHERE timelines.user_id = :user_id AND timelines.post_id < :before
+            ORDER BY timelines.post_id DESC LIMIT :limit
+        )""")
+    return " UNION ALL ".join(arms)
+
+
+async def timeline_page(user_id: int, limit: int, before: int) -> list:
+    authors = await authors_read_on_request(user_id)
+    posts = {}
+    for start in range(0, len(authors), MAX_AUTHORS_PER_QUERY):
+        chunk = authors[start:start + MAX_AUTHORS_PER_QUERY]
+        values = {f"author_{i}": author for i, author in enumerate(chunk)}
+        values.update({"before": before, "limit": limit + 1})
+        # the materialized timeline is read with the first chunk only
+        if start == 0:
+            values["user_id"] = user_id
+        query = timeline_sql(len(chunk), start == 0)
+        # a post can be in both when its author got past FAN_OUT_MAX_FOLLOWERS
+        posts.update((row.id, row) for row in await read_database.fetch_all(query, values))
+    # newest first, the extra row tells if there is a next page
+    return [posts[post_id] for post_id in sorted(posts, reverse=True)[:limit + 1]]
+
+
+@router.get("/timeline", response_model=List[UserPostWithLikes])
+async def get_timeline(
+        response: Response,
+        current_user: Annotated[User, Depends(get_current_user)],
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+):
+    before = FIRST_POST_ID
+    if cursor is not None:
+        try:
+            before = int(decode_cursor(cursor, "timeline")["id"])
+        except (InvalidCursor, KeyError, ValueError, TypeError) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+    posts = await timeline_page(current_user.id, limit, before)
+
+    headers = {}
+    if len(posts) > limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor("timeline", id=posts[limit - 1].id)
+        posts = posts[:limit]
+
+    posts = with_pending_likes(posts)
+    if config.FAST_SERIALIZATION:
+        return json_response(rows_as(UserPostWithLikes, posts), headers=headers)
+    response.headers.update(headers)
+    return posts
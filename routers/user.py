@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, status
 from models.user import UserIn
 from database import database, user_table
-from security import get_password_hash, get_user, authenticate_user, create_access_token
+from security import get_password_hash_async, get_user, authenticate_user, create_access_token, invalidate_user
 
 router = APIRouter()
 
@@ -13,15 +13,16 @@ async def register(user: UserIn):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="A user with that email already exists"
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     query = user_table.insert().values(email=user.email, password=hashed_password)
 
     await database.execute(query)
+    invalidate_user(user.email)
     return {"detail": "User created."}
 
 
 @router.post("/token")
 async def login(user: UserIn):
     user = await authenticate_user(user.email, user.password)
-    access_token = create_access_token(user.email)
+    access_token = create_access_token(user.email, user.id)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -1,30 +1,102 @@
+import asyncio
 import datetime
-from typing import Annotated
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, Callable
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, ExpiredSignatureError, JWTError
 from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
 
-from database import database, user_table
+from cache import TTLCache
+from coherence import coherence, on_change
+from config import config
+from database import database, read_database, user_table
+from lazy import Lazy
+from singleflight import single_flight
 
 SECRET_KEY = "SUPER-HARD-KEY-HERE-THIS-IS-TEST-PURPOSE"
 ALGORITHM = "HS256"
-pwd_context = CryptContext(schemes=["bcrypt"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
+# New passwords are hashed with the first of PASSWORD_HASH_SCHEMES and PASSWORD_HASH_ROUNDS, the other schemes are
+# only verified. Hashes of another scheme or cost are outdated (needs_update), authenticate_user replaces them.
+def create_pwd_context() -> CryptContext:
+    scheme = config.PASSWORD_HASH_SCHEMES[0]
+    settings = {}
+    if config.PASSWORD_HASH_ROUNDS is not None:
+        rounds = config.PASSWORD_HASH_ROUNDS
+        # min = max: a cheaper hash is upgraded, a more expensive one too (the cost was lowered for throughput)
+        settings = {f"{scheme}__rounds": rounds, f"{scheme}__min_rounds": rounds, f"{scheme}__max_rounds": rounds}
+    return CryptContext(schemes=config.PASSWORD_HASH_SCHEMES, default=scheme, deprecated="auto", **settings)
+
+
+pwd_context = Lazy(create_pwd_context)
+
 credential_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials"
 )
 
 
+# bcrypt blocks for tens of milliseconds, it runs in a thread pool (bcrypt releases the GIL) so the event loop
+# keeps serving other requests. When too many hashes are waiting we answer 503 instead of queueing forever.
+class HashingPool:
+    def __init__(self, workers: int | None, max_pending: int):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def run(self, fn: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, try again later",
+                headers={"Retry-After": "1"},
+            )
+        if self.workers == 0:
+            return fn(*args)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hashing")
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "rejected": self.rejected}
+
+
+hashing_pool = Lazy(lambda: HashingPool(workers=config.HASHING_WORKERS, max_pending=config.HASHING_MAX_PENDING))
+
+# users already verified by get_current_user, keyed by the token subject (email)
+user_cache = Lazy(lambda: TTLCache(max_size=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL_SECONDS))
+
+
 def access_token_expire_minutes() -> int:
     return 30
 
 
-def create_access_token(email: str):
+def create_access_token(email: str, user_id: int | None = None):
     expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=access_token_expire_minutes())
     jwt_data = {"sub": email, "exp": expire}
+    if user_id is not None:
+        # lets get_current_user check a cached user is still the same account
+        jwt_data["uid"] = user_id
     encoded_jwt = jwt.encode(jwt_data, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -37,21 +109,97 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# (matches, the new hash when the stored one is outdated)
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+# the rounds of `scheme` whose hash takes the closest to `target_seconds` without going over (the cheapest
+# when even that one is slower) on this machine, with the time a hash took
+def calibrate_rounds(scheme: str, target_seconds: float, samples: int = 3) -> tuple[int, float]:
+    try:
+        handler = get_crypt_handler(scheme)
+    except KeyError:
+        raise ValueError(f"Unknown password hash scheme {scheme}") from None
+    if "rounds" not in handler.setting_kwds:
+        raise ValueError(f"{scheme} has no configurable cost")
+
+    def measure(rounds: int) -> float:
+        hasher = handler.using(rounds=rounds)
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            hasher.hash("calibration-password")
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    # log2: every round doubles the cost, walk up from the cheapest
+    if handler.rounds_cost == "log2":
+        rounds, elapsed = handler.min_rounds, measure(handler.min_rounds)
+        while rounds < handler.max_rounds:
+            next_elapsed = measure(rounds + 1)
+            if next_elapsed > target_seconds:
+                break
+            rounds, elapsed = rounds + 1, next_elapsed
+        return rounds, elapsed
+
+    # linear: the cost is proportional to the rounds, scaled from the default
+    elapsed = measure(handler.default_rounds)
+    rounds = int(handler.default_rounds * target_seconds / elapsed)
+    rounds = max(handler.min_rounds, min(handler.max_rounds, rounds))
+    return rounds, measure(rounds)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_pool.run(get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await hashing_pool.run(verify_and_update_password, plain_password, hashed_password)
+
+
 async def get_user(email: str):
     query = user_table.select().where(user_table.c.email == email)
-    result = await database.fetch_one(query)
+    # a login storm of the same account, or its first requests with a new token, read it once
+    result = await single_flight.do(("get_user", email), lambda: read_database.fetch_one(query))
 
     if result:
         return result
 
 
+# must be called every time the email or password of a user changes (the followers counter is never read from the cache)
+def invalidate_user(email: str):
+    user_cache.invalidate(email)
+    coherence.publish("users")
+
+
+@on_change("users")
+def drop_users():
+    user_cache.clear()
+
+
 async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         raise credential_exception
-    if not verify_password(password, user.password):
+    matches, new_hash = await verify_and_update_password_async(password, user.password)
+    if not matches:
         raise credential_exception
 
+    # the password is only known at login: outdated hashes are upgraded here. Unless the password was changed
+    # in the meantime
+    if new_hash is not None:
+        query = (
+            user_table.update()
+            .where(user_table.c.id == user.id, user_table.c.password == user.password)
+            .values(password=new_hash)
+        )
+        await database.execute(query)
+        invalidate_user(email)
     return user
 
 
@@ -59,6 +207,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     try:
         payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
+        user_id = payload.get("uid")
         if email is None:
             raise credential_exception
     except ExpiredSignatureError as e:
@@ -69,7 +218,16 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         ) from e
     except JWTError as e:
         raise credential_exception from e
-    user = await get_user(email=email)
+
+    user = user_cache.get(email)
     if user is None:
+        user = await get_user(email=email)
+        if user is None:
+            raise credential_exception
+        user_cache.set(email, user)
+
+    # the email was registered again by another account after the token was issued
+    if user_id is not None and user.id != user_id:
+        invalidate_user(email)
         raise credential_exception
     return user
\ No newline at end of file
@@ -0,0 +1,17 @@
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+# Rows read from our own tables already have the shape of the response models, validating them again through the
+# route response_model (and encoding them with the stdlib json) costs more than the query itself on big pages.
+# The fast path copies the model fields out of the rows and encodes them with orjson. Routes keep their
+# response_model, the OpenAPI schema stays the same.
+
+
+def rows_as(model: type[BaseModel], rows) -> list[dict]:
+    fields = tuple(model.model_fields)
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def json_response(content, headers: dict | None = None) -> Response:
+    return Response(content=orjson.dumps(content), media_type="application/json", headers=headers)
@@ -0,0 +1,103 @@
+# Multi-process server: the app is imported once and the listening socket bound before forking --workers processes
+# that share it (the kernel spreads the connections), so every core serves requests.
+#   python serve.py [--host 127.0.0.1] [--port 8000] [--workers <cores>]
+# Each worker keeps its own caches, leaderboard and version tokens, coherence.py keeps them in sync with the writes
+# of the others. A worker that dies is started again, SIGTERM / SIGINT stop them all gracefully.
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from coherence import coherence, shared_generations
+from database import setup_schema
+from main import app
+
+# a worker crashing faster than this on start isn't started again
+MIN_WORKER_UPTIME_SECONDS = 1
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index: int, sock: socket.socket, generations, args):
+    coherence.attach(generations, index)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=args.log_level, timeout_graceful_shutdown=10))
+    server.run(sockets=[sock])
+    # no parent's atexit handlers or buffers flushed twice
+    os._exit(0)
+
+
+def spawn(index: int, sock: socket.socket, generations, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(index, sock, generations, args)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main(args):
+    # preload: the app imported above, settings read and migrations applied once, before any worker starts
+    setup_schema()
+    sock = bind(args.host, args.port)
+    generations = shared_generations(args.workers)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers", flush=True)
+
+    workers: dict[int, tuple[int, float]] = {}
+    for index in range(args.workers):
+        workers[spawn(index, sock, generations, args)] = (index, time.monotonic())
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    exit_code = 0
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in workers:
+            continue
+        index, started = workers.pop(pid)
+        if stopping:
+            continue
+        if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+            print(f"Worker {index} failed on start (status {status}), stopping", file=sys.stderr, flush=True)
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        print(f"Worker {index} exited (status {status}), starting it again", file=sys.stderr, flush=True)
+        workers[spawn(index, sock, generations, args)] = (index, time.monotonic())
+    sock.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="warning")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,48 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Hashable
+
+from config import config
+from lazy import Lazy
+
+
+# Request coalescing: identical reads running at the same time share a single query. The first caller starts it,
+# the others await the same result; it's forgotten as soon as it completes, a caller that comes later runs a new
+# one and sees every write committed meanwhile. Keys must change with the data when a write could be committed
+# while a query is in flight and the caller expects to see it (post versions, the feed cache generation...).
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        # per kind (the first item of the key): queries run, callers served by a query already in flight
+        self.queries: Counter = Counter()
+        self.shared: Counter = Counter()
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not config.SINGLE_FLIGHT_ENABLED:
+            return await fn()
+        task = self._calls.get(key)
+        if task is None:
+            self.queries[key[0]] += 1
+            # its own task: a caller that goes away (client disconnect) doesn't cancel it for the others
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared[key[0]] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # every caller may have gone away, the error is still marked as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> dict:
+        return {"queries": dict(self.queries), "shared": dict(self.shared)}
+
+
+single_flight = Lazy(SingleFlight)
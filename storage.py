@@ -0,0 +1,129 @@
+import asyncio
+import sqlite3
+import typing
+
+import aiosqlite
+import databases
+from databases.backends.sqlite import SQLiteBackend, SQLiteConnection, SQLitePool, SQLiteTransaction
+
+from coherence import coherence
+from metrics import InstrumentedDatabase
+
+# SQLite production profile: WAL so readers don't block the writer (and the other way around), tuned pragmas on
+# every connection, and connections kept open in small pools instead of one new connection per query.
+# database.py builds one writer pool of a single connection and one pool of read-only connections with it.
+
+
+def profile_pragmas(synchronous: str, cache_size_kib: int, mmap_size: int, busy_timeout_ms: int) -> list[str]:
+    return [
+        f"PRAGMA synchronous = {synchronous}",
+        # negative value = size in KiB instead of pages
+        f"PRAGMA cache_size = -{cache_size_kib}",
+        f"PRAGMA mmap_size = {mmap_size}",
+        f"PRAGMA busy_timeout = {busy_timeout_ms}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+
+
+def connection_factory(pragmas: list[str], read_only: bool) -> type[sqlite3.Connection]:
+    class ProfiledConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # WAL is stored in the database file, the writer switches it on once and every connection uses it
+            if not read_only:
+                self.execute("PRAGMA journal_mode = WAL")
+            for pragma in pragmas:
+                self.execute(pragma)
+            if read_only:
+                self.execute("PRAGMA query_only = ON")
+
+    return ProfiledConnection
+
+
+# at most `size` connections, idle ones are reused. A pool of size 1 is a single writer: every other
+# task waits for it, so writes queue in the app instead of failing with "database is locked"
+class SQLiteConnectionPool(SQLitePool):
+    def __init__(self, url: databases.DatabaseURL, size: int, **options: typing.Any):
+        super().__init__(url, **options)
+        self.size = size
+        self._slots = asyncio.Semaphore(size)
+        self._idle: list[aiosqlite.Connection] = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            return await super().acquire()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, connection: aiosqlite.Connection):
+        if connection.in_transaction:
+            # never hand a connection with an open transaction to the next task
+            await super().release(connection)
+        else:
+            self._idle.append(connection)
+        self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            await super().release(self._idle.pop())
+
+
+# Write transactions take the write lock when they start. A deferred BEGIN only takes it at the first write: two
+# transactions that read first (the posts_fts triggers read the index) both hold a shared lock, neither can
+# upgrade and sqlite fails one of them right away with "database is locked", without waiting for the busy timeout.
+# BEGIN IMMEDIATE waits for the lock (busy timeout) before the transaction has read anything.
+class ImmediateTransaction(SQLiteTransaction):
+    async def start(self, is_root: bool, extra_options: dict):
+        if not is_root:
+            await super().start(is_root, extra_options)
+            return
+        self._is_root = True
+        async with self._connection._connection.execute("BEGIN IMMEDIATE") as cursor:
+            await cursor.close()
+
+    async def commit(self):
+        await super().commit()
+        if self._is_root:
+            coherence.record_commit()
+
+
+# commits of the writer are counted, the other workers don't take them for writes of another process (coherence.py)
+class ImmediateConnection(SQLiteConnection):
+    def transaction(self) -> ImmediateTransaction:
+        return ImmediateTransaction(self)
+
+    # autocommit, or part of a transaction that commits later: counted either way (execute_many calls it too)
+    async def execute(self, query):
+        result = await super().execute(query)
+        coherence.record_commit()
+        return result
+
+
+class ImmediateSQLiteBackend(SQLiteBackend):
+    def connection(self) -> ImmediateConnection:
+        return ImmediateConnection(self._pool, self._dialect)
+
+
+# the writer of the default profile, one new connection per task like databases does
+class WriterDatabase(InstrumentedDatabase):
+    SUPPORTED_BACKENDS = {**InstrumentedDatabase.SUPPORTED_BACKENDS, "sqlite": "storage:ImmediateSQLiteBackend"}
+
+
+class ProfiledSQLiteBackend(ImmediateSQLiteBackend):
+    def __init__(self, database_url, *, pool_size: int, pragmas: list[str], read_only: bool = False, **options):
+        super().__init__(database_url, **options)
+        self._pool = SQLiteConnectionPool(
+            self._database_url, pool_size, factory=connection_factory(pragmas, read_only), **options
+        )
+
+    async def disconnect(self):
+        await self._pool.close()
+        await super().disconnect()
+
+
+class ProfiledDatabase(InstrumentedDatabase):
+    SUPPORTED_BACKENDS = {**InstrumentedDatabase.SUPPORTED_BACKENDS, "sqlite": "storage:ProfiledSQLiteBackend"}
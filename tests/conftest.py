@@ -7,9 +7,16 @@ from fastapi.testclient import TestClient
 from httpx import AsyncClient
 
 os.environ["ENV_STATE"] = "test"  # to run test in "test" mode
+os.environ["TEST_PASSWORD_HASH_ROUNDS"] = "4"  # the cheapest bcrypt, tests hash a lot of passwords (benchmarks don't)
 
-from database import database, user_table  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from database import database, setup_schema, user_table  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
 from main import app  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from leaderboard import load_leaderboard  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from fan_out import fan_out  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from feed_cache import feed_cache  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from like_buffer import like_buffer  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from security import user_cache  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
+from versions import versions  # noqa: E402 <- avoid linter to send this line above the "os.envirion"
 
 
 # This means thest will run once per session
@@ -18,6 +25,12 @@ def anyio_backend():
     return "asyncio"
 
 
+# importing the app doesn't touch the database anymore, the schema is created once for the whole session
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    setup_schema()
+
+
 @pytest.fixture()
 def client() -> Generator:
     yield TestClient(app)
@@ -26,10 +39,24 @@ def client() -> Generator:
 @pytest.fixture(autouse=True)
 async def db() -> Generator:
     await database.connect()
+    # what the lifespan does at startup (the test client doesn't run it)
+    await load_leaderboard()
     yield  # <- run the test function here
     await database.disconnect()
 
 
+# every test rolls back the database, in-process caches must not keep rows from a previous test
+@pytest.fixture(autouse=True)
+def clear_caches():
+    user_cache.clear()
+    feed_cache.clear()
+    like_buffer.clear()
+    fan_out.clear()
+    # post ids are reused once a test rolls back
+    versions.reset()
+    yield
+
+
 # Implement httpx to make the requests
 @pytest.fixture()
 async def async_client(client) -> AsyncGenerator:
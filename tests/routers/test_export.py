@@ -0,0 +1,100 @@
+import json
+import sqlite3
+from unittest.mock import ANY
+
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+
+from migrations import migrate
+from routers import export
+from storage import WriterDatabase
+from tests.routers.test_post import bearer_headers, create_comment, create_post, like_post
+
+
+def ndjson(response) -> list[dict]:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.anyio
+async def test_export_posts(async_client: AsyncClient, logged_in_token: str):
+    first_post = await create_post("First post", async_client, logged_in_token)
+    second_post = await create_post("Second post", async_client, logged_in_token)
+
+    response = await async_client.get("/export/posts", headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert ndjson(response) == [{**first_post, "likes": 0}, {**second_post, "likes": 0}]
+
+
+@pytest.mark.anyio
+async def test_export_since_id(async_client: AsyncClient, logged_in_token: str):
+    first_post = await create_post("First post", async_client, logged_in_token)
+    second_post = await create_post("Second post", async_client, logged_in_token)
+
+    response = await async_client.get(
+        "/export/posts", params={"since_id": first_post["id"]}, headers=bearer_headers(logged_in_token)
+    )
+
+    assert [post["id"] for post in ndjson(response)] == [second_post["id"]]
+
+
+@pytest.mark.anyio
+async def test_export_comments_and_likes(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("Post", async_client, logged_in_token)
+    comment = await create_comment("Comment", post["id"], async_client, logged_in_token)
+    like = await like_post(post["id"], async_client, logged_in_token)
+
+    headers = bearer_headers(logged_in_token)
+    assert ndjson(await async_client.get("/export/comments", headers=headers)) == [comment]
+    assert ndjson(await async_client.get("/export/likes", headers=headers)) == [{**like, "created_at": ANY}]
+
+
+@pytest.mark.anyio
+async def test_export_in_chunks(async_client: AsyncClient, logged_in_token: str, mocker):
+    mocker.patch.object(export, "EXPORT_CHUNK_ROWS", 2)
+    for body in ("First post", "Second post", "Third post"):
+        await create_post(body, async_client, logged_in_token)
+
+    chunks = [chunk async for chunk in export.export_rows(export.ExportTable.posts)]
+
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 1]
+
+
+@pytest.mark.anyio
+async def test_export_writer_not_blocked_between_chunks(tmp_path, mocker):
+    path = str(tmp_path / "export.db")
+    migrate(path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO users (email, password) VALUES ('test@example.net', '1234')")
+        connection.executemany("INSERT INTO posts (body, user_id) VALUES (?, 1)", [("First",), ("Second",), ("Third",)])
+    reader = WriterDatabase(f"sqlite:///{path}")
+    await reader.connect()
+    mocker.patch.object(export, "read_database", reader)
+    mocker.patch.object(export, "EXPORT_CHUNK_ROWS", 2)
+
+    rows = export.export_rows(export.ExportTable.posts)
+    try:
+        await rows.__anext__()
+        # the client is slow to take the next chunk, a write goes through meanwhile (no lock left by the export)
+        with sqlite3.connect(path, timeout=0.1) as connection:
+            connection.execute("INSERT INTO posts (body, user_id) VALUES ('Fourth', 1)")
+        remaining = [chunk async for chunk in rows]
+    finally:
+        await rows.aclose()
+        await reader.disconnect()
+
+    assert [chunk.count(b"\n") for chunk in remaining] == [2]
+
+
+@pytest.mark.anyio
+async def test_export_requires_login(async_client: AsyncClient):
+    response = await async_client.get("/export/likes")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.anyio
+async def test_export_unknown_table(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.get("/export/users", headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+
+from config import config
+from tests.routers.test_post import create_post
+
+
+@pytest.mark.anyio
+async def test_metrics(async_client: AsyncClient, logged_in_token: str):
+    created_post = await create_post("Post Body", async_client, logged_in_token)
+    await async_client.get(f"/posts/{created_post['id']}")
+
+    response = await async_client.get("/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    # the route template, not the path
+    assert 'http_request_duration_seconds_count{method="GET",route="/posts/{post_id}"}' in response.text
+    assert 'http_requests_total{method="GET",route="/posts/{post_id}",status="200"}' in response.text
+    assert 'http_request_db_queries_bucket{method="GET",route="/posts/{post_id}",le="1"}' in response.text
+    assert 'db_query_duration_seconds_count{operation="fetch_all"}' in response.text
+    assert 'cache_hits_total{cache="user"}' in response.text
+    assert "hashing_pool_pending" in response.text
+    assert 'admission_queued{class="read"}' in response.text
+    assert 'admission_rejected_total{class="auth",reason="queue_full"}' in response.text
+
+
+@pytest.mark.anyio
+async def test_metrics_unmatched_route(async_client: AsyncClient):
+    await async_client.get("/not/a/route")
+
+    response = await async_client.get("/metrics")
+
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in response.text
+
+
+@pytest.mark.anyio
+async def test_slow_query_log(async_client: AsyncClient, logged_in_token: str, mocker, caplog):
+    created_post = await create_post("Post Body", async_client, logged_in_token)
+    mocker.patch.object(config, "SLOW_QUERY_MS", 0)
+    caplog.set_level(logging.WARNING, logger="metrics")
+
+    await async_client.get(f"/posts/{created_post['id']}")
+
+    slow = [record.getMessage() for record in caplog.records if record.name == "metrics"]
+    assert any("Slow query (fetch_all" in message and f"{created_post['id']}" in message for message in slow)
@@ -1,8 +1,15 @@
+import asyncio
+
 import pytest
 from httpx import AsyncClient
 from fastapi import status
 
 import security
+from config import config
+from database import read_database
+from feed_cache import feed_cache
+from migrations import migrate
+from storage import WriterDatabase
 
 
 def bearer_headers(token):
@@ -131,11 +138,205 @@ async def test_get_all_posts_sort_likes(
     assert post_ids == expected_order
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize("sorting,expected", [("new", [3, 2, 1]), ("old", [1, 2, 3])])
+async def test_get_all_posts_paginated(
+        async_client: AsyncClient,
+        logged_in_token: str,
+        sorting: str,
+        expected: list
+):
+    for body in ("First post", "Second post", "Third post"):
+        await create_post(body, async_client, logged_in_token)
+
+    first_page = await async_client.get("/posts", params={"sorting": sorting, "limit": 2})
+    assert [post["id"] for post in first_page.json()] == expected[:2]
+
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = await async_client.get("/posts", params={"sorting": sorting, "limit": 2, "cursor": cursor})
+    assert [post["id"] for post in second_page.json()] == expected[2:]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_sort_likes_paginated(
+        async_client: AsyncClient,
+        logged_in_token: str
+):
+    first_post = await create_post("First post", async_client, logged_in_token)
+    second_post = await create_post("Second post", async_client, logged_in_token)
+    third_post = await create_post("Third post", async_client, logged_in_token)
+    await like_post(second_post["id"], async_client, logged_in_token)
+
+    first_page = await async_client.get("/posts", params={"sorting": "most_likes", "limit": 2})
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = await async_client.get("/posts", params={"sorting": "most_likes", "limit": 2, "cursor": cursor})
+
+    post_ids = [post["id"] for post in first_page.json() + second_page.json()]
+    assert post_ids == [second_post["id"], third_post["id"], first_post["id"]]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_most_likes_from_leaderboard(async_client: AsyncClient, logged_in_token: str, mocker):
+    posts = [await create_post(f"Post {i}", async_client, logged_in_token) for i in range(3)]
+    await like_post(posts[1]["id"], async_client, logged_in_token)
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    first_page = await async_client.get("/posts", params={"sorting": "most_likes", "limit": 2})
+    fetch_all.assert_not_called()
+    second_page = await async_client.get(
+        "/posts", params={"sorting": "most_likes", "limit": 2, "cursor": first_page.headers["X-Next-Cursor"]}
+    )
+
+    assert [post["id"] for post in first_page.json()] == [posts[1]["id"], posts[2]["id"]]
+    assert first_page.json()[0]["likes"] == 1
+    assert [post["id"] for post in second_page.json()] == [posts[0]["id"]]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_trending(async_client: AsyncClient, logged_in_token: str):
+    posts = [await create_post(f"Post {i}", async_client, logged_in_token) for i in range(3)]
+    await like_post(posts[0]["id"], async_client, logged_in_token)
+    await async_client.post("/like/bulk", json=[{"post_id": posts[2]["id"]}], headers=bearer_headers(logged_in_token))
+
+    response = await async_client.get("/posts", params={"sorting": "trending"})
+
+    assert response.status_code == status.HTTP_200_OK
+    # posts without likes are not trending, the latest like weighs the most
+    assert [post["id"] for post in response.json()] == [posts[2]["id"], posts[0]["id"]]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_trending_single_page(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/posts", params={"sorting": "trending", "cursor": "anything"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/posts", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cursor_from_other_sorting(async_client: AsyncClient, logged_in_token: str):
+    await create_post("First post", async_client, logged_in_token)
+    await create_post("Second post", async_client, logged_in_token)
+    first_page = await async_client.get("/posts", params={"sorting": "new", "limit": 1})
+
+    response = await async_client.get(
+        "/posts", params={"sorting": "most_likes", "cursor": first_page.headers["X-Next-Cursor"]}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cached(async_client: AsyncClient, created_post: dict, mocker):
+    await async_client.get("/posts")
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    response = await async_client.get("/posts")
+
+    assert [post["id"] for post in response.json()] == [created_post["id"]]
+    fetch_all.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cache_invalidated_by_writes(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/posts")
+
+    second_post = await create_post("Second post", async_client, logged_in_token)
+    response = await async_client.get("/posts")
+    assert [post["id"] for post in response.json()] == [second_post["id"], created_post["id"]]
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get("/posts", params={"sorting": "most_likes"})
+    assert response.json()[0] == {**created_post, "likes": 1}
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cache_disabled(async_client: AsyncClient, created_post: dict, mocker):
+    mocker.patch.object(config, "FEED_CACHE_ENABLED", False)
+    await async_client.get("/posts")
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    await async_client.get("/posts")
+
+    fetch_all.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_get_all_posts_wrong_sorting(async_client: AsyncClient, logged_in_token: str):
     response = await async_client.get("/posts", params={"sorting": "wrong"})
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
+@pytest.mark.anyio
+async def test_search_posts(async_client: AsyncClient, logged_in_token: str):
+    await create_post("Nothing to see here", async_client, logged_in_token)
+    once = await create_post("FastAPI tips for the weekend", async_client, logged_in_token)
+    twice = await create_post("fastapi, fastapi and more FastAPI", async_client, logged_in_token)
+    await like_post(once["id"], async_client, logged_in_token)
+
+    response = await async_client.get("/posts/search", params={"q": "fastapi"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{**twice, "likes": 0}, {**once, "likes": 1}]
+
+
+@pytest.mark.anyio
+async def test_search_posts_every_word(async_client: AsyncClient, logged_in_token: str):
+    await create_post("Sunny day", async_client, logged_in_token)
+    rainy_day = await create_post("Rainy day", async_client, logged_in_token)
+
+    response = await async_client.get("/posts/search", params={"q": "day RAINY"})
+
+    assert [post["id"] for post in response.json()] == [rainy_day["id"]]
+
+
+@pytest.mark.anyio
+async def test_search_posts_paginated(async_client: AsyncClient, logged_in_token: str):
+    posts = [await create_post(f"Post number {i}", async_client, logged_in_token) for i in range(5)]
+
+    first_page = await async_client.get("/posts/search", params={"q": "post", "limit": 3})
+    second_page = await async_client.get(
+        "/posts/search", params={"q": "post", "limit": 3, "cursor": first_page.headers["X-Next-Cursor"]}
+    )
+
+    found = [post["id"] for post in first_page.json() + second_page.json()]
+    assert sorted(found) == [post["id"] for post in posts]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+@pytest.mark.anyio
+async def test_search_posts_operators_are_plain_text(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/posts/search", params={"q": '"post* -body^'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [post["id"] for post in response.json()] == [created_post["id"]]
+
+
+@pytest.mark.anyio
+async def test_search_posts_without_words(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/posts/search", params={"q": "!?"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+
+@pytest.mark.anyio
+async def test_search_posts_invalid_cursor(async_client: AsyncClient, logged_in_token: str):
+    first_page = await async_client.get("/posts", params={"limit": 1})
+    other_cursor = first_page.headers.get("X-Next-Cursor", "not-a-cursor")
+
+    for cursor in ("not-a-cursor", other_cursor):
+        response = await async_client.get("/posts/search", params={"q": "post", "cursor": cursor})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.anyio
 async def test_create_comment(async_client: AsyncClient, created_post: dict, registered_user: dict,
                               logged_in_token: str):
@@ -164,6 +365,66 @@ async def test_get_comments_on_post(async_client: AsyncClient, created_post: dic
     assert response.json() <= []
 
 
+@pytest.mark.anyio
+async def test_get_comments_on_post_paginated(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    comments = [await create_comment(f"Comment {i}", created_post["id"], async_client, logged_in_token)
+                for i in range(3)]
+
+    first_page = await async_client.get(f"/posts/{created_post['id']}/comments", params={"limit": 2})
+    second_page = await async_client.get(
+        f"/posts/{created_post['id']}/comments", params={"limit": 2, "cursor": first_page.headers["X-Next-Cursor"]}
+    )
+
+    assert first_page.json() == comments[:2]
+    assert second_page.json() == comments[2:]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+@pytest.mark.anyio
+async def test_get_comments_on_post_invalid_cursor(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get(f"/posts/{created_post['id']}/comments", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_get_feed(async_client: AsyncClient, logged_in_token: str, mocker):
+    quiet_post = await create_post("Quiet post", async_client, logged_in_token)
+    busy_post = await create_post("Busy post", async_client, logged_in_token)
+    comments = [await create_comment(f"Comment {i}", busy_post["id"], async_client, logged_in_token)
+                for i in range(3)]
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    response = await async_client.get("/feed", params={"comments": 2})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {**busy_post, "likes": 0, "comment_count": 3, "comments": [comments[2], comments[1]]},
+        {**quiet_post, "likes": 0, "comment_count": 0, "comments": []},
+    ]
+    # the page and then every preview at once
+    assert fetch_all.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_get_feed_counts_only(async_client: AsyncClient, created_post: dict, created_comment: dict):
+    response = await async_client.get("/feed", params={"comments": 0})
+
+    assert response.json() == [{**created_post, "likes": 0, "comment_count": 1, "comments": []}]
+
+
+@pytest.mark.anyio
+async def test_get_feed_cache_invalidated_by_comments(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/feed")
+    comment = await create_comment("New comment", created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get("/feed")
+
+    assert response.json()[0]["comment_count"] == 1
+    assert response.json()[0]["comments"] == [comment]
+
+
 @pytest.mark.anyio
 async def test_get_post_with_comments(async_client: AsyncClient, created_post: dict, created_comment: dict):
     response = await async_client.get(f"/posts/{created_post["id"]}")
@@ -172,6 +433,41 @@ async def test_get_post_with_comments(async_client: AsyncClient, created_post: d
     assert response.json() == {"post": {**created_post, "likes": 0}, "comments": [created_comment]}
 
 
+@pytest.mark.anyio
+async def test_get_post_with_comments_single_query(
+        async_client: AsyncClient, created_post: dict, created_comment: dict, mocker
+):
+    fetch_all = mocker.spy(read_database, "fetch_all")
+    fetch_one = mocker.spy(read_database, "fetch_one")
+
+    await async_client.get(f"/posts/{created_post["id"]}")
+
+    assert fetch_all.call_count + fetch_one.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_get_posts_with_comments_batch(
+        async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str, mocker
+):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    response = await async_client.get("/posts/batch", params={"ids": [other_post["id"], created_post["id"], 99]})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {"post": {**other_post, "likes": 0}, "comments": []},
+        {"post": {**created_post, "likes": 0}, "comments": [created_comment]},
+    ]
+    assert fetch_all.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_get_posts_with_comments_batch_without_ids(async_client: AsyncClient):
+    response = await async_client.get("/posts/batch")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 @pytest.mark.anyio
 async def test_get_missing_post_with_comments(async_client: AsyncClient, created_post: dict, created_comment: dict):
     response = await async_client.get("/posts/2")
@@ -185,3 +481,190 @@ async def test_like_post(async_client: AsyncClient, created_post: dict, register
 
     assert response.status_code == status.HTTP_201_CREATED
     assert {"id": 1, "post_id": created_post["id"], "user_id": registered_user["id"]}.items() <= response.json().items()
+
+
+@pytest.mark.anyio
+async def test_like_post_increments_counter(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/posts/{created_post["id"]}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_post_twice(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post("/like", json={"post_id": created_post["id"]},
+                                       headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.anyio
+async def test_create_posts_bulk(async_client: AsyncClient, registered_user: dict, logged_in_token: str):
+    response = await async_client.post("/posts/bulk", json=[{"body": "First post"}, {"body": "Second post"}],
+                                       headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == [
+        {"id": 1, "body": "First post", "user_id": registered_user["id"]},
+        {"id": 2, "body": "Second post", "user_id": registered_user["id"]},
+    ]
+    posts = (await async_client.get("/posts", params={"sorting": "old"})).json()
+    assert [post["body"] for post in posts] == ["First post", "Second post"]
+
+
+@pytest.mark.anyio
+async def test_create_posts_bulk_concurrently(async_client: AsyncClient, logged_in_token: str, tmp_path, mocker):
+    # the test database shares one connection that rolls back, here every request gets its own like in the app
+    path = str(tmp_path / "bulk.db")
+    migrate(path)
+    writer = WriterDatabase(f"sqlite:///{path}")
+    await writer.connect()
+    mocker.patch("routers.post.database", writer)
+    mocker.patch("database.database", writer)
+
+    responses = await asyncio.gather(*(
+        async_client.post("/posts/bulk", json=[{"body": f"Post {i}-{j}"} for j in range(20)],
+                          headers=bearer_headers(logged_in_token))
+        for i in range(8)
+    ))
+
+    assert [response.status_code for response in responses] == [status.HTTP_201_CREATED] * 8
+    assert await writer.fetch_val("SELECT count(*) FROM posts") == 160
+    await writer.disconnect()
+
+
+@pytest.mark.anyio
+async def test_create_posts_bulk_empty(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post("/posts/bulk", json=[], headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.anyio
+async def test_create_comments_bulk(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    comments = [{"body": "First comment", "post_id": created_post["id"]},
+                {"body": "Second comment", "post_id": created_post["id"]}]
+    response = await async_client.post("/comments/bulk", json=comments, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [comment["id"] for comment in response.json()] == [1, 2]
+    stored = (await async_client.get(f"/posts/{created_post["id"]}/comments")).json()
+    assert [comment["body"] for comment in stored] == ["First comment", "Second comment"]
+
+
+@pytest.mark.anyio
+async def test_create_comments_bulk_missing_post(async_client: AsyncClient, created_post: dict,
+                                                 logged_in_token: str):
+    comments = [{"body": "Comment", "post_id": created_post["id"]}, {"body": "Comment", "post_id": 99}]
+    response = await async_client.post("/comments/bulk", json=comments, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert (await async_client.get(f"/posts/{created_post["id"]}/comments")).json() == []
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    likes = [{"post_id": other_post["id"]}, {"post_id": created_post["id"]}]
+
+    response = await async_client.post("/like/bulk", json=likes, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [like["post_id"] for like in response.json()] == [other_post["id"], created_post["id"]]
+    posts = (await async_client.get("/posts")).json()
+    assert [post["likes"] for post in posts] == [1, 1]
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_already_liked(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+    likes = [{"post_id": other_post["id"]}, {"post_id": created_post["id"]}]
+
+    response = await async_client.post("/like/bulk", json=likes, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    posts = (await async_client.get("/posts")).json()
+    assert [post["likes"] for post in posts] == [0, 1]
+
+
+@pytest.mark.anyio
+async def test_fast_serialization_matches_response_models(
+        async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str, mocker
+):
+    await create_post("Second post", async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+    requests = [
+        ("/posts", {"limit": 1}),
+        (f"/posts/{created_post["id"]}/comments", {}),
+        (f"/posts/{created_post["id"]}", {}),
+        ("/posts/batch", {"ids": [created_post["id"]]}),
+    ]
+
+    fast = [await async_client.get(url, params=params) for url, params in requests]
+    mocker.patch.object(config, "FAST_SERIALIZATION", False)
+    feed_cache.clear()
+    validated = [await async_client.get(url, params=params) for url, params in requests]
+
+    for fast_response, validated_response in zip(fast, validated):
+        assert fast_response.json() == validated_response.json()
+        assert fast_response.headers.get("X-Next-Cursor") == validated_response.headers.get("X-Next-Cursor")
+        assert fast_response.headers.get("ETag") == validated_response.headers.get("ETag")
+
+
+@pytest.mark.anyio
+async def test_get_post_not_modified(async_client: AsyncClient, created_post: dict, mocker):
+    response = await async_client.get(f"/posts/{created_post["id"]}")
+    spy = mocker.spy(read_database, "fetch_all")
+
+    not_modified = await async_client.get(
+        f"/posts/{created_post["id"]}", headers={"If-None-Match": response.headers["ETag"]}
+    )
+
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not_modified.headers["ETag"] == response.headers["ETag"]
+    assert not_modified.content == b""
+    # decided without reading the post
+    spy.assert_not_called()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("change", ["comment", "like"])
+async def test_post_etag_changes(async_client: AsyncClient, created_post: dict, logged_in_token: str, change: str):
+    urls = [f"/posts/{created_post["id"]}", f"/posts/{created_post["id"]}/comments", "/posts", "/feed"]
+    etags = [(await async_client.get(url)).headers["ETag"] for url in urls]
+
+    if change == "comment":
+        await create_comment("Comment", created_post["id"], async_client, logged_in_token)
+    else:
+        await like_post(created_post["id"], async_client, logged_in_token)
+
+    for url, etag in zip(urls, etags):
+        response = await async_client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
+
+
+@pytest.mark.anyio
+async def test_feed_not_modified_until_new_post(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    etag = (await async_client.get("/posts")).headers["ETag"]
+
+    response = await async_client.get("/posts", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    await create_post("Second post", async_client, logged_in_token)
+    response = await async_client.get("/posts", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 2
+
+
+@pytest.mark.anyio
+async def test_other_posts_keep_their_etag(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    etag = (await async_client.get(f"/posts/{other_post["id"]}")).headers["ETag"]
+
+    await create_comment("Comment", created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/posts/{other_post["id"]}", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
@@ -0,0 +1,211 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+
+from config import config
+from database import database, timeline_table
+from fan_out import FanOut, fan_out
+from migrations import migrate
+from storage import ProfiledDatabase
+from tests.routers.test_post import bearer_headers, create_post
+from tests.test_storage import pragmas
+
+
+@pytest.fixture()
+async def author(async_client: AsyncClient) -> dict:
+    user = {"email": "author@example.net", "password": "1234"}
+    await async_client.post("/register", json=user)
+    token = (await async_client.post("/token", json=user)).json()["access_token"]
+    post = await create_post("Author post", async_client, token)
+    return {"id": post["user_id"], "token": token}
+
+
+async def follow(user_id: int, async_client: AsyncClient, logged_in_token: str):
+    return await async_client.post("/follow", json={"user_id": user_id}, headers=bearer_headers(logged_in_token))
+
+
+async def timeline(async_client: AsyncClient, logged_in_token: str, **params) -> list[dict]:
+    response = await async_client.get("/timeline", params=params, headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+async def timeline_post_ids() -> list[int]:
+    return [row.post_id for row in await database.fetch_all(timeline_table.select())]
+
+
+@pytest.mark.anyio
+async def test_follow(async_client: AsyncClient, logged_in_token: str, registered_user: dict, author: dict):
+    response = await follow(author["id"], async_client, logged_in_token)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {"user_id": author["id"], "follower_id": registered_user["id"]}
+
+
+@pytest.mark.anyio
+async def test_follow_twice(async_client: AsyncClient, logged_in_token: str, author: dict):
+    await follow(author["id"], async_client, logged_in_token)
+
+    response = await follow(author["id"], async_client, logged_in_token)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.anyio
+async def test_follow_themselves(async_client: AsyncClient, logged_in_token: str, registered_user: dict):
+    response = await follow(registered_user["id"], async_client, logged_in_token)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_follow_missing_user(async_client: AsyncClient, logged_in_token: str):
+    response = await follow(99, async_client, logged_in_token)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_follow_backfills_timeline(async_client: AsyncClient, logged_in_token: str, author: dict):
+    await follow(author["id"], async_client, logged_in_token)
+
+    assert [post["body"] for post in await timeline(async_client, logged_in_token)] == ["Author post"]
+
+
+@pytest.mark.anyio
+async def test_new_posts_are_fanned_out(async_client: AsyncClient, logged_in_token: str, author: dict):
+    await follow(author["id"], async_client, logged_in_token)
+    await create_post("New post", async_client, author["token"])
+    await create_post("Own post", async_client, logged_in_token)
+
+    # the author's post waits for the worker, the user's own posts are read on request
+    assert [post["body"] for post in await timeline(async_client, logged_in_token)] == ["Own post", "Author post"]
+    await fan_out.flush()
+
+    assert [post["body"] for post in await timeline(async_client, logged_in_token)] == [
+        "Own post", "New post", "Author post"
+    ]
+    assert fan_out.stats()["timeline_rows"] >= 1
+
+
+@pytest.mark.anyio
+async def test_posts_of_popular_authors_are_read_on_request(
+        async_client: AsyncClient, logged_in_token: str, author: dict, mocker
+):
+    mocker.patch.object(config, "FAN_OUT_MAX_FOLLOWERS", 1)
+    await follow(author["id"], async_client, logged_in_token)
+    post = await create_post("New post", async_client, author["token"])
+
+    await fan_out.flush()
+
+    assert post["id"] not in await timeline_post_ids()
+    assert [post["body"] for post in await timeline(async_client, logged_in_token)] == ["New post", "Author post"]
+
+
+@pytest.mark.anyio
+async def test_posts_of_authors_back_under_the_threshold_are_fanned_out(
+        async_client: AsyncClient, logged_in_token: str, author: dict, mocker
+):
+    mocker.patch.object(config, "FAN_OUT_MAX_FOLLOWERS", 2)
+    other = {"email": "other@example.net", "password": "1234"}
+    await async_client.post("/register", json=other)
+    other_token = (await async_client.post("/token", json=other)).json()["access_token"]
+    await follow(author["id"], async_client, logged_in_token)
+    await follow(author["id"], async_client, other_token)
+    # read on request, never fanned out
+    await create_post("Popular post", async_client, author["token"])
+    await fan_out.flush()
+
+    await async_client.delete(f"/follow/{author["id"]}", headers=bearer_headers(other_token))
+    await fan_out.flush()
+
+    assert [post["body"] for post in await timeline(async_client, logged_in_token)] == ["Popular post", "Author post"]
+    assert len(await timeline_post_ids()) == 2
+
+
+@pytest.mark.anyio
+async def test_unfollow(async_client: AsyncClient, logged_in_token: str, author: dict):
+    await follow(author["id"], async_client, logged_in_token)
+
+    response = await async_client.delete(f"/follow/{author["id"]}", headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert await timeline(async_client, logged_in_token) == []
+    # a new post of the author doesn't reach the timeline anymore
+    await create_post("New post", async_client, author["token"])
+    await fan_out.flush()
+    assert await timeline(async_client, logged_in_token) == []
+
+
+@pytest.mark.anyio
+async def test_follow_keeps_the_user_caches(async_client: AsyncClient, logged_in_token: str, author: dict, mocker):
+    publish = mocker.patch("security.coherence.publish")
+
+    await follow(author["id"], async_client, logged_in_token)
+    await async_client.delete(f"/follow/{author["id"]}", headers=bearer_headers(logged_in_token))
+
+    publish.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_unfollow_not_followed(async_client: AsyncClient, logged_in_token: str, author: dict):
+    response = await async_client.delete(f"/follow/{author["id"]}", headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_timeline_pages(async_client: AsyncClient, logged_in_token: str, author: dict):
+    await follow(author["id"], async_client, logged_in_token)
+    for i in range(2):
+        await create_post(f"Post {i}", async_client, author["token"])
+        await create_post(f"Own post {i}", async_client, logged_in_token)
+    await fan_out.flush()
+
+    bodies = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await async_client.get("/timeline", params=params, headers=bearer_headers(logged_in_token))
+        bodies += [post["body"] for post in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert bodies == ["Own post 1", "Post 1", "Own post 0", "Post 0", "Author post"]
+
+
+@pytest.mark.anyio
+async def test_timeline_invalid_cursor(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.get("/timeline", params={"cursor": "x"}, headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_timeline_requires_login(async_client: AsyncClient):
+    response = await async_client.get("/timeline")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.anyio
+async def test_fan_out_stop_during_flush(tmp_path, mocker):
+    # same as the like buffer: a single writer connection must not be left in an interrupted transaction
+    path = str(tmp_path / "fan_out.db")
+    migrate(path)
+    writer = ProfiledDatabase(f"sqlite:///{path}", pool_size=1, pragmas=pragmas)
+    await writer.connect()
+    await writer.execute("INSERT INTO users (id, email, password) VALUES (1, 'author@example.net', '-')")
+    await writer.execute("INSERT INTO users (id, email, password) VALUES (2, 'reader@example.net', '-')")
+    await writer.execute("INSERT INTO follows (follower_id, followee_id) VALUES (2, 1)")
+    mocker.patch("fan_out.database", writer)
+    worker = FanOut()
+    worker.start()
+
+    worker.add(post_id=1, user_id=1)
+    # the background flush took the post and is opening its transaction
+    while worker._pending:
+        await asyncio.sleep(0)
+    worker.add(post_id=2, user_id=1)
+    await asyncio.wait_for(worker.stop(), timeout=5)
+
+    assert await writer.fetch_val("SELECT count(*) FROM timelines WHERE user_id = 2") == 2
+    await writer.disconnect()
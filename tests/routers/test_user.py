@@ -2,6 +2,8 @@ import pytest
 from httpx import AsyncClient
 from fastapi import status
 
+import security
+
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
     return await async_client.post(
@@ -39,3 +41,13 @@ async def test_login_user(async_client: AsyncClient, registered_user: dict):
     response = await async_client.post("/token",
                                        json={"email": registered_user["email"], "password": registered_user["password"]})
     assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.anyio
+async def test_login_user_hashing_saturated(async_client: AsyncClient, registered_user: dict, mocker):
+    mocker.patch("security.hashing_pool", security.HashingPool(workers=1, max_pending=0))
+
+    response = await async_client.post("/token",
+                                       json={"email": registered_user["email"], "password": registered_user["password"]})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
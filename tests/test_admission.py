@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+
+from admission import Limiter, Overloaded, request_class
+
+
+def test_request_class():
+    assert request_class("POST", "/token") == "auth"
+    assert request_class("POST", "/register") == "auth"
+    assert request_class("POST", "/posts") == "write"
+    assert request_class("DELETE", "/follow/1") == "write"
+    assert request_class("GET", "/posts") == "read"
+    assert request_class("GET", "/metrics") is None
+
+
+@pytest.mark.anyio
+async def test_limiter_queues_then_rejects():
+    limiter = Limiter(concurrency=1, max_queue=1, timeout=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+    assert limiter.stats()["rejected"] == {"queue_full": 1, "timeout": 0}
+
+    # the slot goes straight to the request that was waiting
+    limiter.release()
+    await waiting
+    assert limiter.active == 1
+    assert limiter.queued == 0
+
+
+@pytest.mark.anyio
+async def test_limiter_wait_times_out():
+    limiter = Limiter(concurrency=1, max_queue=1, timeout=0.01)
+    await limiter.acquire()
+
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+
+    assert limiter.stats()["rejected"] == {"queue_full": 0, "timeout": 1}
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_leaves_the_queue():
+    limiter = Limiter(concurrency=1, max_queue=1, timeout=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.anyio
+async def test_overloaded_class_is_shed(async_client: AsyncClient, mocker):
+    reads = Limiter(concurrency=1, max_queue=0, timeout=1)
+    mocker.patch("admission.limiters", {"read": reads, "write": Limiter(1, 0, 1), "auth": Limiter(1, 0, 1)})
+    await reads.acquire()
+
+    response = await async_client.get("/posts")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+    # other classes and /metrics are still served
+    assert (await async_client.post("/register", json={"email": "a@example.net", "password": "1"})).status_code == 201
+    metrics = await async_client.get("/metrics")
+    assert metrics.status_code == status.HTTP_200_OK
+    reads.release()
+    assert (await async_client.get("/posts")).status_code == status.HTTP_200_OK
@@ -0,0 +1,52 @@
+from cache import TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(mocker):
+    monotonic = mocker.patch("cache.time.monotonic", return_value=100)
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+
+    monotonic.return_value = 111
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_invalidate():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+
+    assert cache.get("a") is None
+
+
+def test_value_computed_before_clear_is_not_stored():
+    cache = TTLCache(max_size=2, ttl=60)
+    generation = cache.generation
+    cache.clear()
+
+    cache.set("a", 1, generation=generation)
+
+    assert cache.get("a") is None
@@ -0,0 +1,155 @@
+import sqlite3
+
+import pytest
+from httpx import AsyncClient
+
+import coherence as coherence_module
+from coherence import RECORD_EXTERNAL_WRITE, Coherence, shared_generations
+from fan_out import fan_out
+from migrations import migrate
+from storage import WriterDatabase
+from tests.routers.test_post import create_post
+
+
+@pytest.fixture()
+def database_file(tmp_path):
+    path = str(tmp_path / "coherence.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY)")
+        connection.execute("CREATE TABLE external_writes (id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)")
+        connection.execute("INSERT INTO external_writes VALUES (1, 0)")
+    return path
+
+
+@pytest.fixture()
+def calls(mocker):
+    calls = []
+    mocker.patch.dict(coherence_module.handlers, {
+        "feed": [lambda: calls.append("feed")],
+        "users": [lambda: calls.append("users")],
+    })
+    return calls
+
+
+# two workers sharing their generations, like serve.py sets them up
+@pytest.fixture()
+async def workers(database_file):
+    generations = shared_generations(2)
+    workers = [Coherence(interval=60), Coherence(interval=60)]
+    for index, worker in enumerate(workers):
+        worker.attach(generations, index)
+        worker.start(database_file)
+    yield workers
+    for worker in workers:
+        await worker.stop()
+
+
+@pytest.mark.anyio
+async def test_publish_runs_the_handlers_of_the_other_workers(workers, calls):
+    first, second = workers
+    first.publish("feed")
+
+    await first.poll()
+    assert calls == []
+
+    await second.poll()
+    assert calls == ["feed"]
+    assert second.stats()["invalidations"]["feed"] == 1
+
+    # seen once
+    await second.poll()
+    assert calls == ["feed"]
+
+
+@pytest.mark.anyio
+async def test_commit_of_another_process_runs_every_handler(workers, database_file, calls):
+    with sqlite3.connect(database_file) as connection:
+        connection.execute("INSERT INTO posts DEFAULT VALUES")
+
+    await workers[0].poll()
+
+    assert calls == ["feed", "users"]
+    assert workers[0].stats()["invalidations"]["external"] == 1
+
+
+@pytest.mark.anyio
+async def test_published_commit_is_not_external(workers, database_file, calls):
+    # a commit of the other worker
+    with sqlite3.connect(database_file) as connection:
+        connection.execute("INSERT INTO posts DEFAULT VALUES")
+    workers[1].record_commit()
+    workers[1].publish("users")
+
+    await workers[0].poll()
+
+    assert calls == ["users"]
+    assert workers[0].stats()["invalidations"]["external"] == 0
+
+
+@pytest.mark.anyio
+async def test_external_write_with_commits_of_the_workers(workers, database_file, calls):
+    with sqlite3.connect(database_file) as connection:
+        connection.execute("INSERT INTO posts DEFAULT VALUES")
+        connection.execute(RECORD_EXTERNAL_WRITE)
+    # the workers kept writing meanwhile
+    workers[0].record_commit()
+    workers[1].record_commit()
+
+    await workers[0].poll()
+    await workers[0].poll()
+
+    assert calls == ["feed", "users"]
+    assert workers[0].stats()["invalidations"]["external"] == 1
+
+
+@pytest.mark.anyio
+async def test_handler_returning_false_is_called_again(workers, mocker):
+    results = [False, True]
+    handler = mocker.Mock(side_effect=lambda: results.pop(0))
+    mocker.patch.dict(coherence_module.handlers, {"feed": [handler], "users": []})
+    workers[1].publish("feed")
+
+    await workers[0].poll()
+    await workers[0].poll()
+    await workers[0].poll()
+
+    assert handler.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_counted_commit_is_not_external(workers, database_file, calls):
+    with sqlite3.connect(database_file) as connection:
+        connection.execute("INSERT INTO posts DEFAULT VALUES")
+    # what the writer connection of the other worker does after a commit that changed no cache (fan-out...)
+    workers[1].record_commit()
+
+    await workers[0].poll()
+
+    assert calls == []
+    assert workers[0].stats()["invalidations"]["external"] == 0
+
+
+@pytest.mark.anyio
+async def test_fan_out_keeps_etags(async_client: AsyncClient, logged_in_token: str, tmp_path, mocker):
+    post = await create_post("Post", async_client, logged_in_token)
+    etag = (await async_client.get(f"/posts/{post['id']}")).headers["ETag"]
+
+    # the fan-out commits on a file (the test database never commits), watched by this process
+    path = str(tmp_path / "fan_out.db")
+    migrate(path)
+    writer = WriterDatabase(f"sqlite:///{path}")
+    await writer.connect()
+    watcher = Coherence(interval=60)
+    watcher.start(path)
+    mocker.patch("storage.coherence", watcher)
+    mocker.patch("fan_out.database", writer)
+
+    fan_out.add(post["id"], 1)
+    await fan_out.flush()
+    await watcher.poll()
+
+    assert watcher.stats()["invalidations"]["external"] == 0
+    response = await async_client.get(f"/posts/{post['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    await watcher.stop()
+    await writer.disconnect()
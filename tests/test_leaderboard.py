@@ -0,0 +1,121 @@
+import random
+import time
+
+import pytest
+from httpx import AsyncClient
+
+import leaderboard as leaderboard_module
+from database import database, like_table, post_table
+from leaderboard import REBASE_HALF_LIVES, Leaderboard, TopK, leaderboard, load_leaderboard, refresh_leaderboard
+from tests.routers.test_post import create_post, like_post
+
+
+def post(post_id: int, likes: int = 0) -> dict:
+    return {"id": post_id, "body": f"Post {post_id}", "user_id": 1, "likes": likes}
+
+
+def test_top_k_keeps_the_highest():
+    top = TopK(size=2)
+    for post_id, score in ((1, 5), (2, 1), (3, 3)):
+        top.update(post(post_id), score)
+
+    assert [entry["id"] for entry in top.top(10)] == [1, 3]
+
+
+def test_top_k_matches_sorting_everything():
+    rng = random.Random(1)
+    top = TopK(size=10)
+    scores = {}
+    for _ in range(2000):
+        post_id = rng.randint(1, 100)
+        scores[post_id] = scores.get(post_id, 0) + rng.randint(1, 3)
+        top.update(post(post_id), scores[post_id])
+
+    expected = sorted(scores, key=lambda post_id: (scores[post_id], post_id), reverse=True)[:10]
+    assert [entry["id"] for entry in top.top(10)] == expected
+
+
+def test_top_k_ignores_lower_scores():
+    top = TopK(size=2)
+    top.update(post(1, likes=2), 2)
+    top.update(post(1, likes=1), 1)
+
+    assert top.top(1) == [post(1, likes=2)]
+
+
+def test_trending_prefers_recent_likes():
+    board = Leaderboard(size=10, half_life=3600)
+    now = time.time()
+    board.record_likes(post(1, likes=3), [now - 10 * 3600] * 3)
+    board.record_likes(post(2, likes=1), [now])
+
+    assert [entry["id"] for entry in board.trending.top(10)] == [2, 1]
+    assert [entry["id"] for entry in board.most_liked.top(10)] == [1, 2]
+
+
+def test_trending_rebase_keeps_the_order():
+    board = Leaderboard(size=10, half_life=1)
+    start = time.time()
+    board.record_likes(post(1, likes=2), [start, start])
+    board.record_likes(post(2, likes=1), [start])
+
+    # far enough for the landmark to move, old scores shrink together
+    later = start + REBASE_HALF_LIVES + 1
+    board.record_likes(post(3, likes=1), [later])
+
+    assert [entry["id"] for entry in board.trending.top(10)] == [3, 1, 2]
+
+
+@pytest.mark.anyio
+async def test_load_leaderboard(registered_user: dict):
+    user_id = registered_user["id"]
+    old_post = await database.execute(post_table.insert().values(body="Old", user_id=user_id, likes=2))
+    new_post = await database.execute(post_table.insert().values(body="New", user_id=user_id, likes=1))
+    await database.execute_many(like_table.insert(), [
+        {"post_id": old_post, "user_id": user_id, "created_at": None},
+        {"post_id": old_post, "user_id": user_id + 1, "created_at": None},
+        {"post_id": new_post, "user_id": user_id, "created_at": time.time()},
+    ])
+
+    await load_leaderboard()
+
+    assert leaderboard.loaded
+    assert [entry["id"] for entry in leaderboard.most_liked.top(10)] == [old_post, new_post]
+    # likes without created_at are too old to be trending
+    assert [entry["id"] for entry in leaderboard.trending.top(10)] == [new_post]
+
+
+def trending_score(post_id: int) -> float:
+    return next(score for score, key in leaderboard.trending._keys if key == post_id)
+
+
+@pytest.mark.anyio
+async def test_refresh_leaderboard_reads_new_likes(registered_user: dict, mocker):
+    mocker.patch.object(leaderboard_module, "NEW_LIKES_CHUNK", 2)
+    user_id = registered_user["id"]
+    # written by another process after the db fixture loaded the leaderboard
+    post_id = await database.execute(post_table.insert().values(body="Elsewhere", user_id=user_id, likes=3))
+    now = time.time()
+    await database.execute_many(like_table.insert(), [
+        {"post_id": post_id, "user_id": user_id + offset, "created_at": now} for offset in range(3)
+    ])
+
+    await refresh_leaderboard()
+
+    assert [entry["id"] for entry in leaderboard.most_liked.top(10)] == [post_id]
+    assert trending_score(post_id) == pytest.approx(3 * leaderboard.weight(now))
+    # nothing new, the likes already counted are not counted twice
+    await refresh_leaderboard()
+    assert trending_score(post_id) == pytest.approx(3 * leaderboard.weight(now))
+
+
+@pytest.mark.anyio
+async def test_local_like_is_counted_once(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("Post", async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+    score = trending_score(post["id"])
+
+    # another worker wrote something meanwhile
+    await refresh_leaderboard()
+
+    assert trending_score(post["id"]) == score
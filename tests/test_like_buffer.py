@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+
+from config import config
+from database import database, like_table
+from like_buffer import LikeBuffer, like_buffer
+from migrations import migrate
+from storage import ProfiledDatabase
+from tests.test_storage import pragmas
+from tests.routers.test_post import bearer_headers, create_post
+
+
+@pytest.fixture()
+def write_behind(mocker):
+    mocker.patch.object(config, "LIKE_WRITE_BEHIND", True)
+
+
+async def stored_likes() -> int:
+    return len(await database.fetch_all(like_table.select()))
+
+
+@pytest.mark.anyio
+async def test_like_is_buffered(async_client: AsyncClient, logged_in_token: str, write_behind):
+    post = await create_post("Post", async_client, logged_in_token)
+
+    response = await async_client.post("/like", json={"post_id": post["id"]}, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["id"] is None
+    assert await stored_likes() == 0
+    # pending likes are already part of the counts
+    assert (await async_client.get("/posts")).json()[0]["likes"] == 1
+    assert (await async_client.get(f"/posts/{post["id"]}")).json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_buffered_likes_are_flushed(async_client: AsyncClient, logged_in_token: str, write_behind):
+    post = await create_post("Post", async_client, logged_in_token)
+    await async_client.post("/like", json={"post_id": post["id"]}, headers=bearer_headers(logged_in_token))
+    await async_client.get("/posts")
+
+    await like_buffer.flush()
+
+    assert await stored_likes() == 1
+    assert len(like_buffer) == 0
+    assert (await async_client.get("/posts")).json()[0]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_flush_counts_only_the_stored_likes(
+        async_client: AsyncClient, logged_in_token: str, registered_user: dict
+):
+    first = await create_post("First post", async_client, logged_in_token)
+    second = await create_post("Second post", async_client, logged_in_token)
+    # stored meanwhile by another worker, counter included
+    await async_client.post("/like", json={"post_id": first["id"]}, headers=bearer_headers(logged_in_token))
+    buffer = LikeBuffer(max_size=10, flush_interval=60)
+    buffer.add(first["id"], registered_user["id"])
+    buffer.add(second["id"], registered_user["id"])
+    buffer.add(second["id"], registered_user["id"] + 1)
+
+    await buffer.flush()
+
+    posts = {post["id"]: post for post in (await async_client.get("/posts")).json()}
+    assert (posts[first["id"]]["likes"], posts[second["id"]]["likes"]) == (1, 2)
+    assert await stored_likes() == 3
+
+
+@pytest.mark.anyio
+async def test_buffered_like_twice(async_client: AsyncClient, logged_in_token: str, write_behind):
+    post = await create_post("Post", async_client, logged_in_token)
+    await async_client.post("/like", json={"post_id": post["id"]}, headers=bearer_headers(logged_in_token))
+
+    response = await async_client.post("/like", json={"post_id": post["id"]}, headers=bearer_headers(logged_in_token))
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.anyio
+async def test_buffered_like_missing_post(async_client: AsyncClient, logged_in_token: str, write_behind):
+    response = await async_client.post("/like", json={"post_id": 99}, headers=bearer_headers(logged_in_token))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_stop_drains_the_buffer(async_client: AsyncClient, logged_in_token: str, registered_user: dict):
+    post = await create_post("Post", async_client, logged_in_token)
+    buffer = LikeBuffer(max_size=10, flush_interval=60)
+    buffer.start()
+    buffer.add(post["id"], registered_user["id"])
+
+    await buffer.stop()
+
+    assert await stored_likes() == 1
+    assert buffer.stats() == {"pending": 0, "flushes": 1, "flushed_likes": 1}
+
+
+@pytest.mark.anyio
+async def test_stop_during_flush_drains_the_buffer(tmp_path, mocker):
+    # production profile: a single writer connection, a flush interrupted in its transaction would keep it forever
+    path = str(tmp_path / "likes.db")
+    migrate(path)
+    writer = ProfiledDatabase(f"sqlite:///{path}", pool_size=1, pragmas=pragmas)
+    await writer.connect()
+    # the connection is open and idle, the flush waits on its BEGIN
+    await writer.execute("SELECT 1")
+    mocker.patch("like_buffer.database", writer)
+    buffer = LikeBuffer(max_size=1, flush_interval=60)
+    buffer.start()
+
+    buffer.add(post_id=1, user_id=1)
+    # the background flush took the like and is opening its transaction
+    while not buffer._flushing:
+        await asyncio.sleep(0)
+    buffer.add(post_id=2, user_id=1)
+    await asyncio.wait_for(buffer.stop(), timeout=5)
+
+    assert len(buffer) == 0
+    assert await writer.fetch_val("SELECT count(*) FROM likes") == 2
+    await writer.disconnect()
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # the database can't even be created there, importing the app must not try
+    database_path = tmp_path / "missing" / "app.db"
+    env = {**os.environ, "ENV_STATE": "test", "TEST_DATABASE_URL": f"sqlite:///{database_path}"}
+
+    subprocess.run([sys.executable, "-c", "import main, manage"], env=env, check=True, cwd=Path(__file__).parents[1])
+
+    assert not database_path.parent.exists()
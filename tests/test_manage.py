@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import manage
+import security
+from bulk_import import ImportFormat, ImportTable, InvalidImport, import_rows, read_rows
+from database import database, like_table, post_table
+from migrations import migrate
+
+
+@pytest.mark.anyio
+async def test_reconcile_like_counts(registered_user: dict):
+    post_id = await database.execute(post_table.insert().values(body="Post", user_id=registered_user["id"], likes=7))
+    await database.execute(like_table.insert().values(post_id=post_id, user_id=registered_user["id"]))
+
+    generation = await database.fetch_val("SELECT generation FROM external_writes")
+
+    await manage.reconcile_like_counts()
+
+    post = await database.fetch_one(post_table.select().where(post_table.c.id == post_id))
+    assert post.likes == 1
+    # running workers are told
+    assert await database.fetch_val("SELECT generation FROM external_writes") == generation + 1
+
+
+@pytest.mark.anyio
+async def test_rebuild_search_index(registered_user: dict):
+    post_id = await database.execute(post_table.insert().values(body="Searchable post", user_id=registered_user["id"]))
+    await database.execute("INSERT INTO posts_fts (posts_fts) VALUES ('delete-all')")
+
+    await manage.rebuild_search_index()
+
+    assert await database.fetch_val("SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'searchable'") == post_id
+
+
+@pytest.fixture()
+def import_database(tmp_path) -> str:
+    path = str(tmp_path / "import.db")
+    migrate(path)
+    return path
+
+
+def test_import_rows(import_database: str):
+    password = security.get_password_hash("1234")
+    users = io.BytesIO(f'{{"id": 1, "email": "import@example.net", "password": "{password}"}}\n'.encode())
+    posts = io.BytesIO(b"id,body,user_id\n1,Imported post,1\n2,Another one,1\n")
+    likes = io.BytesIO(b'{"post_id": 2, "user_id": 1, "created_at": null}\n')
+
+    assert import_rows(import_database, ImportTable.users, read_rows(users, ImportFormat.ndjson)) == 1
+    assert import_rows(import_database, ImportTable.posts, read_rows(posts, ImportFormat.csv), batch_size=1) == 2
+    assert import_rows(import_database, ImportTable.likes, read_rows(likes, ImportFormat.ndjson)) == 1
+
+    with sqlite3.connect(import_database) as connection:
+        assert connection.execute("SELECT id, likes FROM posts ORDER BY id").fetchall() == [(1, 0), (2, 1)]
+        # indexes and search triggers are back, the imported posts are searchable
+        assert connection.execute("SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'imported'").fetchall() == [(1,)]
+        names = {row[0] for row in connection.execute("SELECT name FROM sqlite_master")}
+        assert {"ix_posts_likes_id", "posts_fts_insert", "ux_likes_post_id_user_id"} <= names
+        # one external write per import, seen by the workers of a running app
+        assert connection.execute("SELECT generation FROM external_writes").fetchone() == (3,)
+
+
+@pytest.mark.parametrize("table, content, message", [
+    (ImportTable.users, b'{"email": "plain@example.net", "password": "1234"}\n', "must be a hash"),
+    (ImportTable.posts, b'{"body": "Post", "user_id": 1, "title": "?"}\n', "Unknown columns"),
+    (ImportTable.likes, b'{"post_id": 1, "user_id": 1}\n{"post_id": 1, "user_id": 1}\n', "ux_likes_post_id_user_id"),
+])
+def test_import_rows_invalid(import_database: str, table: ImportTable, content: bytes, message: str):
+    with pytest.raises(InvalidImport, match=message):
+        import_rows(import_database, table, read_rows(io.BytesIO(content), ImportFormat.ndjson))
+
+    # nothing imported, nothing dropped
+    with sqlite3.connect(import_database) as connection:
+        assert connection.execute(f"SELECT count(*) FROM {table.value}").fetchone() == (0,)
+        indexes = connection.execute("SELECT name FROM sqlite_master WHERE name = 'ix_likes_user_id'").fetchall()
+        assert indexes == [("ix_likes_user_id",)]
+        assert connection.execute("SELECT generation FROM external_writes").fetchone() == (0,)
+
+
+def test_export_command_with_the_production_profile(import_database: str):
+    with sqlite3.connect(import_database) as connection:
+        connection.execute("INSERT INTO users (id, email, password) VALUES (1, 'export@example.net', 'hash')")
+        connection.execute("INSERT INTO posts (id, body, user_id) VALUES (1, 'Exported post', 1)")
+    env = {
+        **os.environ, "ENV_STATE": "test", "TEST_DATABASE_URL": f"sqlite:///{import_database}",
+        "TEST_SQLITE_PRODUCTION_PROFILE": "true",
+    }
+
+    # the reader pool is closed too, the process exits
+    result = subprocess.run(
+        [sys.executable, "manage.py", "export", "posts"],
+        env=env, cwd=Path(__file__).parents[1], capture_output=True, check=True, timeout=30,
+    )
+
+    assert [json.loads(line)["body"] for line in result.stdout.splitlines()] == ["Exported post"]
@@ -0,0 +1,74 @@
+import sqlite3
+
+from database import metadata
+from migrations import LATEST_VERSION, current_version, migrate
+
+
+def table_columns(connection: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def index_names(connection: sqlite3.Connection) -> set:
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_migrate_new_database(tmp_path):
+    path = str(tmp_path / "new.db")
+
+    assert migrate(path) == list(range(1, LATEST_VERSION + 1))
+
+    connection = sqlite3.connect(path)
+    assert current_version(connection) == LATEST_VERSION
+    # the tables in database.py must describe what the migrations built
+    for table in metadata.sorted_tables:
+        assert table_columns(connection, table.name) == {column.name for column in table.columns}
+        assert {index.name for index in table.indexes} <= index_names(connection)
+
+
+def test_migrate_is_idempotent(tmp_path):
+    path = str(tmp_path / "new.db")
+    migrate(path)
+
+    assert migrate(path) == []
+
+
+def test_migrate_database_created_with_create_all(tmp_path):
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE users (id INTEGER NOT NULL, email VARCHAR, password VARCHAR, PRIMARY KEY (id), UNIQUE (email));
+        CREATE TABLE posts (id INTEGER NOT NULL, body VARCHAR, user_id INTEGER NOT NULL, PRIMARY KEY (id));
+        CREATE TABLE comments (
+            id INTEGER NOT NULL, body VARCHAR, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (id)
+        );
+        CREATE TABLE likes (id INTEGER NOT NULL, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (id));
+        INSERT INTO users (id, email, password) VALUES (1, 'test@example.net', 'hash');
+        INSERT INTO posts (id, body, user_id) VALUES (1, 'Post', 1);
+        INSERT INTO likes (post_id, user_id) VALUES (1, 1), (1, 1);
+    """)
+    connection.close()
+
+    migrate(path)
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("SELECT likes FROM posts WHERE id = 1").fetchone() == (1,)
+    assert connection.execute("SELECT count(*) FROM likes").fetchone() == (1,)
+    assert {"ix_comments_post_id", "ux_likes_post_id_user_id", "ix_likes_user_id"} <= index_names(connection)
+    # posts written before the search index existed are indexed too
+    assert connection.execute("SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'post'").fetchall() == [(1,)]
+
+
+def test_migrate_legacy_database_without_authors(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE posts (id INTEGER NOT NULL, body VARCHAR, PRIMARY KEY (id));
+        CREATE TABLE comments (id INTEGER NOT NULL, body VARCHAR, post_id INTEGER NOT NULL, PRIMARY KEY (id));
+    """)
+    connection.close()
+
+    migrate(path)
+
+    connection = sqlite3.connect(path)
+    assert {"user_id", "likes"} <= table_columns(connection, "posts")
+    assert "user_id" in table_columns(connection, "comments")
@@ -0,0 +1,96 @@
+import ast
+import logging
+
+import pytest
+from httpx import AsyncClient
+
+from config import config
+from database import database
+from fan_out import fan_out
+from tests.routers.test_post import bearer_headers, create_comment, create_post, like_post
+
+
+async def explain(sql: str, args: tuple) -> list[str]:
+    raw_connection = database.connection().raw_connection
+    async with raw_connection.execute(f"EXPLAIN QUERY PLAN {sql}", args) as cursor:
+        return [row[3] for row in await cursor.fetchall()]
+
+
+def assert_plan_uses_indexes(sql: str, plan: list[str]):
+    # reading back the rows of a subquery is fine, its own plan lines are checked
+    subqueries = {detail.removeprefix("CO-ROUTINE ") for detail in plan if detail.startswith("CO-ROUTINE ")}
+    for detail in plan:
+        assert "TEMP B-TREE" not in detail, f"{sql} sorts without an index: {plan}"
+        if detail.startswith("SCAN") and detail.removeprefix("SCAN ") not in subqueries:
+            # a scan is only fine for a first page: walking an index (or the primary key) in order until the LIMIT
+            assert " WHERE " not in sql and " LIMIT " in sql, f"{sql} scans the table: {plan}"
+
+
+@pytest.fixture()
+def executed_queries(caplog):
+    # databases logs every query it compiles with its bound parameters
+    caplog.set_level(logging.DEBUG, logger="databases")
+
+    def queries():
+        return [
+            (record.args[0], ast.literal_eval(record.args[1]))
+            for record in caplog.records
+            if record.name == "databases" and record.msg.startswith("Query:")
+        ]
+
+    return queries
+
+
+@pytest.mark.anyio
+async def test_every_query_uses_an_index(async_client: AsyncClient, executed_queries, mocker):
+    user = {"email": "plans@example.net", "password": "1234"}
+    await async_client.post("/register", json=user)
+    token = (await async_client.post("/token", json=user)).json()["access_token"]
+
+    post = await create_post("First post", async_client, token)
+    second_post = await create_post("Second post", async_client, token)
+    await create_comment("Comment", post["id"], async_client, token)
+    await like_post(post["id"], async_client, token)
+    # write-behind likes check the post and the like with a single read
+    mocker.patch.object(config, "LIKE_WRITE_BEHIND", True)
+    await like_post(second_post["id"], async_client, token)
+
+    for sorting in ("new", "old", "most_likes"):
+        first_page = await async_client.get("/posts", params={"sorting": sorting, "limit": 1})
+        cursor = first_page.headers["X-Next-Cursor"]
+        await async_client.get("/posts", params={"sorting": sorting, "limit": 1, "cursor": cursor})
+    await create_comment("Second comment", post["id"], async_client, token)
+    comments_page = await async_client.get(f"/posts/{post["id"]}/comments", params={"limit": 1})
+    await async_client.get(f"/posts/{post["id"]}/comments", params={"cursor": comments_page.headers["X-Next-Cursor"]})
+    for comments in (0, 2):
+        await async_client.get("/feed", params={"comments": comments})
+    await async_client.get(f"/posts/{post["id"]}")
+    await async_client.get("/posts/batch", params={"ids": [post["id"], post["id"] + 1]})
+    for table in ("posts", "comments", "likes"):
+        await async_client.get(f"/export/{table}", params={"since_id": 1})
+    await async_client.post("/posts", json={"body": "Post"}, headers=bearer_headers(token))
+    followed = {"email": "followed@example.net", "password": "1234"}
+    await async_client.post("/register", json=followed)
+    followed_token = (await async_client.post("/token", json=followed)).json()["access_token"]
+    followed_id = (await create_post("Followed post", async_client, followed_token))["user_id"]
+    await async_client.post("/follow", json={"user_id": followed_id}, headers=bearer_headers(token))
+    await create_post("Fanned out post", async_client, followed_token)
+    await fan_out.flush()
+    timeline_page = await async_client.get("/timeline", params={"limit": 1}, headers=bearer_headers(token))
+    await async_client.get("/timeline", params={"cursor": timeline_page.headers["X-Next-Cursor"]},
+                           headers=bearer_headers(token))
+    await async_client.delete(f"/follow/{followed_id}", headers=bearer_headers(token))
+    await async_client.post("/comments/bulk", json=[{"body": "Comment", "post_id": post["id"]}],
+                            headers=bearer_headers(token))
+
+    queries = [(sql, args) for sql, args in executed_queries() if not sql.startswith("INSERT")]
+    assert queries
+    for sql, args in queries:
+        assert_plan_uses_indexes(sql, await explain(sql, args))
+
+
+@pytest.mark.anyio
+async def test_plan_check_detects_missing_index():
+    sql = "SELECT posts.id FROM posts WHERE posts.body = ?"
+    with pytest.raises(AssertionError):
+        assert_plan_uses_indexes(sql, await explain(sql, ("Post",)))
@@ -1,7 +1,10 @@
 import pytest
+import sqlalchemy
 from jose import jwt
 
 import security
+from config import config
+from database import database, user_table
 
 
 def test_access_token_expire_minutes():
@@ -20,6 +23,24 @@ def test_password_hashes():
     assert security.verify_password(password, security.get_password_hash(password))
 
 
+@pytest.mark.anyio
+async def test_password_hashes_in_pool():
+    password = "password"
+    hashed_password = await security.get_password_hash_async(password)
+    assert await security.verify_password_async(password, hashed_password)
+
+
+@pytest.mark.anyio
+async def test_hashing_pool_saturated(mocker):
+    mocker.patch("security.hashing_pool", security.HashingPool(workers=1, max_pending=0))
+
+    with pytest.raises(security.HTTPException) as e:
+        await security.get_password_hash_async("password")
+
+    assert e.value.status_code == 503
+    assert security.hashing_pool.stats()["rejected"] == 1
+
+
 @pytest.mark.anyio
 async def test_get_user(registered_user: dict):
     user = await security.get_user(registered_user["email"])
@@ -42,6 +63,68 @@ async def test_authenticate_user(registered_user: dict):
     assert user.email == registered_user["email"]
 
 
+@pytest.fixture()
+def hash_policy(mocker):
+    # the context is built from the settings once, built again with the patched ones
+    def change(schemes: list[str], rounds: int | None):
+        mocker.patch.object(config, "PASSWORD_HASH_SCHEMES", schemes)
+        mocker.patch.object(config, "PASSWORD_HASH_ROUNDS", rounds)
+        security.pwd_context.reset()
+
+    yield change
+    security.pwd_context.reset()
+
+
+async def stored_password(email: str) -> str:
+    query = sqlalchemy.select(user_table.c.password).where(user_table.c.email == email)
+    return await database.fetch_val(query)
+
+
+@pytest.mark.anyio
+async def test_authenticate_user_rehashes_outdated_cost(registered_user: dict, hash_policy):
+    assert (await stored_password(registered_user["email"])).startswith("$2b$04$")
+    hash_policy(["bcrypt"], 5)
+
+    await security.authenticate_user(registered_user["email"], registered_user["password"])
+
+    new_hash = await stored_password(registered_user["email"])
+    assert new_hash.startswith("$2b$05$")
+    assert security.verify_password(registered_user["password"], new_hash)
+    # same cost now, nothing to upgrade
+    await security.authenticate_user(registered_user["email"], registered_user["password"])
+    assert await stored_password(registered_user["email"]) == new_hash
+
+
+@pytest.mark.anyio
+async def test_authenticate_user_rehashes_deprecated_scheme(registered_user: dict, hash_policy):
+    hash_policy(["pbkdf2_sha256", "bcrypt"], None)
+
+    await security.authenticate_user(registered_user["email"], registered_user["password"])
+
+    assert (await stored_password(registered_user["email"])).startswith("$pbkdf2-sha256$")
+
+
+@pytest.mark.anyio
+async def test_authenticate_user_wrong_password_keeps_hash(registered_user: dict, hash_policy):
+    old_hash = await stored_password(registered_user["email"])
+    hash_policy(["bcrypt"], 5)
+
+    with pytest.raises(security.HTTPException):
+        await security.authenticate_user(registered_user["email"], "wrong-password")
+
+    assert await stored_password(registered_user["email"]) == old_hash
+
+
+def test_calibrate_rounds():
+    # nothing is fast enough: the cheapest cost
+    assert security.calibrate_rounds("bcrypt", target_seconds=0, samples=1)[0] == 4
+    rounds, elapsed = security.calibrate_rounds("pbkdf2_sha256", target_seconds=0.005, samples=1)
+    assert rounds >= 1 and elapsed > 0
+
+    with pytest.raises(ValueError):
+        security.calibrate_rounds("plaintext", target_seconds=0.1)
+
+
 @pytest.mark.anyio
 async def test_authenticate_user_not_found():
     with pytest.raises(security.HTTPException):
@@ -65,3 +148,35 @@ async def test_get_current_user(registered_user: dict):
 async def test_get_current_user_invalid_token():
     with pytest.raises(security.HTTPException):
         await security.get_current_user("invalid token")
+
+
+
+@pytest.mark.anyio
+async def test_get_current_user_is_cached(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"], registered_user["id"])
+    await security.get_current_user(token)
+    spy = mocker.spy(security, "get_user")
+
+    user = await security.get_current_user(token)
+
+    assert user.email == registered_user["email"]
+    spy.assert_not_called()
+    assert security.user_cache.stats()["hits"] >= 1
+
+
+@pytest.mark.anyio
+async def test_get_current_user_other_account_with_same_email(registered_user: dict):
+    token = security.create_access_token(registered_user["email"], registered_user["id"] + 1)
+
+    with pytest.raises(security.HTTPException):
+        await security.get_current_user(token)
+
+
+@pytest.mark.anyio
+async def test_invalidate_user(registered_user: dict):
+    token = security.create_access_token(registered_user["email"])
+    await security.get_current_user(token)
+
+    security.invalidate_user(registered_user["email"])
+
+    assert security.user_cache.get(registered_user["email"]) is None
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from database import read_database
+from singleflight import SingleFlight
+from tests.routers.test_post import create_post
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_query():
+    flight = SingleFlight()
+    calls = 0
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*(flight.do(("post", 1), query) for _ in range(5)))
+
+    assert results == [1] * 5
+    assert flight.stats() == {"queries": {"post": 1}, "shared": {"post": 4}}
+    assert len(flight) == 0
+    # once it completed, the next caller runs a new query
+    assert await flight.do(("post", 1), query) == 2
+
+
+@pytest.mark.anyio
+async def test_different_keys_run_their_own_query():
+    flight = SingleFlight()
+
+    async def query(value):
+        await asyncio.sleep(0)
+        return value
+
+    assert await asyncio.gather(flight.do(("post", 1), lambda: query(1)), flight.do(("post", 2), lambda: query(2))) \
+        == [1, 2]
+
+
+@pytest.mark.anyio
+async def test_error_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flight.do(("post", 1), query) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flight) == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_caller_does_not_cancel_the_query():
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def query():
+        started.set()
+        await asyncio.sleep(0.01)
+        return "post"
+
+    first = asyncio.create_task(flight.do(("post", 1), query))
+    await started.wait()
+    second = asyncio.create_task(flight.do(("post", 1), query))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "post"
+
+
+@pytest.mark.anyio
+async def test_concurrent_get_post_reads_once(async_client: AsyncClient, logged_in_token: str, mocker):
+    post = await create_post("Post", async_client, logged_in_token)
+    fetch_all = mocker.spy(read_database, "fetch_all")
+
+    responses = await asyncio.gather(*(async_client.get(f"/posts/{post["id"]}") for _ in range(5)))
+
+    assert {response.status_code for response in responses} == {200}
+    assert fetch_all.call_count == 1
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from migrations import migrate
+from storage import ProfiledDatabase, profile_pragmas
+
+pragmas = profile_pragmas(synchronous="NORMAL", cache_size_kib=1024, mmap_size=0, busy_timeout_ms=1000)
+
+
+@pytest.fixture()
+async def profiled_databases(tmp_path):
+    path = tmp_path / "profile.db"
+    migrate(str(path))
+    writer = ProfiledDatabase(f"sqlite:///{path}", pool_size=1, pragmas=pragmas)
+    reader = ProfiledDatabase(f"sqlite:///{path}", pool_size=2, pragmas=pragmas, read_only=True)
+    await writer.connect()
+    await reader.connect()
+    yield writer, reader
+    await reader.disconnect()
+    await writer.disconnect()
+
+
+@pytest.mark.anyio
+async def test_writer_enables_wal(profiled_databases):
+    writer, _ = profiled_databases
+    assert await writer.fetch_val("PRAGMA journal_mode") == "wal"
+    assert await writer.fetch_val("PRAGMA synchronous") == 1  # NORMAL
+
+
+@pytest.mark.anyio
+async def test_reader_is_read_only(profiled_databases):
+    writer, reader = profiled_databases
+    await writer.execute("INSERT INTO users (email, password) VALUES ('test@example.net', '-')")
+
+    assert await reader.fetch_val("SELECT count(*) FROM users") == 1
+    with pytest.raises(sqlite3.OperationalError):
+        await reader.execute("DELETE FROM users")
+
+
+@pytest.mark.anyio
+async def test_connections_are_reused(profiled_databases):
+    _, reader = profiled_databases
+
+    async with reader.connection() as connection:
+        first = connection.raw_connection
+    async with reader.connection() as connection:
+        second = connection.raw_connection
+
+    assert first is second
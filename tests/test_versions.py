@@ -0,0 +1,45 @@
+from versions import Versions, etag_matches
+
+
+def test_bumped_post_gets_a_new_etag():
+    versions = Versions(size=10)
+    etag = versions.post_etag(1)
+
+    versions.bump_posts([2])
+    assert versions.post_etag(1) == etag
+
+    versions.bump_posts([1])
+    assert versions.post_etag(1) != etag
+
+
+def test_forgotten_post_never_keeps_an_old_etag():
+    versions = Versions(size=1)
+    versions.bump_posts([1])
+    etag = versions.post_etag(1)
+
+    versions.bump_posts([1])
+    versions.bump_posts([2])
+
+    # 1 is not remembered anymore, it gets the highest version forgotten
+    assert versions.post_etag(1) != etag
+    assert versions.post(1) == versions.post(3)
+
+
+def test_reset_changes_every_etag():
+    versions = Versions(size=10)
+    etags = [versions.feed_etag(), versions.post_etag(1)]
+
+    versions.reset()
+
+    assert versions.feed_etag() != etags[0]
+    assert versions.post_etag(1) != etags[1]
+
+
+def test_etag_matches():
+    etag = 'W/"abc-feed-1"'
+
+    assert etag_matches(etag, etag)
+    assert etag_matches('"other", "abc-feed-1"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('W/"abc-feed-2"', etag)
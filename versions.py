@@ -0,0 +1,71 @@
+import secrets
+from collections import OrderedDict
+
+from coherence import on_change
+from config import config
+from lazy import Lazy
+
+
+# Version tokens for conditional GETs: every write that changes a post or the feed bumps its version once it's
+# committed, an ETag is the version the response was built from. Comparing the If-None-Match header with the
+# current version answers 304 without touching the database.
+# Versions are taken from a single counter, a post bumped last is always newer than anything served before.
+# Only the `size` posts bumped last are remembered, the others share `_floor` (the highest version forgotten):
+# a forgotten post can get a new ETag it didn't need, never keep an old one after a change.
+class Versions:
+    def __init__(self, size: int):
+        self.size = size
+        # a restart (or reset) starts new tokens, ETags from another process never match
+        self.epoch = secrets.token_hex(4)
+        self._last = 0
+        self._floor = 0
+        self.feed = 0
+        self._posts: OrderedDict[int, int] = OrderedDict()
+
+    def _next(self) -> int:
+        self._last += 1
+        return self._last
+
+    def bump_feed(self):
+        self.feed = self._next()
+
+    def bump_posts(self, post_ids):
+        for post_id in post_ids:
+            self._posts[post_id] = self._next()
+            self._posts.move_to_end(post_id)
+        while len(self._posts) > self.size:
+            _, version = self._posts.popitem(last=False)
+            self._floor = max(self._floor, version)
+
+    def post(self, post_id: int) -> int:
+        return self._posts.get(post_id, self._floor)
+
+    def feed_etag(self) -> str:
+        return f'W/"{self.epoch}-feed-{self.feed}"'
+
+    def post_etag(self, post_id: int) -> str:
+        return f'W/"{self.epoch}-post-{post_id}-{self.post(post_id)}"'
+
+    # every token served so far stops matching, for writes made outside this process
+    def reset(self):
+        self.epoch = secrets.token_hex(4)
+        self._posts.clear()
+        self._floor = self._last
+
+
+versions = Lazy(lambda: Versions(size=config.POST_VERSIONS_SIZE))
+
+
+# we don't know which posts another process changed
+@on_change("feed")
+def drop_versions():
+    versions.reset()
+
+
+# If-None-Match: "*" or a list of ETags, compared weakly (RFC 9110 13.1.2)
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}